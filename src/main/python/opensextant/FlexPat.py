@@ -1,8 +1,38 @@
 # -*- coding: utf-8 -*-
+import hashlib
+import io
+import json
 import os
 import re
+import string
+import sys
+from collections import deque
+from multiprocessing import Pipe, Process
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice, repeat
+from logging import getLogger
+from threading import Lock, local
+from time import perf_counter
+from traceback import format_exc
+from xml.etree import ElementTree
 
 from opensextant import TextMatch, Extractor, reduce_matches
+from opensextant.utility import get_csv_writer
+
+log = getLogger(__name__)
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    # Python 3.10 and older
+    import sre_parse
+    import sre_constants
+
+try:
+    # Optional: guarded scans use the timeout of the regex module, if installed, else a watchdog process.
+    import regex as regex_module
+except ImportError:
+    regex_module = None
 
 
 def resource_for(resource_name):
@@ -47,14 +77,31 @@ class RegexPattern:
         self.family = fam
         self.id = pid
         self.description = desc
-        # Pattern
-        self.regex = None
+        # Pattern. Rules loaded from cache are compiled on first use of .regex
+        self._regex = None
+        self.regex_source = None
         # Ordered group-name list with slots in pattern.
         self.regex_groups = []
         self.version = None
         self.enabled = False
         self.match_classname = None
         self.match_class = None
+        # Prefilter: compiled regexes that must all be found in text for this rule to match. See derive_triggers()
+        self.triggers = []
+        # Pattern compiled with the regex module, for its timeout in guarded mode
+        self.guarded_regex = None
+
+    @property
+    def regex(self):
+        if self._regex is None and self.regex_source is not None:
+            self._regex = re.compile(self.regex_source, re.IGNORECASE)
+        return self._regex
+
+    @regex.setter
+    def regex(self, rx):
+        self._regex = rx
+        self.regex_source = None
+        self.guarded_regex = None
 
     def __str__(self):
         return "{}, Pattern: {}".format(self.id, self.regex)
@@ -70,8 +117,22 @@ class PatternMatch(TextMatch):
     LOWER_CASE = 2
     FOUND_CASE = 0
 
-    def __init__(self, *args, pattern_id=None, label=None, match_groups=None):
+    def __init__(self, *args, pattern_id=None, label=None, match_groups=None, match=None, slot_names=None,
+                 surrounding=0):
+        """
+        :param args: text, start, end
+        :param pattern_id: rule id
+        :param label: rule family
+        :param match_groups: list of slots, (group, value, start, end)
+        :param match: raw regex match, from which match_groups, with slot_names,
+            and pre_text/post_text, with surrounding length, are derived on first access instead.
+        :param slot_names: ordered group names of the rule
+        :param surrounding: length of pre_text, post_text to derive from match
+        """
         TextMatch.__init__(self, *args, label=label)
+        self._match = match
+        self._slot_names = slot_names
+        self._surrounding = surrounding if match is not None else 0
         # Normalized text match is NONE until normalize() is run.
         self.textnorm = None
         self.pattern_id = pattern_id
@@ -86,11 +147,73 @@ class PatternMatch(TextMatch):
 
         # Optionally -- back fill as much surrounding text as you want for
         # normalizer/validator routines. Use pre_text, post_text
-        self.pre_text = None
-        self.post_text = None
+        self._pre_text = None
+        self._post_text = None
         if self.pattern_id and "-" in self.pattern_id:
             self.variant_id = self.pattern_id.split("-", 1)[1]
 
+    @property
+    def match_groups(self):
+        if self._match_groups is None and self._match is not None:
+            self._match_groups = _digest_sub_groups(self._match, self._slot_names)
+        return self._match_groups
+
+    @match_groups.setter
+    def match_groups(self, groups):
+        self._match_groups = groups
+
+    @property
+    def pre_text(self):
+        if self._surrounding:
+            self._add_deferred_text()
+        return self._pre_text
+
+    @pre_text.setter
+    def pre_text(self, t):
+        self._pre_text = t
+
+    @property
+    def post_text(self):
+        if self._surrounding:
+            self._add_deferred_text()
+        return self._post_text
+
+    @post_text.setter
+    def post_text(self, t):
+        self._post_text = t
+
+    def _add_deferred_text(self):
+        m = self._match
+        length = self._surrounding
+        self._surrounding = 0
+        text = m.string
+        x1, x2 = m.start(), m.end()
+        if x1 > 0:
+            self._pre_text = text[max(0, x1 - length):x1]
+        if x2 > 0:
+            self._post_text = text[x2:x2 + length]
+
+    def release_match(self):
+        """
+        Derive match_groups and surrounding text now and drop the raw regex match, with its hold on the text.
+        """
+        if self._match is not None:
+            if self._match_groups is None:
+                self._match_groups = _digest_sub_groups(self._match, self._slot_names)
+            if self._surrounding:
+                self._add_deferred_text()
+            self._match = None
+
+    def __getstate__(self):
+        # Raw regex matches do not pickle
+        self.release_match()
+        slots = {}
+        for cls in type(self).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(self, name):
+                    slots[name] = getattr(self, name)
+        return self.__dict__, slots
+
     def __str__(self):
         return f"({self.label}) {self.text}"
 
@@ -132,6 +255,13 @@ class PatternMatch(TextMatch):
         :return:
         """
         default_attrs = {"method": self.pattern_id}
+        if self._match_groups is None and self._match is not None:
+            # Values straight from the raw match
+            values = self._match.groups()
+            if len(values) > len(self._slot_names):
+                raise Exception("Unexpected -- more slots found than groups in pattern.")
+            default_attrs.update(zip(self._slot_names, values))
+            return default_attrs
         for (k, v, x1, x2) in self.match_groups:
             default_attrs[k] = v
         return default_attrs
@@ -181,6 +311,120 @@ class PatternTestCase:
         self.true_positive = True
 
 
+_REPEATS = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT, getattr(sre_constants, "POSSESSIVE_REPEAT", None)}
+_COMMON_CHARS = set(string.ascii_letters + string.whitespace)
+
+
+def _class_atoms(items):
+    """ Characters of a [class] as (op, value) atoms, or None if the class is too broad to be a trigger """
+    atoms = []
+    for op, av in items:
+        if op is sre_constants.LITERAL:
+            atoms.append((op, av))
+        elif op is sre_constants.RANGE:
+            atoms.append((op, av))
+        elif op is sre_constants.CATEGORY and av is sre_constants.CATEGORY_DIGIT:
+            atoms.append((op, av))
+        else:
+            # Negated classes, spaces, word characters, etc.
+            return None
+    return frozenset(atoms)
+
+
+def _atom_chars(atom):
+    op, av = atom
+    if op is sre_constants.LITERAL:
+        return [chr(av)]
+    if op is sre_constants.RANGE:
+        return [chr(c) for c in range(av[0], min(av[1], av[0] + 1000) + 1)]
+    return list(string.digits)
+
+
+def _trigger_rank(atoms):
+    """ Rarer character sets first:  fewer common (ASCII letter, space) characters, then smaller sets """
+    chars = [ch for atom in atoms for ch in _atom_chars(atom)]
+    return len([ch for ch in chars if ch in _COMMON_CHARS]), len(chars)
+
+
+def _required_atoms(parsed):
+    """
+    Character sets that any match of the parsed regex must include, one character of each.
+    Optional, zero-width and backreference items require nothing.
+    """
+    required = []
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            required.append(frozenset([(op, av)]))
+        elif op is sre_constants.IN:
+            atoms = _class_atoms(av)
+            if atoms:
+                required.append(atoms)
+        elif op in _REPEATS:
+            if av[0] >= 1:
+                required.extend(_required_atoms(av[2]))
+        elif op is sre_constants.SUBPATTERN:
+            required.extend(_required_atoms(av[-1]))
+        elif op is getattr(sre_constants, "ATOMIC_GROUP", None):
+            required.extend(_required_atoms(av))
+        elif op is sre_constants.BRANCH:
+            # Each alternative requires one of its own sets
+            alternatives = [_required_atoms(alt) for alt in av[1]]
+            if all(alternatives):
+                required.append(frozenset().union(*[min(alt, key=_trigger_rank) for alt in alternatives]))
+    return required
+
+
+def _trigger_class(atoms):
+    parts = []
+    for op, av in sorted(atoms, key=str):
+        if op is sre_constants.LITERAL:
+            parts.append(re.escape(chr(av)))
+        elif op is sre_constants.RANGE:
+            parts.append("{}-{}".format(re.escape(chr(av[0])), re.escape(chr(av[1]))))
+        else:
+            parts.append("\\d")
+    return "[{}]".format("".join(parts))
+
+
+def derive_triggers(regex, limit=3):
+    """
+    Derive a cheap prefilter for a rule:  character classes that must all appear in a text for the rule to match,
+    e.g., a digit or degree symbol. The rarest sets not overlapping each other are chosen.
+    Derivation is conservative: where a regex construct is not understood, nothing is required of it.
+
+    :param regex: compiled regex
+    :param limit: max number of triggers
+    :return: list of compiled regexes, possibly empty
+    """
+    try:
+        parsed = sre_parse.parse(regex.pattern, regex.flags)
+    except Exception:
+        return []
+    triggers = []
+    chosen = set()
+    for atoms in sorted(set(_required_atoms(parsed)), key=lambda a: (_trigger_rank(a), _trigger_class(a))):
+        chars = {ch for atom in atoms for ch in _atom_chars(atom)}
+        if chars & chosen:
+            # Overlaps a rarer set already chosen, e.g., [0-5] after [01]
+            continue
+        chosen.update(chars)
+        triggers.append(re.compile(_trigger_class(atoms), regex.flags | re.IGNORECASE))
+        if len(triggers) == limit:
+            break
+    return triggers
+
+
+# Bump when the layout of the rule cache changes.
+FLEXPAT_CACHE_VERSION = 1
+
+
+def default_cache_dir():
+    """
+    Folder for the FlexPat rule cache when none is given:  $XPONENTS_FLEXPAT_CACHE if set, else None (no cache)
+    """
+    return os.environ.get("XPONENTS_FLEXPAT_CACHE") or None
+
+
 def get_config_file(cfg, modfile):
     """
     Locate a resource file that is collocated with the python module, e.g., get_config_file("file.cfg", __file__)
@@ -202,9 +446,21 @@ class RegexPatternManager:
 
     """
 
-    def __init__(self, patterns_cfg, module_file=None, debug=False, testing=False):
+    def __init__(self, patterns_cfg, module_file=None, debug=False, testing=False, cache_dir=None):
+        """
+        :param patterns_cfg: patterns config file, path or name of a resource
+        :param module_file: resolve the config file relative to this module file
+        :param debug:
+        :param testing: True to load #TEST cases
+        :param cache_dir: folder for the cache of expanded rules, keyed by a hash of the config file.
+                          Caching is opt-in:  None uses default_cache_dir(), i.e. $XPONENTS_FLEXPAT_CACHE if set,
+                          otherwise no cache;  False to not cache.  Only the expanded regex sources, slot groups
+                          and trigger sources are cached -- rules are still compiled lazily, on first use.
+        """
         self.families = set([])
         self.patterns = {}
+        # Prefilters from #TRIGGER <family> * <regex>
+        self.family_triggers = {}
         self.patterns_file = patterns_cfg
         if module_file:
             # Resolve this absolute path now.
@@ -217,6 +473,8 @@ class RegexPatternManager:
         self.match_class_registry = {}
         self.testing = testing
         self.debug = debug
+        self.cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+        self.cache_file = None
         self._initialize()
 
     def get_pattern(self, pid):
@@ -258,6 +516,51 @@ class RegexPatternManager:
             if pat.id.startswith(some):
                 pat.enabled = flag
 
+    def _cache_path(self, content: bytes):
+        """
+        Cache file for the given config content. Key covers the content, cache layout and Python version,
+        as the expanded rules and derived triggers depend on the re module.
+        """
+        key = hashlib.sha256(content)
+        key.update("v{} py{}.{}".format(FLEXPAT_CACHE_VERSION, *sys.version_info[0:2]).encode("UTF-8"))
+        basename = os.path.splitext(os.path.basename(self.patterns_file))[0]
+        return os.path.join(self.cache_dir, "{}-{}.json".format(basename, key.hexdigest()[0:16]))
+
+    def _load_cache(self):
+        """
+        :return: dict of rules by rule key, each with expanded "pattern", slot "groups" and derived "triggers";
+                 None if not cached or unreadable.
+        """
+        if not self.cache_file or not os.path.exists(self.cache_file):
+            return None
+        try:
+            with open(self.cache_file, "r", encoding="UTF-8") as fh:
+                return json.load(fh).get("rules")
+        except Exception as err:
+            log.debug("FlexPat cache ignored %s: %s", self.cache_file, err)
+            return None
+
+    def _save_cache(self, rules: dict):
+        """
+        Write cache atomically and remove stale caches of the same config file. Failure here is not fatal.
+        """
+        folder = os.path.dirname(self.cache_file)
+        stale = re.compile(re.escape(os.path.basename(self.cache_file).rsplit("-", 1)[0]) + "-[0-9a-f]{16}[.]json")
+        tmp = "{}.{}.tmp".format(self.cache_file, os.getpid())
+        try:
+            os.makedirs(folder, exist_ok=True)
+            with open(tmp, "w", encoding="UTF-8") as fh:
+                json.dump({"version": FLEXPAT_CACHE_VERSION, "rules": rules}, fh)
+            os.replace(tmp, self.cache_file)
+            for fname in os.listdir(folder):
+                fpath = os.path.join(folder, fname)
+                if stale.fullmatch(fname) and fpath != self.cache_file:
+                    os.remove(fpath)
+        except OSError as err:
+            log.debug("FlexPat cache not saved %s: %s", self.cache_file, err)
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
     def _initialize(self):
         """
         :raise Exception if item not found.
@@ -268,6 +571,8 @@ class RegexPatternManager:
         # the  # RULE statements as name and a sequence of DEFINES and regex bits
         defines = {}
         rules = {}
+        triggers = {}
+        self.family_triggers = {}
         # Preserve order
         rule_order = []
         # Record pattern setup and validation messages
@@ -283,8 +588,18 @@ class RegexPatternManager:
             raise FileNotFoundError("Tried various absolute and inferred paths for the file '{}'".format(
                 os.path.basename(self.patterns_file)))
 
-        # PY3:
-        with open(config_fpath, "r", encoding="UTF-8") as fh:
+        with open(config_fpath, "rb") as fh:
+            content = fh.read()
+        self.patterns_file_path = config_fpath
+        cached = None
+        if self.cache_dir:
+            self.cache_file = self._cache_path(content)
+            cached = self._load_cache()
+        # Rules as expanded and compiled, to be saved if not yet cached.
+        expanded = {}
+
+        # PY3: newline=None reads lines as text mode open() would.
+        with io.StringIO(content.decode("UTF-8"), newline=None) as fh:
             testcount = 0
             for line in fh:
                 stmt = line.strip()
@@ -307,6 +622,16 @@ class RegexPatternManager:
 
                     rules[ruleKey] = rulePattern
                     rule_order.append(ruleKey)
+                elif line.startswith("#TRIGGER"):
+                    # #TRIGGER<tab><rule_fam><tab><rule_id or *><tab><regex>
+                    # Regex that must be found in text for the rule (or any rule in family, *) to match.
+                    fields = re.split("[\t ]+", stmt, 3)
+                    fam = fields[1]
+                    trigger = re.compile(fields[3], re.IGNORECASE)
+                    if fields[2] == "*":
+                        self.family_triggers[fam] = trigger
+                    else:
+                        triggers[fam + "-" + fields[2]] = trigger
                 elif self.testing and stmt.startswith("#TEST"):
                     fields = re.split("[\t ]+", stmt, 3)
                     testcount += 1
@@ -326,9 +651,6 @@ class RegexPatternManager:
                 else:
                     pass
 
-        elementRegex = "<[a-zA-Z0-9_]+>"
-        elementPattern = re.compile(elementRegex)
-
         for tmpkey in rule_order:
             tmpRulePattern = rules.get(tmpkey)
             fam, rule_name = tmpkey.split("-", 1)
@@ -347,43 +669,71 @@ class RegexPatternManager:
                 except Exception as err:
                     print(err)
 
-            # find all of the element definitions within the pattern
-            groupNum = 1
-            for m in elementPattern.finditer(tmpRulePattern):
-                e1 = m.start()
-                e2 = m.end()
-                elementName = tmpRulePattern[e1 + 1: e2 - 1]
-                pat.regex_groups.append(elementName)
-
-                if self.debug:
-                    subelementPattern = defines.get(elementName)
-                    configMessages.append("\n\t")
-                    configMessages.append("{} {} = {}".format(groupNum, elementName, subelementPattern))
-                groupNum += 1
-
-            for slot_name in set(pat.regex_groups):
-                if slot_name not in defines:
-                    raise Exception("Slot definition is not DEFINED for " + slot_name)
-
-                tmpDef = defines[slot_name]
-                # NOTE:  Use of parens, "(expr)", is required to create groups within a pattern.
-                tmpDefPattern = "({})".format(tmpDef)
-                tmpDefSlot = "<{}>".format(slot_name)
-                # Replaces all.
-                tmpRulePattern = tmpRulePattern.replace(tmpDefSlot, tmpDefPattern)
-
-            if self.debug:
-                configMessages.append("\nrulepattern=" + tmpRulePattern)
-
-            pat.regex = re.compile(tmpRulePattern, re.IGNORECASE)
+            entry = cached.get(tmpkey) if cached else None
+            if entry:
+                # Expanded and validated on an earlier load; compiled on first use.
+                pat.regex_groups = entry["groups"]
+                pat.regex_source = entry["pattern"]
+                derived = [re.compile(t, re.IGNORECASE) for t in entry["triggers"]]
+            else:
+                derived = self._expand_rule(pat, tmpRulePattern, defines, tmpkey in triggers, configMessages)
+                expanded[tmpkey] = {"pattern": pat.regex.pattern, "groups": pat.regex_groups,
+                                    "triggers": [t.pattern for t in derived]}
+
+            if tmpkey in triggers:
+                pat.triggers = [triggers[tmpkey]]
+            else:
+                pat.triggers = derived
             pat.enabled = True
             self.patterns[pat.id] = pat
             if not self.validate_pattern(pat):
                 raise Exception("Invalid Pattern " + str(pat))
 
+        if self.cache_file and not cached:
+            self._save_cache(expanded)
+
         if self.debug:
             configMessages.append("\nFound # of PATTERNS={}".format(len(self.patterns)))
 
+    def _expand_rule(self, pat, tmpRulePattern, defines, has_trigger, configMessages):
+        """
+        Fill in the slots of a #RULE with the #DEFINE patterns and compile it.
+        :return: triggers derived for the rule, unless it has an explicit #TRIGGER
+        """
+        # find all of the element definitions within the pattern
+        elementPattern = re.compile("<[a-zA-Z0-9_]+>")
+        groupNum = 1
+        for m in elementPattern.finditer(tmpRulePattern):
+            e1 = m.start()
+            e2 = m.end()
+            elementName = tmpRulePattern[e1 + 1: e2 - 1]
+            pat.regex_groups.append(elementName)
+
+            if self.debug:
+                subelementPattern = defines.get(elementName)
+                configMessages.append("\n\t")
+                configMessages.append("{} {} = {}".format(groupNum, elementName, subelementPattern))
+            groupNum += 1
+
+        for slot_name in set(pat.regex_groups):
+            if slot_name not in defines:
+                raise Exception("Slot definition is not DEFINED for " + slot_name)
+
+            tmpDef = defines[slot_name]
+            # NOTE:  Use of parens, "(expr)", is required to create groups within a pattern.
+            tmpDefPattern = "({})".format(tmpDef)
+            tmpDefSlot = "<{}>".format(slot_name)
+            # Replaces all.
+            tmpRulePattern = tmpRulePattern.replace(tmpDefSlot, tmpDefPattern)
+
+        if self.debug:
+            configMessages.append("\nrulepattern=" + tmpRulePattern)
+
+        pat.regex = re.compile(tmpRulePattern, re.IGNORECASE)
+        if has_trigger:
+            return []
+        return derive_triggers(pat.regex)
+
 
 def _digest_sub_groups(m, pattern_groups):
     """
@@ -405,6 +755,307 @@ def _digest_sub_groups(m, pattern_groups):
     return slots
 
 
+def _trigger_found(trigger, text, found: dict):
+    """ Search text for trigger, once per text. found caches results by trigger """
+    if trigger is None:
+        return True
+    key = trigger.pattern
+    if key not in found:
+        found[key] = trigger.search(text) is not None
+    return found[key]
+
+
+def _any_trigger(rules):
+    """ Family trigger, found if the first trigger of any rule is found """
+    if not all(pat.triggers for pat in rules):
+        return None
+    sources = sorted({pat.triggers[0].pattern for pat in rules})
+    return re.compile("|".join(sources), re.IGNORECASE)
+
+
+class ScanPlan:
+    """
+    Enabled rules grouped by family, in configuration order, for a given list of families.
+    With triggers, families and rules whose trigger is not found in the text are skipped.
+    Results are the same with or without triggers.
+    """
+
+    def __init__(self, features, patterns, triggers=True, family_triggers=None):
+        """
+        :param features: families to scan for
+        :param patterns: list of RegexPattern
+        :param triggers: True to prefilter with rule triggers
+        :param family_triggers: optional dict of explicit family triggers
+        """
+        self.use_triggers = triggers
+        self.families = []
+        self.family_triggers = {}
+        for fam in features:
+            rules = [pat for pat in patterns if pat.family == fam and pat.enabled]
+            if not rules:
+                continue
+            self.families.append((fam, rules))
+            if triggers:
+                trigger = (family_triggers or {}).get(fam) or _any_trigger(rules)
+                if trigger:
+                    self.family_triggers[fam] = trigger
+
+    def rules(self, text):
+        """
+        Rules to apply to the text, skipping families and rules that cannot match.
+        :param text: text to scan
+        :return: generator of RegexPattern
+        """
+        found = {}
+        for fam, rules in self.families:
+            if not _trigger_found(self.family_triggers.get(fam), text, found):
+                continue
+            if self.use_triggers:
+                rules = [pat for pat in rules if all([_trigger_found(t, text, found) for t in pat.triggers])]
+                if not rules:
+                    continue
+            for pat in rules:
+                yield pat
+
+
+class RuleProfile:
+    """
+    Per-rule statistics gathered by PatternExtractor.extract_patterns() while set as the extractor's profile:
+    scans of text, wall time (finditer, match objects and normalize), finditer hits,
+    hits omitted by normalize(), matches later filtered out as duplicates or submatches
+    and scans stopped for going over the time limit of guarded mode.
+
+        pex.profile = RuleProfile()
+        ... extract ...
+        pex.profile.write_csv("rule_profile.csv")
+
+    Process workers in extract_many() profile their own copy of the extractor;  use threads to profile there.
+    """
+    FIELDS = ["rule", "family", "scans", "seconds", "hits", "omitted", "filtered_out", "timeouts"]
+
+    def __init__(self):
+        # rule id => [family, scans, seconds, hits, omitted, filtered_out, timeouts]
+        self.rules = {}
+        self._lock = Lock()
+
+    def __getstate__(self):
+        return {"rules": self.rules}
+
+    def __setstate__(self, state):
+        self.rules = state["rules"]
+        self._lock = Lock()
+
+    def record(self, pat, seconds, hits, omitted, filtered, timed_out=False):
+        with self._lock:
+            stats = self.rules.get(pat.id)
+            if not stats:
+                stats = self.rules[pat.id] = [pat.family, 0, 0.0, 0, 0, 0, 0]
+            stats[1] += 1
+            stats[2] += seconds
+            stats[3] += hits
+            stats[4] += omitted
+            stats[5] += filtered
+            if timed_out:
+                stats[6] += 1
+
+    def reset(self):
+        with self._lock:
+            self.rules.clear()
+
+    def as_dict(self, by="rule"):
+        """
+        :param by: "rule" or "family" to sum rules of a family
+        :return: dict of stats by rule id or family, in order of most time spent.
+        """
+        report = {}
+        with self._lock:
+            for pid, (fam, scans, seconds, hits, omitted, filtered, timeouts) in self.rules.items():
+                key = pid if by == "rule" else fam
+                stats = report.get(key)
+                if not stats:
+                    stats = report[key] = {"family": fam, "scans": 0, "seconds": 0.0, "hits": 0, "omitted": 0,
+                                           "filtered_out": 0, "timeouts": 0}
+                stats["scans"] += scans
+                stats["seconds"] += seconds
+                stats["hits"] += hits
+                stats["omitted"] += omitted
+                stats["filtered_out"] += filtered
+                stats["timeouts"] += timeouts
+        return dict(sorted(report.items(), key=lambda item: -item[1]["seconds"]))
+
+    def write_csv(self, fpath, by="rule"):
+        """
+        Write report as CSV
+        :param fpath: file path or text file handle
+        :param by: rule or family
+        """
+        columns = self.FIELDS if by == "rule" else self.FIELDS[1:]
+        if hasattr(fpath, "write"):
+            self._write_csv(fpath, columns, by)
+        else:
+            with open(fpath, "w", encoding="UTF-8") as fh:
+                self._write_csv(fh, columns, by)
+
+    def _write_csv(self, fh, columns, by):
+        writer = get_csv_writer(fh, columns)
+        writer.writeheader()
+        for key, stats in self.as_dict(by=by).items():
+            row = dict(stats)
+            if by == "rule":
+                row["rule"] = key
+            row["seconds"] = "{:.6f}".format(stats["seconds"])
+            writer.writerow(row)
+
+
+# Extractor for worker processes of PatternExtractor.extract_many(), set once as each worker starts.
+_worker_extractor = None
+
+
+def _init_extract_worker(extractor):
+    global _worker_extractor
+    _worker_extractor = extractor
+
+
+def _run_test_case(t, scope):
+    return _worker_extractor._test_case(t, scope)
+
+
+def _extract_batch(batch, kwargs, extractor=None):
+    """
+    :return: list of (matches, error) for each text in batch
+    """
+    if extractor is None:
+        extractor = _worker_extractor
+    results = []
+    for text in batch:
+        try:
+            results.append((extractor.extract(text, **kwargs), None))
+        except Exception:
+            results.append((None, format_exc(limit=5)))
+    return results
+
+
+class RuleTimeout(Exception):
+    """ A rule went over its time limit in guarded mode """
+    pass
+
+
+class _SpanMatch:
+    """
+    Stand-in for re.Match rebuilt from the group spans, m.regs, found by the watchdog process.
+    """
+
+    def __init__(self, text, regs):
+        self.string = text
+        self.regs = regs
+
+    def group(self, i=0):
+        x1, x2 = self.regs[i]
+        return self.string[x1:x2] if x1 >= 0 else None
+
+    def groups(self):
+        return tuple([self.group(i) for i in range(1, len(self.regs))])
+
+    def start(self, i=0):
+        return self.regs[i][0]
+
+    def end(self, i=0):
+        return self.regs[i][1]
+
+    def span(self, i=0):
+        return self.regs[i]
+
+
+def _watchdog_worker(conn):
+    """
+    Watchdog process:  scan the last text sent with the rule sent, reply with the spans of each match.
+    """
+    text = None
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            return
+        if msg[0] == "text":
+            text = msg[1]
+        else:
+            source, flags = msg[1:]
+            conn.send([m.regs for m in re.compile(source, flags).finditer(text)])
+
+
+class _Watchdog:
+    """
+    Runs regex scans in a child process that can be killed when a scan goes over its time limit.
+    """
+
+    def __init__(self):
+        # Process that owns the watchdog;  a forked copy does not, see _guarded_finditer()
+        self.pid = os.getpid()
+        self.process = None
+        self.conn = None
+        self.text = None
+
+    def start(self):
+        self.conn, child = Pipe()
+        self.process = Process(target=_watchdog_worker, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self):
+        if self.process:
+            self.process.kill()
+            self.process.join()
+            self.conn.close()
+        self.process = None
+        self.conn = None
+        self.text = None
+
+    def finditer(self, regex, text, timeout):
+        """
+        A new text is pickled through the pipe to the child, once;  further rules on the same text only send
+        the rule.  After a timeout the replacement child is sent the text again.
+        :return: list of matches, as for regex.finditer(text)
+        :raise RuleTimeout: if the scan took more than timeout seconds.  The child process is replaced.
+        """
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            self.start()
+        if text is not self.text:
+            self.conn.send(("text", text))
+            self.text = text
+        self.conn.send(("scan", regex.pattern, regex.flags))
+        if not self.conn.poll(timeout):
+            self.stop()
+            raise RuleTimeout()
+        return [_SpanMatch(text, regs) for regs in self.conn.recv()]
+
+
+# Watchdog for each thread, started on first use of guarded mode.
+_watchdogs = local()
+
+
+def _guarded_finditer(pat, text, timeout):
+    """
+    Matches for the rule, scanning for at most timeout seconds.
+    :return: list of matches
+    :raise RuleTimeout:
+    """
+    if regex_module:
+        rx = pat.guarded_regex
+        if rx is None:
+            rx = pat.guarded_regex = regex_module.compile(pat.regex.pattern, pat.regex.flags | regex_module.VERSION0)
+        try:
+            return list(rx.finditer(text, timeout=timeout))
+        except TimeoutError:
+            raise RuleTimeout()
+
+    watchdog = getattr(_watchdogs, "watchdog", None)
+    if watchdog is None or watchdog.pid != os.getpid():
+        # The watchdog of a parent process is inherited by fork, but is not this process's child to use.
+        watchdog = _watchdogs.watchdog = _Watchdog()
+    return watchdog.finditer(pat.regex, text, timeout)
+
+
 class PatternExtractor(Extractor):
     """
         Discussion: Read first https://opensextant.github.io/Xponents/doc/Patterns.md
@@ -431,6 +1082,9 @@ class PatternExtractor(Extractor):
         for result in test_results:
             print(repr(result))
 
+        # Or across processes, with timings and a JUnit report; tests over 0.5 seconds are flagged SLOW
+        test_results = pex.run_tests(workers=4, slow=0.5, report="flexpat-tests.xml", report_format="junit")
+
         # RUN
         #=====================
         real_results = pex.extract(".... text blob 1-800-123-4567...")
@@ -441,7 +1095,7 @@ class PatternExtractor(Extractor):
         ```
     """
 
-    def __init__(self, pattern_manager):
+    def __init__(self, pattern_manager, triggers=True, rule_timeout=None):
         """
         invoke RegexPatternManager(your_cfg_file) or implement a custom RegexPatternManager (rare).
         NOTE - `PatternsOfLifeManager` is a  particular subclass of RegexPatternManager becuase
@@ -449,67 +1103,219 @@ class PatternExtractor(Extractor):
         The `CLASS` names unfortunately are specific to Python or Java.
 
         :param pattern_manager: RegexPatternManager
+        :param triggers: skip rules whose trigger, derived or from #TRIGGER in config, is not in the text.
+        :param rule_timeout: guarded mode, seconds each rule may scan a text for. A rule that takes longer
+            is skipped for that text and reported, in `timeouts` and the profile. Guarded scans use the timeout
+            of the `regex` module if installed, else they run in a watchdog process, one per thread,
+            that is killed and replaced when a rule runs over.  The watchdog is sent a pickled copy of each text
+            it scans, once per call of extract(), and the spans of matches back, so without `regex` guarded mode
+            costs a copy of every document and a round trip per rule;  it is meant for untrusted or
+            pathological input rather than bulk extraction.
         """
         Extractor.__init__(self)
         self.id = "xpx"
         self.name = "Xponents Pattern Extractor"
         self.pattern_manager = pattern_manager
+        self.triggers = triggers
+        self._plans = {}
+        # Set to a RuleProfile to gather statistics for each rule.
+        self.profile = None
+        self.rule_timeout = rule_timeout
+        # Count of texts each rule was stopped on for going over rule_timeout
+        self.timeouts = {}
 
     def extract(self, text, **kwargs):
         """ Default Extractor API. """
         return self.extract_patterns(text, **kwargs)
 
+    def extract_many(self, docs, workers=2, executor="process", batch_size=16, **kwargs):
+        """
+        Extract from many texts with a pool of workers.  Process workers receive a copy of this extractor,
+        compiled patterns included, once as they start; thread workers share it.
+        Results stream back in the order of docs, with a bounded number of batches in flight.
+        A failure on one text does not stop the others:  it is reported as the error for that text.
+
+        :param docs: iterable of texts
+        :param workers: pool size; 1 or less extracts in this process
+        :param executor: process or thread
+        :param batch_size: texts sent to a worker at a time
+        :param kwargs: as for extract(), e.g., features
+        :return: generator of (matches, error) for each text; error is None or the formatted exception
+        """
+        docs_iter = iter(docs)
+        batches = iter(lambda: list(islice(docs_iter, batch_size)), [])
+        if workers <= 1:
+            for batch in batches:
+                yield from _extract_batch(batch, kwargs, extractor=self)
+            return
+
+        if executor == "process":
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker, initargs=(self,))
+            extractor = None
+        elif executor == "thread":
+            pool = ThreadPoolExecutor(max_workers=workers)
+            extractor = self
+        else:
+            raise Exception("Unknown executor " + executor)
+
+        pending = deque()
+        try:
+            for batch in batches:
+                pending.append(pool.submit(_extract_batch, batch, kwargs, extractor=extractor))
+                if len(pending) >= 2 * workers:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def extract_stream(self, file_or_iter, chunk_size=1048576, overlap=1024, **kwargs):
+        """
+        Extract from a text stream too large to hold in memory, scanning windows of about chunk_size characters.
+        Each window repeats `overlap` characters of text on either side, so matches have the context they
+        would have in the full text;  a match belongs to the window in which it starts. Offsets are absolute.
+        Matches of a rule that begin inside an earlier match of that rule, as found on the other side of a window
+        boundary, are dropped. Set overlap greater than the longest expected match plus its surrounding text.
+
+        :param file_or_iter: file opened in text mode, or iterable of str, e.g., lines
+        :param chunk_size: window size in characters, not counting overlap
+        :param overlap: characters of context shared by adjacent windows
+        :param kwargs: as for extract(), e.g., features
+        :return: generator of matches
+        """
+        if isinstance(file_or_iter, str):
+            raise Exception("Stream expected; use extract() for text")
+        if overlap <= 0 or chunk_size <= overlap:
+            raise Exception("chunk_size must be greater than overlap, and overlap greater than 0")
+        if hasattr(file_or_iter, "read"):
+            pieces = iter(lambda: file_or_iter.read(chunk_size), "")
+        else:
+            pieces = iter(file_or_iter)
+
+        buffer = ""
+        offset = 0  # Absolute offset of buffer
+        own = 0  # Matches starting in buffer[own:limit] belong to this window.
+        last_end = {}
+        eof = False
+        while not eof:
+            while len(buffer) - own < chunk_size + overlap:
+                piece = next(pieces, None)
+                if piece is None:
+                    eof = True
+                    break
+                buffer += piece
+            limit = len(buffer) if eof else len(buffer) - overlap
+
+            for m in self.extract_patterns(buffer, **kwargs):
+                if not own <= m.start < limit or m.start + offset < last_end.get(m.pattern_id, 0):
+                    continue
+                m.start += offset
+                m.end += offset
+                if m.match_groups:
+                    m.match_groups = [(k, v, x1 + offset if x1 >= 0 else x1, x2 + offset if x2 >= 0 else x2)
+                                      for k, v, x1, x2 in m.match_groups]
+                last_end[m.pattern_id] = max(m.end, last_end.get(m.pattern_id, 0))
+                yield m
+
+            keep = max(0, limit - overlap)
+            buffer = buffer[keep:]
+            offset += keep
+            own = limit - keep
+
+    def scan_plan(self, features=None):
+        """
+        The ScanPlan for the given families, rebuilt only if the patterns or their enabled state change.
+        :param features: list of families, default is all families
+        :return: ScanPlan
+        """
+        if not features:
+            features = self.pattern_manager.families
+        features = tuple(features)
+        patterns = list(self.pattern_manager.patterns.values())
+        state = (self.triggers, tuple([(id(pat), pat.enabled) for pat in patterns]))
+        cached = self._plans.get(features)
+        if cached and cached[0] == state:
+            return cached[1]
+
+        for fam in features:
+            if fam not in self.pattern_manager.families:
+                raise Exception("Uknown Pattern Family " + fam)
+        plan = ScanPlan(features, patterns, triggers=self.triggers,
+                        family_triggers=self.pattern_manager.family_triggers)
+        self._plans[features] = (state, plan)
+        return plan
+
     def extract_patterns(self, text, **kwargs):
         """
         Given some text input, apply all relevant pattern families against the text.
         Surrounding text is added to each match for post-processing.
+        Slots and surrounding text are derived from the raw match only while normalizing;
+        matches returned here no longer reference the text.
         :param text:
         :param kwargs:
         :return:
         """
-        features = kwargs.get("features")
-        if not features:
-            features = self.pattern_manager.families
+        plan = self.scan_plan(kwargs.get("features"))
 
-        tlen = len(text)
         results = []
-        for fam in features:
-            if fam not in self.pattern_manager.families:
-                raise Exception("Uknown Pattern Family " + fam)
-
-            for pat_id in self.pattern_manager.patterns:
-                pat = self.pattern_manager.patterns[pat_id]
-                if not pat.family == fam:
-                    continue
-                if not pat.enabled:
+        profile = self.profile
+        profiled = []
+        timeout = self.rule_timeout
+        for pat in plan.rules(text):
+            if profile is not None:
+                t0 = perf_counter()
+                found = len(results)
+                omitted = 0
+            if timeout:
+                try:
+                    matches = _guarded_finditer(pat, text, timeout)
+                except RuleTimeout:
+                    log.warning("FlexPat rule %s went over time limit; skipped for text of length %d",
+                                pat.id, len(text))
+                    self.timeouts[pat.id] = self.timeouts.get(pat.id, 0) + 1
+                    if profile is not None:
+                        profile.record(pat, perf_counter() - t0, 0, 0, 0, timed_out=True)
                     continue
-
-                for m in pat.regex.finditer(text):
-                    digested_groups = _digest_sub_groups(m, pat.regex_groups)
-                    if pat.match_class:
-                        domainObj = pat.match_class(m.group(), m.start(), m.end(),
-                                                    pattern_id=pat.id,
-                                                    label=pat.family,
-                                                    match_groups=digested_groups)
-                        # surrounding text may be used by normalization and validation
-                        domainObj.add_surrounding_text(text, tlen, length=20)
-                        domainObj.normalize()
-                        if not domainObj.omit:
-                            results.append(domainObj)
-                    else:
-                        genericObj = PatternMatch(m.group(), m.start(), m.end(),
-                                                  pattern_id=pat.id,
-                                                  label=pat.family,
-                                                  match_groups=digested_groups)
-                        genericObj.add_surrounding_text(text, tlen, length=20)
-                        results.append(genericObj)
+            else:
+                matches = pat.regex.finditer(text)
+            for m in matches:
+                # Slots and surrounding text are derived from the raw match if used.
+                if pat.match_class:
+                    domainObj = pat.match_class(m.group(), m.start(), m.end(),
+                                                pattern_id=pat.id,
+                                                label=pat.family,
+                                                match=m, slot_names=pat.regex_groups, surrounding=20)
+                    domainObj.normalize()
+                    if not domainObj.omit:
+                        results.append(domainObj)
+                    elif profile is not None:
+                        omitted += 1
+                else:
+                    genericObj = PatternMatch(m.group(), m.start(), m.end(),
+                                              pattern_id=pat.id,
+                                              label=pat.family,
+                                              match=m, slot_names=pat.regex_groups, surrounding=20)
+                    results.append(genericObj)
+            if profile is not None:
+                profiled.append((pat, perf_counter() - t0, len(results) - found + omitted, omitted))
 
         # Determine if any matches are redundant.  Mark redundancies as "filtered out".
+        # Raw regex matches hold the whole text, so returned matches keep only their own slots and context.
         reduce_matches(results)
         for r in results:
+            r.release_match()
             if r.is_duplicate or r.is_submatch:
                 r.filtered_out = True
 
+        if profiled:
+            # Filtered out by normalize() or as redundant
+            filtered = {}
+            for r in results:
+                if r.filtered_out:
+                    filtered[r.pattern_id] = filtered.get(r.pattern_id, 0) + 1
+            for pat, seconds, hits, omitted in profiled:
+                profile.record(pat, seconds, hits, omitted, filtered.get(pat.id, 0))
+
         return results
 
     def default_tests(self, scope="rule"):
@@ -533,40 +1339,81 @@ class PatternExtractor(Extractor):
         """
         test_results = []
         for t in self.pattern_manager.test_cases:
-            expect_valid_match = "FAIL" not in t.text
             print("Test", t.family, t.text)
-            output1 = self.extract_patterns(t.text, features=[t.family])
+            test_results.append(self._test_case(t, scope))
 
-            output = []
-            for m in output1:
-                if scope == "rule" and not t.id.startswith(m.pattern_id):
-                    continue
-                output.append(m)
-
-            # Determine if pattern matched true positive or false positive.
-            # To condition the TP or FP based on the matches
-            #  keep a running tally of whether each match is filtered or not.
-            # That is, for many matches True Positive = at least one unfiltered match is needed, AND was expected.
-            #          for many matches False Positive = at least one unfiltered match is needed, AND was NOT expected.
-            fpcount = 0
-            tpcount = 0
-            for m in output:
-                allowed = not m.filtered_out or (m.is_duplicate and m.filtered_out)
-                if expect_valid_match and allowed:
-                    tpcount += 1
-                if not expect_valid_match and allowed:
-                    fpcount += 1
-
-            tp = tpcount > 0 and expect_valid_match
-            fp = fpcount > 0 and not expect_valid_match
-            tn = fpcount == 0 and not expect_valid_match
-            fn = tpcount == 0 and expect_valid_match
-            success = (tp or tn) and not (fp or fn)
-            test_results.append({"TEST": t.id,
-                                 "TEXT": t.text,
-                                 "MATCHES": output,
-                                 "PASS": success})
+        return test_results
+
+    def _test_case(self, t, scope):
+        """
+        Run one TEST case, see default_tests()
+        :return: test result with timing of the case, SECONDS
+        """
+        t0 = perf_counter()
+        expect_valid_match = "FAIL" not in t.text
+        output1 = self.extract_patterns(t.text, features=[t.family])
+
+        output = []
+        for m in output1:
+            if scope == "rule" and not t.id.startswith(m.pattern_id):
+                continue
+            output.append(m)
+
+        # Determine if pattern matched true positive or false positive.
+        # To condition the TP or FP based on the matches
+        #  keep a running tally of whether each match is filtered or not.
+        # That is, for many matches True Positive = at least one unfiltered match is needed, AND was expected.
+        #          for many matches False Positive = at least one unfiltered match is needed, AND was NOT expected.
+        fpcount = 0
+        tpcount = 0
+        for m in output:
+            allowed = not m.filtered_out or (m.is_duplicate and m.filtered_out)
+            if expect_valid_match and allowed:
+                tpcount += 1
+            if not expect_valid_match and allowed:
+                fpcount += 1
+
+        tp = tpcount > 0 and expect_valid_match
+        fp = fpcount > 0 and not expect_valid_match
+        tn = fpcount == 0 and not expect_valid_match
+        fn = tpcount == 0 and expect_valid_match
+        success = (tp or tn) and not (fp or fn)
+        return {"TEST": t.id,
+                "TEXT": t.text,
+                "MATCHES": output,
+                "PASS": success,
+                "SECONDS": perf_counter() - t0}
+
+    def run_tests(self, scope="rule", workers=2, slow=0.5, report=None, report_format="json"):
+        """
+        Run TEST cases as default_tests() does, across a pool of worker processes and without printing each case.
+        Tests that take longer than `slow` seconds are flagged SLOW, to catch rules that have become expensive.
+
+        :param scope: rule or ruleset, see default_tests()
+        :param workers: number of processes; 1 or less runs tests in this process
+        :param slow: seconds beyond which a test is flagged SLOW
+        :param report: optional file path for a report of results
+        :param report_format: json or junit
+        :return: test results array in order of TEST cases, as default_tests() with SECONDS and SLOW added
+        """
+        if report_format not in {"json", "junit"}:
+            raise Exception("Unknown report format " + report_format)
+        cases = self.pattern_manager.test_cases
+        if workers <= 1 or len(cases) < 2:
+            test_results = [self._test_case(t, scope) for t in cases]
+        else:
+            chunk = max(1, len(cases) // (4 * workers))
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker,
+                                     initargs=(self,)) as pool:
+                test_results = list(pool.map(_run_test_case, cases, repeat(scope), chunksize=chunk))
 
+        for result in test_results:
+            result["SLOW"] = result["SECONDS"] > slow
+        if report:
+            if report_format == "json":
+                write_test_json(test_results, report)
+            else:
+                write_test_junit(test_results, report, name=self.name, slow=slow)
         return test_results
 
 
@@ -584,3 +1431,46 @@ def print_test(result: dict):
         arr = result["MATCHES"]
         matches = ";".join([match.text for match in arr])
     print(f"TEST: {tid}, TEXT: {txt} PASS:{res}\tMATCHES: {matches}")
+
+
+def _test_matches(result: dict):
+    return [{"text": m.text, "start": m.start, "end": m.end, "pattern_id": m.pattern_id,
+             "filtered_out": m.filtered_out} for m in result["MATCHES"]]
+
+
+def write_test_json(results: list, fpath):
+    """ Write results from run_tests() or default_tests() as JSON
+    """
+    report = []
+    for result in results:
+        item = {k.lower(): v for k, v in result.items() if k != "MATCHES"}
+        item["matches"] = _test_matches(result)
+        report.append(item)
+    with open(fpath, "w", encoding="UTF-8") as fh:
+        json.dump(report, fh, indent=2)
+
+
+def write_test_junit(results: list, fpath, name="FlexPat", slow=None):
+    """ Write results from run_tests() as JUnit XML, one testcase per TEST grouped by rule family.
+    Slow tests are reported as failures of type "slow".
+    """
+    failures = 0
+    cases = []
+    for result in results:
+        case = ElementTree.Element("testcase", classname=result["TEST"].split("-", 1)[0], name=result["TEST"],
+                                   time="{:.6f}".format(result.get("SECONDS", 0)))
+        if not result["PASS"]:
+            failure = ElementTree.SubElement(case, "failure", type="match", message="Unexpected matches")
+            failure.text = "TEXT: {}\nMATCHES: {}".format(result["TEXT"], ";".join(
+                [m["text"] for m in _test_matches(result)]))
+        elif result.get("SLOW"):
+            ElementTree.SubElement(case, "failure", type="slow",
+                                   message="Took {:.3f} s, over {} s".format(result["SECONDS"], slow))
+        if len(case):
+            failures += 1
+        cases.append(case)
+
+    suite = ElementTree.Element("testsuite", name=name, tests=str(len(results)), failures=str(failures),
+                                errors="0", time="{:.6f}".format(sum([r.get("SECONDS", 0) for r in results])))
+    suite.extend(cases)
+    ElementTree.ElementTree(suite).write(fpath, encoding="UTF-8", xml_declaration=True)
@@ -4,13 +4,24 @@ import os
 import re
 import sys
 from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import heappop, heappush
+from itertools import accumulate, groupby
 from logging import getLogger
 from logging.config import dictConfig
-from math import sqrt, sin, cos, radians, atan2, log as mathlog, log10
+from math import sqrt, sin, cos, radians, degrees, asin, atan2, log as mathlog, log10
 
 from opensextant.utility import get_csv_reader, get_bool, get_list, load_datafile
 from pygeodesy.ellipsoidalVincenty import LatLon as LL
-from pygeodesy.geohash import encode as geohash_encode, decode as geohash_decode, neighbors as geohash_neighbors
+from opensextant.geohash import encode as geohash_encode, decode as geohash_decode, neighbors as geohash_neighbors, \
+    decode2 as _geohash_decode2, encode_many as _geohash_encode_many
+
+try:
+    # Optional. Array distance functions use NumPy if present.
+    import numpy as np
+except ImportError:
+    np = None
 
 PY3 = sys.version_info.major == 3
 countries = []
@@ -39,6 +50,8 @@ def logger_config(logger_level: str, pkg: str):
     }
     dictConfig({
         'version': 1,
+        # Keep module loggers created before this call, e.g. opensextant.FlexPat
+        'disable_existing_loggers': False,
         'formatters': {
             'default': {
                 'format': '%(levelname)s in %(module)s: %(message)s',
@@ -148,6 +161,116 @@ def distance_haversine(ddlon1, ddlat1, ddlon2, ddlat2):
     return int(EARTH_RADIUS_WGS84 * c)
 
 
+def distance_cartesian_many(x1, y1, xs, ys):
+    """
+    One-to-many 2-D Cartesian distance from X1, Y1 to each point in the arrays xs, ys.
+    :return: numpy array if NumPy is installed, otherwise array.array of floats
+    """
+    if np is not None:
+        return np.hypot(np.asarray(xs, dtype=float) - x1, np.asarray(ys, dtype=float) - y1)
+    return array("d", [distance_cartesian(x1, y1, x2, y2) for x2, y2 in zip(xs, ys)])
+
+
+def distance_cartesian_pairwise(xs1, ys1, xs2, ys2):
+    """
+    Element-wise 2-D Cartesian distance between points (xs1[i], ys1[i]) and (xs2[i], ys2[i]).
+    :return: numpy array if NumPy is installed, otherwise array.array of floats
+    """
+    if np is not None:
+        return np.hypot(np.asarray(xs2, dtype=float) - np.asarray(xs1, dtype=float),
+                        np.asarray(ys2, dtype=float) - np.asarray(ys1, dtype=float))
+    return array("d", [distance_cartesian(x1, y1, x2, y2) for x1, y1, x2, y2 in zip(xs1, ys1, xs2, ys2)])
+
+
+def distance_cartesian_matrix(xs1, ys1, xs2, ys2):
+    """
+    Many-to-many 2-D Cartesian distance.  Row i holds the distances from point i of (xs1, ys1) to all of (xs2, ys2).
+    :return: 2-D numpy array if NumPy is installed, otherwise a list of array.array rows
+    """
+    if np is not None:
+        x1 = np.asarray(xs1, dtype=float)[:, np.newaxis]
+        y1 = np.asarray(ys1, dtype=float)[:, np.newaxis]
+        return np.hypot(np.asarray(xs2, dtype=float) - x1, np.asarray(ys2, dtype=float) - y1)
+    return [distance_cartesian_many(x1, y1, xs2, ys2) for x1, y1 in zip(xs1, ys1)]
+
+
+def _haversine_np(lon1, lat1, lon2, lat2):
+    """
+    NumPy haversine in meters over radians; arguments broadcast. Same arithmetic and truncation as
+    distance_haversine.  NumPy's arctan2 may differ from math.atan2 in the last bit, which changes the
+    truncated result only when the distance is within a hair of a whole meter;  those are recomputed
+    as distance_haversine does, so results are identical.
+    """
+    sin_dlat = np.sin((lat2 - lat1) / 2)
+    sin_dlon = np.sin((lon2 - lon1) / 2)
+    a = (sin_dlat * sin_dlat) + (np.cos(lat1) * np.cos(lat2) * sin_dlon * sin_dlon)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    meters = EARTH_RADIUS_WGS84 * c
+    distances = meters.astype(np.int64)
+    edge = np.abs(meters - np.rint(meters)) < 1e-6
+    if edge.any():
+        lon1, lat1, lon2, lat2 = np.broadcast_arrays(lon1, lat1, lon2, lat2)
+        for i in zip(*np.nonzero(edge)):
+            sin_dlat = sin((lat2[i] - lat1[i]) / 2)
+            sin_dlon = sin((lon2[i] - lon1[i]) / 2)
+            a = (sin_dlat * sin_dlat) + (cos(lat1[i]) * cos(lat2[i]) * sin_dlon * sin_dlon)
+            c = 2 * atan2(sqrt(a), sqrt(1 - a))
+            distances[i] = int(EARTH_RADIUS_WGS84 * c)
+    return distances
+
+
+def distance_haversine_many(ddlon1, ddlat1, ddlons, ddlats):
+    """
+    One-to-many distance_haversine(), meters from the decimal degree Lon/Lat (X,Y) to each point in the
+    arrays ddlons, ddlats.
+    :return: numpy array if NumPy is installed, otherwise array.array of integers
+    """
+    if np is not None:
+        return _haversine_np(radians(ddlon1), radians(ddlat1),
+                             np.radians(np.asarray(ddlons, dtype=float)), np.radians(np.asarray(ddlats, dtype=float)))
+
+    lat1 = radians(ddlat1)
+    lon1 = radians(ddlon1)
+    cos_lat1 = cos(lat1)
+    distances = array("q")
+    for ddlon2, ddlat2 in zip(ddlons, ddlats):
+        lat2 = radians(ddlat2)
+        sin_dlat = sin((lat2 - lat1) / 2)
+        sin_dlon = sin((radians(ddlon2) - lon1) / 2)
+        a = (sin_dlat * sin_dlat) + (cos_lat1 * cos(lat2) * sin_dlon * sin_dlon)
+        c = 2 * atan2(sqrt(a), sqrt(1 - a))
+        distances.append(int(EARTH_RADIUS_WGS84 * c))
+    return distances
+
+
+def distance_haversine_pairwise(ddlons1, ddlats1, ddlons2, ddlats2):
+    """
+    Element-wise distance_haversine() between points (ddlons1[i], ddlats1[i]) and (ddlons2[i], ddlats2[i])
+    :return: numpy array if NumPy is installed, otherwise array.array of integers
+    """
+    if np is not None:
+        return _haversine_np(np.radians(np.asarray(ddlons1, dtype=float)),
+                             np.radians(np.asarray(ddlats1, dtype=float)),
+                             np.radians(np.asarray(ddlons2, dtype=float)),
+                             np.radians(np.asarray(ddlats2, dtype=float)))
+    return array("q", [distance_haversine(x1, y1, x2, y2)
+                       for x1, y1, x2, y2 in zip(ddlons1, ddlats1, ddlons2, ddlats2)])
+
+
+def distance_haversine_matrix(ddlons1, ddlats1, ddlons2, ddlats2):
+    """
+    Many-to-many distance_haversine().  Row i holds the distances from point i of (ddlons1, ddlats1)
+    to all of (ddlons2, ddlats2).
+    :return: 2-D numpy array if NumPy is installed, otherwise a list of array.array rows
+    """
+    if np is not None:
+        lon1 = np.radians(np.asarray(ddlons1, dtype=float))[:, np.newaxis]
+        lat1 = np.radians(np.asarray(ddlats1, dtype=float))[:, np.newaxis]
+        return _haversine_np(lon1, lat1,
+                             np.radians(np.asarray(ddlons2, dtype=float)), np.radians(np.asarray(ddlats2, dtype=float)))
+    return [distance_haversine_many(x1, y1, ddlons2, ddlats2) for x1, y1 in zip(ddlons1, ddlats1)]
+
+
 def location_accuracy(conf, prec_err):
     """
     Both confidence and precision error are required to be non-zero and positive.
@@ -206,16 +329,34 @@ def _ll2dict(p: LL):
     return {"lat": p.lat, "lon": p.lon}
 
 
-def _ll2geohash(p: LL):
-    return geohash_encode(lat=p.lat, lon=p.lon)
-
-
 def point2geohash(lat: float, lon: float, precision=6):
     return geohash_encode(lat=lat, lon=lon, precision=precision)
 
 
+def points2geohash(lats, lons, precision=6):
+    """
+    Bulk form of point2geohash for parallel arrays of lat, lon
+    :return: list of geohashes
+    """
+    return _geohash_encode_many(lats, lons, precision=precision)
+
+
 def geohash2point(gh):
-    return (float(x) for x in geohash_decode(gh))
+    return _geohash_decode2(gh)
+
+
+def _destination(lat, lon, distance, bearing):
+    """
+    Spherical destination point; good enough to pick the geohash cells a radius touches.
+    :return: tuple lat, lon
+    """
+    d = distance / EARTH_RADIUS_WGS84
+    b = radians(bearing)
+    lat1, lon1 = radians(lat), radians(lon)
+    lat2 = asin(sin(lat1) * cos(d) + cos(lat1) * sin(d) * cos(b))
+    lon2 = lon1 + atan2(sin(b) * sin(d) * cos(lat1), cos(d) - sin(lat1) * sin(lat2))
+    lon2 = (degrees(lon2) + 540) % 360 - 180
+    return degrees(lat2), lon2
 
 
 def radial_geohash(lat, lon, radius):
@@ -224,11 +365,9 @@ def radial_geohash(lat, lon, radius):
     """
     corners = {}
     # Find clockwise points at a radius, E, N, S, W. Bearing for North is 0deg.
-    p1 = LL(lat, lon)
-    corners["N"] = _ll2geohash(p1.destination(radius, 0))
-    corners["E"] = _ll2geohash(p1.destination(radius, 90))
-    corners["S"] = _ll2geohash(p1.destination(radius, 180))
-    corners["W"] = _ll2geohash(p1.destination(radius, 270))
+    for direction, bearing in [("N", 0), ("E", 90), ("S", 180), ("W", 270)]:
+        y, x = _destination(lat, lon, radius, bearing)
+        corners[direction] = geohash_encode(lat=y, lon=x)
     return corners
 
 
@@ -267,15 +406,18 @@ class Coordinate:
     Expects a row dict with 'lat' and 'lon',
     or kwd args 'lat', 'lon'
     @param row default dictionary
+
+    Coordinate and its subclasses use __slots__ rather than a per-instance __dict__, as
+    gazetteer caches hold millions of them.  X and Y are aliases of lon and lat.
+    Subclass without __slots__ to add arbitrary attributes.
     """
+    __slots__ = ("lat", "lon", "mgrs", "geohash")
 
     def __init__(self, row, lat=None, lon=None):
         # TODO: set coordinate to X, Y = None, None by default.
-        self.X = 0.0
-        self.Y = 0.0
+        self.lat = 0.0
+        self.lon = 0.0
         self.mgrs = None
-        self.lat = self.Y
-        self.lon = self.X
         # Set geohash on demand, otherwise it can be computed from lat,lon
         self.geohash = None
 
@@ -287,15 +429,31 @@ class Coordinate:
         if lat and lon:
             self.set(lat, lon)
 
+    @property
+    def X(self):
+        return self.lon
+
+    @X.setter
+    def X(self, x):
+        self.lon = x
+
+    @property
+    def Y(self):
+        return self.lat
+
+    @Y.setter
+    def Y(self, y):
+        self.lat = y
+
     def validate(self):
+        if self.Y is None or self.X is None:
+            return False
         return validate_lat(self.Y) and validate_lon(self.X) and (self.X != 0.0 and self.Y != 0.0)
 
     def set(self, lat, lon):
         """ Set the location lat, lon"""
-        self.X = float(lon)
-        self.Y = float(lat)
-        self.lat = self.Y
-        self.lon = self.X
+        self.lon = float(lon)
+        self.lat = float(lat)
 
     def format_coord(self):
         return format_coord(self.Y, self.X)
@@ -355,6 +513,11 @@ class Place(Coordinate):
     This Python API hopes to simplify the concepts in the Java API.
 
     """
+    __slots__ = ("id", "place_id", "name", "is_ascii", "is_upper", "adm1_postalcode", "place_postalcode",
+                 "name_type", "name_script", "country", "country_code", "country_code_fips",
+                 "feature_class", "feature_code", "adm1", "adm1_name", "adm1_iso", "adm2", "adm2_name",
+                 "source", "name_bias", "id_bias", "precision", "method", "population", "population_scale",
+                 "hierarchical_path", "name_group", "search_only")
 
     def __init__(self, pid, name, lat=None, lon=None):
         Coordinate.__init__(self, None, lat=lat, lon=lon)
@@ -425,6 +588,9 @@ class Country(Coordinate):
     """
     Country metadata
     """
+    __slots__ = ("cc_iso2", "cc_iso3", "cc_fips", "place_id", "name", "namenorm", "name_type", "aliases",
+                 "is_territory", "is_unique_name", "is_name_unique", "timezones", "languages",
+                 "primary_language")
 
     def __init__(self):
         Coordinate.__init__(self, None)
@@ -438,6 +604,7 @@ class Country(Coordinate):
         self.aliases = []
         self.is_territory = False
         self.is_unique_name = False
+        self.is_name_unique = False
         self.timezones = []
         self.languages = set([])
         self.primary_language = None
@@ -818,7 +985,11 @@ class TextEntity:
     * TextEntity: represents a span of text
     * TextMatch: a TextEntity matched by a particular routine.  This is the basis for most all
     extractors and annotators in OpenSetant.
+
+    TextEntity, TextMatch and PlaceCandidate declare __slots__; subclasses that do not
+    declare their own, e.g., PatternMatch, also carry a __dict__.
     """
+    __slots__ = ("text", "start", "end", "len", "is_duplicate", "is_overlap", "is_submatch")
 
     def __init__(self, text, start, end):
         self.text = text
@@ -894,6 +1065,7 @@ class TextMatch(TextEntity):
     """
     An entity matched by some tagger; it is a text span with lots of metadata.
     """
+    __slots__ = ("id", "label", "filtered_out", "attrs")
 
     def __init__(self, *args, label=None):
         TextEntity.__init__(self, *args)
@@ -947,6 +1119,7 @@ class PlaceCandidate(TextMatch):
     response from the REST API, for example.
 
     """
+    __slots__ = ("confidence", "rules", "is_country", "place", "location_certainty")
 
     def __init__(self, *args, **kwargs):
         TextMatch.__init__(self, *args, **kwargs)
@@ -1032,60 +1205,163 @@ IS_SUBMATCH = 1
 IS_DUPLICATE = 2
 
 
+def _contained_spans(spans):
+    """
+    Spans (start, end) that lie within another, different span.  Sorted by start, then longest first,
+    a span is preceded by every span that could contain it, so a running maximum of end suffices.
+    :param spans: distinct spans
+    :return: set of contained spans
+    """
+    found = set()
+    max_end = None
+    for span in sorted(spans, key=lambda sp: (sp[0], -sp[1])):
+        x1, x2 = span
+        if max_end is not None and x1 < x2 <= max_end:
+            found.add(span)
+        if max_end is None or x2 > max_end:
+            max_end = x2
+    return found
+
+
+def _left_crossed_spans(spans):
+    """
+    Spans X crossed from the left by another span Y:  Y.start < X.start <= Y.end < X.end
+    Sweep by start, keeping a heap of the ends of spans started so far that reach the current start.
+    :param spans: distinct spans
+    :return: set of spans
+    """
+    found = set()
+    ends = []
+    for x1, group in groupby(sorted(spans), key=lambda sp: sp[0]):
+        group = list(group)
+        while ends and ends[0] < x1:
+            heappop(ends)
+        if ends:
+            found.update(span for span in group if ends[0] < span[1])
+        for span in group:
+            heappush(ends, span[1])
+    return found
+
+
+def _overlapping_spans(spans):
+    """
+    Spans that overlap another span, neither being within the other, using the same rules as the
+    pairwise comparison in reduce_matches:  ends are inclusive and a zero-length span is not within
+    another.
+    :param spans: distinct spans, start <= end
+    :return: set of spans
+    """
+    found = _left_crossed_spans(spans)
+    # Crossed from the right, by mirroring offsets.
+    mirrored = {(-x2, -x1): (x1, x2) for x1, x2 in spans}
+    found.update(mirrored[span] for span in _left_crossed_spans(mirrored))
+
+    points = sorted(x1 for x1, x2 in spans if x1 == x2)
+    if points:
+        ranges = sorted(span for span in spans if span[0] < span[1])
+        starts = [x1 for x1, x2 in ranges]
+        reach = list(accumulate([x2 for x1, x2 in ranges], max))
+        for span in spans:
+            x1, x2 = span
+            if x1 == x2:
+                # Zero-length span lies on another span
+                idx = bisect_right(starts, x1)
+                if idx and reach[idx - 1] >= x1:
+                    found.add(span)
+            else:
+                idx = bisect_left(points, x1)
+                if idx < len(points) and points[idx] <= x2:
+                    found.add(span)
+    return found
+
+
 def reduce_matches(matches):
     """
     Mark each match if it is a submatch or overlap or exact duplicate of other.
+    Matches are compared by span with sorted sweeps, O(n log n), rather than every pair;  the flags set
+    are the same as pairwise comparison:
+
+    - is_duplicate: an earlier match has the same span
+    - is_submatch: the match lies within a different span
+    - is_overlap: the match shares offsets with another span and neither is within the other.
+
+    Filtered out matches are ignored. Flags are only ever set, not cleared.
+
     :param matches: array of TextMatch (or TextEntity). This is the more object oriented version
     of reduce_matches_dict
     :return:
     """
     if len(matches) < 2:
         return
-    loop = 0
-    for M in matches:
-        loop += 1
-        if M.filtered_out:
-            continue
-        m1 = M.start
-        m2 = M.end
-        # print(M.text, loop)
-
-        # In this loop you have to compare M against all N
-        #   Cannot exit loop on first match or overlap.
-        for N in matches[loop:]:
-            if N.filtered_out:
-                continue
-
-            n1 = N.start
-            n2 = N.end
-
-            if m2 < n1  or m1 > n2:
-                # M entirely before N
-                # M entirely after N
-                continue
-
-            # print("\t", N.text, N.start, N.is_duplicate)
-            if n1 == m1 and n2 == m2:
-                # Exact duplicate - Mark N as dup, as M is first in array, but only if M is a valid match.
-                N.is_duplicate = True
-            elif n1 <= m1 < m2 <= n2:
-                # M is within N span
-                M.is_submatch = True
-            elif m1 <= n1 < n2 <= m2:
-                # N is within M span
-                N.is_submatch = True
-            elif m1 <= n2 <= m2 or n1 <= m2 <= n2:
-                #  n1    n2
-                #     m1    m2
-                M.is_overlap = True
-                N.is_overlap = True
+    valid = [M for M in matches if not M.filtered_out]
+    spans = set()
+    for M in valid:
+        span = (M.start, M.end)
+        if span in spans and M.start <= M.end:
+            M.is_duplicate = True
+        spans.add(span)
+
+    # Reversed spans (start > end) are not expected; they are compared pairwise.
+    reversed_spans = {span for span in spans if span[0] > span[1]}
+    spans.difference_update(reversed_spans)
+    contained = _contained_spans(spans)
+    overlapping = _overlapping_spans(spans)
+    for n2, n1 in reversed_spans:
+        for span in spans:
+            if span[0] <= n1 and n2 <= span[1]:
+                overlapping.add(span)
+                overlapping.add((n2, n1))
+
+    for M in valid:
+        span = (M.start, M.end)
+        if span in contained:
+            M.is_submatch = True
+        if span in overlapping:
+            M.is_overlap = True
+
+
+class _RangeMax:
+    """
+    Maximum over ranges of an array, with point updates. Segment tree.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = [-math.inf] * (2 * size)
+
+    def update(self, pos, value):
+        pos += self.size
+        self.tree[pos] = value
+        while pos > 1:
+            pos >>= 1
+            self.tree[pos] = max(self.tree[2 * pos], self.tree[2 * pos + 1])
+
+    def query(self, lo, hi):
+        """ max of positions lo..hi-1, -inf if none are set """
+        result = -math.inf
+        lo += self.size
+        hi += self.size
+        while lo < hi:
+            if lo & 1:
+                result = max(result, self.tree[lo])
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                result = max(result, self.tree[hi])
+            lo >>= 1
+            hi >>= 1
+        return result
 
 
 def reduce_matches_dict(matches):
     """
     Accepts an array annotations (dict). Inserts the "submatch" flag in dict if there is a
     submatch (that is, if another TextEntity A wholly contains another, B -- B is a submatch).
-    We just have to loop through half of the array ~ comparing each item to each other item once.
+
+    The flag is the one the last of the pairwise comparisons would set, in array order:  IS_SUBMATCH if a later
+    annotation contains this one, otherwise that of the last earlier annotation with the same span (IS_DUPLICATE)
+    or containing this span (IS_SUBMATCH).  Spans are visited by start, longest first, so only containing
+    spans are in the range-max tree of ends, indexed by array position, when a span is checked.
 
     :param matches: array of dicts.
     """
@@ -1093,41 +1369,29 @@ def reduce_matches_dict(matches):
     if _max < 2:
         return
 
-    loops = 0
-    for i in range(0, _max):
-        M = matches[i]
-        m1 = M['start']
-        m2 = M['end']
-
-        for j in range(i + 1, _max):
-            loops += 1
-            N = matches[j]
-            n1 = N['start']
-            n2 = N['end']
-
-            if m2 < n1:
-                # M before N
-                continue
-
-            if m1 > n2:
-                # M after N
-                continue
-
-            # Check for filtered-out matches not done in this version.
-            #
-            if n1 == m1 and n2 == m2:
-                N['submatch'] = IS_DUPLICATE
-
-            elif n1 <= m1 < m2 <= n2:
-                M['submatch'] = IS_SUBMATCH
-                # Determined state of M.
-                # break this internal loop
-
-            elif m1 <= n1 < n2 <= m2:
-                N['submatch'] = IS_SUBMATCH
-                # Determined state of N,
-                # But possibly more N contained within M. Do not break yet.
-    return
+    # Check for filtered-out matches not done in this version.
+    positions = {}
+    for i, M in enumerate(matches):
+        positions.setdefault((M['start'], M['end']), []).append(i)
+
+    ends = _RangeMax(_max)
+    for span in sorted(positions, key=lambda sp: (sp[0], -sp[1])):
+        m1, m2 = span
+        if m1 <= m2:
+            last = -1
+            for i in positions[span]:
+                flag = None
+                if m1 < m2 and ends.query(i + 1, _max) >= m2:
+                    flag = IS_SUBMATCH
+                elif m1 < m2 and ends.query(last + 1, i) >= m2:
+                    flag = IS_SUBMATCH
+                elif last >= 0:
+                    flag = IS_DUPLICATE
+                if flag is not None:
+                    matches[i]['submatch'] = flag
+                last = i
+        for i in positions[span]:
+            ends.update(i, m2)
 
 
 # -=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-=-
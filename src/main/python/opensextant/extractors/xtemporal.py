@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
+import re
 from calendar import timegm
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
 
 import arrow
 from opensextant import logger_config
@@ -24,6 +26,12 @@ NO_DAY = -5
 log = logger_config("INFO", pkg=__name__)
 _default_locale = None
 
+# Results of parsing, by slot value: month names (arrow) and time zones
+_month_names = {}
+_time_zones = {}
+# Time zone offset, as arrow parses the "Z" token:  Z, +HH or +HHMM
+_tz_offset = re.compile(r"([+-])?(\d{2})(\d{2})?")
+
 def format_date(d):
     if isinstance(d, arrow.Arrow):
         return d.format("YYYY-MM-DD")
@@ -65,11 +73,15 @@ def normalize_month_name(slots):
     tlen = len(text)
     if tlen < 3 or 11 < tlen:
         return INVALID_DATE
-    try:
-        short = text[0:3]
-        return arrow.get(short, "MMM").month
-    except:
-        return INVALID_DATE
+    short = text[0:3]
+    month = _month_names.get(short)
+    if month is None:
+        try:
+            month = arrow.get(short, "MMM").month
+        except:
+            month = INVALID_DATE
+        _month_names[short] = month
+    return month
 
 
 def normalize_month_num(slots: dict):
@@ -178,24 +190,51 @@ def normalize_year(slots) -> int:
         return INVALID_DATE
 
 
+def _tzinfo(tz, fmt):
+    """
+    :param tz: time zone text
+    :param fmt: "Z" for Z or an offset, "ZZZ" for a zone name, e.g. EST or Europe/Paris
+    :return: tzinfo; None if not a time zone
+    """
+    if tz in {"UTC", "Z"}:
+        return timezone.utc
+    if fmt == "Z":
+        m = _tz_offset.fullmatch(tz)
+        if not m:
+            return None
+        sign, hh, mm = m.groups()
+        offset = timedelta(hours=int(hh), minutes=int(mm or 0))
+        return timezone(-offset if sign == "-" else offset)
+    try:
+        return ZoneInfo(tz)
+    except Exception:
+        return None
+
+
+def _parse_tz(tz, fmt):
+    key = (tz, fmt)
+    if key not in _time_zones:
+        if len(_time_zones) > 10000:
+            _time_zones.clear()
+        _time_zones[key] = _tzinfo(tz, fmt)
+    return _time_zones[key]
+
+
 def normalize_tz(slots):
     """
+    Time zone of SHORT_TZ, Z, or LONG_TZ, a zone name such as EST.  Parsed with datetime and zoneinfo as
+    arrow did, the names resolved against the IANA time zone database.
 
     :param slots:
-    :return: arrow.tzinfo
+    :return: tzinfo; None if no time zone or not parsed.  Cached by time zone text.
     """
-
-    try:
-        tz = slots.get("SHORT_TZ")
-        if tz:
-            dt_tz = arrow.get(tz, "Z")
-            return dt_tz
-        tz = slots.get("LONG_TZ")
-        if tz:
-            dt_tz = arrow.get(tz, "ZZZ")
-            return dt_tz
-    except Exception as parse_err:
-        return None
+    tz = slots.get("SHORT_TZ")
+    if tz:
+        return _parse_tz(tz, "Z")
+    tz = slots.get("LONG_TZ")
+    if tz:
+        return _parse_tz(tz, "ZZZ")
+    return None
 
 
 def normalize_time(slots):
@@ -229,12 +268,76 @@ def normalize_time(slots):
     return hh, mm, ss, resolution
 
 
+def _tzname(tz):
+    """ Name of the time zone as reported so far:  its name on 0001-01-01, e.g. EST, CET or LMT """
+    return datetime.min.replace(tzinfo=tz).tzname()
+
+
+def _arrow_date_attrs(year, month, day, tm, tz_found):
+    """
+    Date found, with optional time and time zone, built with arrow.
+    :return: tuple of datenorm, epoch, timestamp, tzinfo
+    """
+    date_found = arrow.get(datetime(year, month, day))
+    if tm:
+        hr, minute, seconds, resolution = tm
+        if hr >= 0:
+            date_found = date_found.shift(hours=hr)
+            if minute >= 0:
+                date_found = date_found.shift(minutes=minute)
+                if seconds >= 0:
+                    date_found = date_found.shift(seconds=seconds)
+    if tz_found:
+        date_found = date_found.to(tz_found)
+
+    timestamp = date_found.format("YYYY-MM-DDTHH:mm:ssZ") if tm else None
+    tzname = arrow.get(datetime.min, tzinfo=tz_found).format("ZZZ") if tz_found else None
+    return date_found.format("YYYY-MM-DD"), timegm(date_found.timetuple()), timestamp, tzname
+
+
+def _date_attrs(year, month, day, tm, tz_found):
+    """
+    Same as _arrow_date_attrs() with datetime alone: time is taken as UTC, then shown in the time zone found.
+    :return: tuple of datenorm, epoch, timestamp, tzinfo
+    """
+    date_found = datetime(year, month, day, tzinfo=timezone.utc)
+    if tm:
+        hr, minute, seconds, resolution = tm
+        if hr >= 0:
+            secs = 3600 * hr
+            if minute >= 0:
+                secs += 60 * minute
+                if seconds >= 0:
+                    secs += seconds
+            date_found += timedelta(seconds=secs)
+    if tz_found:
+        date_found = date_found.astimezone(tz_found)
+
+    datenorm = f"{date_found.year:04d}-{date_found.month:02d}-{date_found.day:02d}"
+    timestamp = None
+    if tm:
+        # As arrow formats "Z":  +HHMM
+        offset = int(date_found.utcoffset().total_seconds() / 60)
+        sign = "+" if offset >= 0 else "-"
+        hh, mm = divmod(abs(offset), 60)
+        timestamp = f"{datenorm}T{date_found.hour:02d}:{date_found.minute:02d}:{date_found.second:02d}" \
+                    f"{sign}{hh:02d}{mm:02d}"
+    tzname = _tzname(tz_found) if tz_found else None
+    return datenorm, timegm(date_found.timetuple()), timestamp, tzname
+
+
 class XTemporal(PatternExtractor):
-    def __init__(self, cfg="datetime_patterns_py.cfg", debug=False, locale=None):
+    def __init__(self, cfg="datetime_patterns_py.cfg", debug=False, locale=None, use_arrow=False):
         """
         :param cfg: patterns config file.
+        :param use_arrow: True to build normalized dates with arrow, as XTemporal did before the datetime
+            fast path.  For comparison.
         """
         PatternExtractor.__init__(self, RegexPatternManager(cfg, debug=debug, testing=debug))
+        if use_arrow:
+            for pat in self.pattern_manager.patterns.values():
+                if pat.match_class is DateTimeMatch:
+                    pat.match_class = ArrowDateTimeMatch
         if locale:
             global _default_locale
             _default_locale = locale.lower()
@@ -268,6 +371,9 @@ class DateTimeMatch(PatternMatch):
         that are not ambiguous, e.g., 30/05/1977.
         Ambiguous dates (with no default locale used) are parsed as "north-am".
     """
+    # Builds (datenorm, epoch, timestamp, tzname) for normalize()
+    date_attrs = staticmethod(_date_attrs)
+
     def __init__(self, *args, **kwargs):
         PatternMatch.__init__(self, *args, **kwargs)
         self.case = PatternMatch.LOWER_CASE
@@ -348,32 +454,24 @@ class DateTimeMatch(PatternMatch):
 
         try:
             tz_found = None
-            date_found = arrow.get(datetime(year, month, day))
             tm = normalize_time(slots)
             if tm:
-                hr, minute, seconds, resolution = tm
-                if hr >= 0:
-                    date_found = date_found.shift(hours=hr)
-                    if minute >= 0:
-                        date_found = date_found.shift(minutes=minute)
-                        if seconds >= 0:
-                            date_found = date_found.shift(seconds=seconds)
+                resolution = tm[3]
                 tz_found = normalize_tz(slots)
-                if tz_found:
-                    date_found = date_found.to(tz_found.tzinfo)
+            datenorm, epoch, timestamp, tzname = self.date_attrs(year, month, day, tm, tz_found)
 
             # Matchgroups are raw data from REGEX
             # Attributes are final encodings to share.
             self.attrs = {
-                "datenorm": date_found.format("YYYY-MM-DD"),
-                "epoch": timegm(date_found.timetuple()),
+                "datenorm": datenorm,
+                "epoch": epoch,
                 "resolution": resolution,
                 "locale": self.locale
             }
             if tm:
-                self.attrs["timestamp"] = date_found.format("YYYY-MM-DDTHH:mm:ssZ")
+                self.attrs["timestamp"] = timestamp
             if tz_found:
-                self.attrs["tzinfo"] = tz_found.format("ZZZ")
+                self.attrs["tzinfo"] = tzname
 
             self.is_valid = True
             self.filtered_out = False
@@ -383,3 +481,10 @@ class DateTimeMatch(PatternMatch):
             self.attrs["error"] = str(parse_err)
             log.info("Parsing error: DATE: %s (YMD = %d / % d / %d )", self.text, year, month, day)
             log.debug("Exception  - ", exc_info=parse_err)
+
+
+class ArrowDateTimeMatch(DateTimeMatch):
+    """
+    DateTimeMatch normalized with arrow, see XTemporal(use_arrow=True)
+    """
+    date_attrs = staticmethod(_arrow_date_attrs)
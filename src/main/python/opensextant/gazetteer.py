@@ -1,21 +1,43 @@
+import heapq
 import json
+import multiprocessing
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from logging import getLogger
+from math import asin, cos, degrees, pi, radians, sin
+from time import perf_counter
 from traceback import format_exc
+from urllib.parse import quote
 
 import arrow
 import pysolr
-from opensextant import Place, Country, distance_haversine, load_major_cities, make_HASC, popscale, \
-    geohash_cells_radially, bbox, point2geohash, geohash2point, pkg_resource_path
+from opensextant import Place, Country, distance_haversine_many, distance_haversine_matrix, load_major_cities, \
+    make_HASC, popscale, geohash_cells_radially, bbox, point2geohash, points2geohash, geohash2point, \
+    pkg_resource_path, EARTH_RADIUS_WGS84, _estimate_geohash_precision
 from opensextant.utility import ensure_dirs, is_ascii, has_cjk, has_arabic, \
     ConfigUtility, get_bool, trivial_bias, replace_diacritics, strip_quotes, parse_float, load_list
 from opensextant.wordstats import WordStats
 
+log = getLogger(__name__)
+
 DEFAULT_SOLR_URL="127.0.0.1:7000"
 DEFAULT_MASTER = "master_gazetteer.sqlite"
 DEFAULT_COUNTRY_ID_BIAS = 49
 DEFAULT_WORDSTATS = "wordstats.sqlite"
 
+# Columns of the placenames table, in table order
+PLACENAMES_COLUMNS = ("id", "place_id", "name", "name_type", "name_group", "source", "feat_class", "feat_code",
+                      "cc", "FIPS_cc", "adm1", "adm2", "lat", "lon", "geohash", "duplicate", "name_bias", "id_bias",
+                      "search_only")
+# Columns as_place() requires, always included when callers select columns
+PLACE_REQUIRED_COLUMNS = frozenset(["id", "place_id", "name", "lat", "lon", "cc", "feat_class", "feat_code",
+                                    "id_bias", "name_bias"])
+# Prepared statements cached per connection; DB queries use a fixed set of statement shapes
+STATEMENT_CACHE_SIZE = 256
+
 GAZETTEER_SOURCE_ID = {
     "ISO",  # ISO-3166 metadata
     "N",  # NGA
@@ -222,6 +244,11 @@ def normalize_name(nm: str):
     return nm.replace("\u2019", "'").replace("\xa0", " ").strip().strip("'")
 
 
+def _dedup_name(nm: str):
+    """ Name as compared by DB.find_duplicates(): normalized, case-insensitive, single spaced """
+    return " ".join(normalize_name(nm).lower().split())
+
+
 def name_group_for(nm: str):
     """
     Determine the major language "name group" for the input
@@ -243,7 +270,7 @@ def as_admin_place(r):
     """
     keys = {}
     if hasattr(r, "keys"):
-        keys = r.keys()
+        keys = set(r.keys())
 
     p = Place(r['place_id'], r['name'])
     p.country_code = r["cc"]
@@ -266,7 +293,7 @@ def as_place(r, source="index"):
     """
     keys = {}
     if hasattr(r, "keys"):
-        keys = r.keys()
+        keys = set(r.keys())
 
     lat, lon = 0, 0
     if "geo" in r:
@@ -696,27 +723,50 @@ def load_major_cities_iso():
 
 
 class DB:
-    def __init__(self, dbpath, commit_rate=1000, debug=False, add_geohash=False):
+    def __init__(self, dbpath, commit_rate=1000, debug=False, add_geohash=False, mode="rw"):
         """
         Save items to SQlite db at the commit_rate given.  Call close to finalize any partial batches
         and save database.
 
+        Read-only mode, mode="ro", is for query services:  many threads or processes share one existing
+        gazetteer file.  Each thread (and each forked process) gets its own connection on first use, opened
+        read-only with shared locking.  close() closes them all.
+
         :param dbpath:
         :param commit_rate:
+        :param mode: "rw" for ETL (default) or "ro" for read-only, multi-reader access
         """
+        if mode not in {"rw", "ro"}:
+            raise Exception(f"Unknown DB mode {mode}")
         self.dbpath = dbpath
-        self.conn = None
+        self.read_only = mode == "ro"
+        self._conn = None
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._open = False
         self.queue = []
         self.queue_count = 0
         self.commit_rate = commit_rate
         self.debug = debug
         self.geohash_default = add_geohash
-        if not os.path.exists(dbpath):
+        self._name_tokenizer = None
+        self._has_checkpoint_table = False
+        # ETL checkpoint saved with each batch of queued places, see set_checkpoint()
+        self.checkpoint = None
+        self._bulk_rows = None
+        self.bulk_stats = None
+        if self.read_only:
+            if not os.path.exists(dbpath):
+                raise Exception(f"Gazetteer DB not found, {dbpath}")
+            self.reopen()
+        elif not os.path.exists(dbpath):
             ensure_dirs(dbpath)
             self.reopen()
             self.create()
         else:
             self.reopen()
+            self._restore_deferred()
 
     def purge(self, q):
         if "source" in q:
@@ -796,6 +846,150 @@ class DB:
         self.conn.executescript(sql_script)
         self.conn.commit()
 
+        self.create_spatial_index()
+
+    def has_spatial_index(self) -> bool:
+        """
+        :return: True if the R*Tree index on placenames exists
+        """
+        sql = "select name from sqlite_master where type='table' and name='placenames_rtree'"
+        return self.conn.execute(sql).fetchone() is not None
+
+    def create_spatial_index(self):
+        """
+        Create the R*Tree spatial index on placenames, keyed by placenames.id. Triggers keep the index
+        in sync with inserts, deletes and location updates on placenames.
+        If the index is new and placenames already has rows, the index is populated from the table.
+        :return:
+        """
+        existed = self.has_spatial_index()
+        sql_script = """
+            create VIRTUAL TABLE IF NOT EXISTS placenames_rtree using rtree(
+                `id`, `min_lat`, `max_lat`, `min_lon`, `max_lon`
+            );
+
+            create TRIGGER IF NOT EXISTS placenames_rtree_ins AFTER INSERT ON placenames BEGIN
+                insert or replace into placenames_rtree values (new.id, new.lat, new.lat, new.lon, new.lon);
+            END;
+            create TRIGGER IF NOT EXISTS placenames_rtree_del AFTER DELETE ON placenames BEGIN
+                delete from placenames_rtree where id = old.id;
+            END;
+            create TRIGGER IF NOT EXISTS placenames_rtree_upd AFTER UPDATE OF lat, lon ON placenames BEGIN
+                update placenames_rtree set min_lat = new.lat, max_lat = new.lat, min_lon = new.lon, max_lon = new.lon
+                where id = new.id;
+            END;
+        """
+        self.conn.executescript(sql_script)
+        if not existed:
+            self.conn.execute("""insert or replace into placenames_rtree 
+                select id, lat, lat, lon, lon from placenames""")
+        self.conn.commit()
+
+    def has_name_index(self) -> bool:
+        """
+        :return: True if the full-text name index on placenames exists
+        """
+        sql = "select name from sqlite_master where type='table' and name='placenames_fts'"
+        return self.conn.execute(sql).fetchone() is not None
+
+    def create_name_index(self, tokenizer="unicode61"):
+        """
+        Create the full-text name index, placenames_fts, an FTS5 table over placenames.name keyed by placenames.id.
+        Triggers keep the index in sync with inserts, deletes and name updates.  Names are not stored twice;
+        the index reads them from placenames.  See search_names()
+
+        :param tokenizer: "unicode61" for word and word-prefix search, ignoring case and diacritics;
+            or "trigram" for substring search.
+        :return:
+        """
+        if tokenizer == "unicode61":
+            tokenize = "unicode61 remove_diacritics 2"
+        elif tokenizer == "trigram":
+            tokenize = "trigram"
+        else:
+            raise Exception(f"Unsupported tokenizer {tokenizer}")
+
+        existed = self.has_name_index()
+        sql_script = f"""
+            create VIRTUAL TABLE IF NOT EXISTS placenames_fts using fts5(
+                name, content='placenames', content_rowid='id', tokenize='{tokenize}', prefix='2 3'
+            );
+
+            create TRIGGER IF NOT EXISTS placenames_fts_ins AFTER INSERT ON placenames BEGIN
+                insert into placenames_fts (rowid, name) values (new.id, new.name);
+            END;
+            create TRIGGER IF NOT EXISTS placenames_fts_del AFTER DELETE ON placenames BEGIN
+                insert into placenames_fts (placenames_fts, rowid, name) values ('delete', old.id, old.name);
+            END;
+            create TRIGGER IF NOT EXISTS placenames_fts_upd AFTER UPDATE OF name ON placenames BEGIN
+                insert into placenames_fts (placenames_fts, rowid, name) values ('delete', old.id, old.name);
+                insert into placenames_fts (rowid, name) values (new.id, new.name);
+            END;
+        """
+        self.conn.executescript(sql_script)
+        if not existed:
+            self.conn.execute("insert into placenames_fts (placenames_fts) values ('rebuild')")
+        self.conn.commit()
+        self._name_tokenizer = None
+
+    def _name_index_tokenizer(self):
+        if not self._name_tokenizer:
+            sql = "select sql from sqlite_master where type='table' and name='placenames_fts'"
+            row = self.conn.execute(sql).fetchone()
+            if not row:
+                raise Exception("Name index does not exist. See create_name_index()")
+            self._name_tokenizer = "trigram" if "trigram" in row[0] else "unicode61"
+        return self._name_tokenizer
+
+    def search_names(self, prefix: str = None, text: str = None, cc: str = None, feat_class: str = None,
+                     limit=10, columns=None) -> list:
+        """
+        Name search using the full-text name index, see create_name_index().  All words in text must match;
+        the last word of prefix may be partial, e.g., for autocomplete.  With a trigram index, text matches
+        any part of a name and prefix matches the start of a name.
+
+        :param prefix: words of a name, the last one possibly incomplete.
+        :param text: words of a name
+        :param cc: ISO country code to filter.
+        :param feat_class: feature class to filter
+        :param limit: count of places to return
+        :param columns: optional list of placenames columns to select; columns required for Place are added.
+        :return: array of Place, best match first
+        """
+        prefix = prefix.strip() if prefix else None
+        text = text.strip() if text else None
+        if not prefix and not text:
+            raise Exception("Provide prefix or text to search")
+
+        trigram = self._name_index_tokenizer() == "trigram"
+        clauses = []
+        params = []
+        query = []
+        if text:
+            query.append(_fts_phrase(text) if trigram else _fts_words(text))
+        if prefix:
+            if trigram:
+                clauses.append("placenames_fts.name like ?")
+                params.append(prefix.replace("%", "").replace("_", "") + "%")
+            else:
+                query.append(_fts_words(prefix, prefix=True))
+        if query:
+            clauses.insert(0, "placenames_fts match ?")
+            params.insert(0, " ".join(query))
+            order = "order by placenames_fts.rank, placenames.id"
+        else:
+            order = "order by length(placenames.name), placenames.id"
+        if cc:
+            clauses.append("placenames.cc = ?")
+            params.append(cc)
+        if feat_class:
+            clauses.append("placenames.feat_class = ?")
+            params.append(feat_class)
+        params.append(limit)
+
+        sql = _select_sql(_as_columns(columns), _FTS_PLACENAMES, tuple(clauses), criteria=order, limit=True)
+        return [as_place(p, source="db") for p in self.conn.execute(sql, params)]
+
     def create_indices(self):
         """
         Create additional indices that are used for advanced ETL functions and optimization.
@@ -819,20 +1013,147 @@ class DB:
         """
         self.conn.executescript(indices)
         self.conn.commit()
+        self.create_spatial_index()
 
     def optimize(self):
         self.reopen()
         self.conn.execute("VACUUM")
         self.conn.commit()
 
+    @contextmanager
+    def bulk_load(self, batch_size=None):
+        """
+        Context for loading many places, e.g., DataSource.normalize() or add_places().
+        Secondary indices on placenames and the triggers that maintain the R*Tree and name indices are dropped
+        on entry.  Batches are inserted sorted by id.  On exit the indices are rebuilt once and ANALYZE is run.
+        Statistics are saved in bulk_stats and logged at INFO level.
+        The dropped DDL is kept in the etl_deferred_ddl table until it is reapplied, so if the process dies
+        inside the block the next DB(...) of the file, in "rw" mode, rebuilds the indices and triggers.
+
+            with db.bulk_load():
+                db.add_places(places)
+
+        :param batch_size: optional number of places per insert, instead of commit_rate
+        """
+        self.reopen()
+        sql = """select type, name, sql from sqlite_master 
+            where tbl_name = 'placenames' and type in ('index', 'trigger') and sql is not null"""
+        deferred = [(row["type"], row["name"], row["sql"]) for row in self.conn.execute(sql)]
+        self._create_deferred_table()
+        self.conn.executemany("insert into etl_deferred_ddl (type, name, sql) values (?, ?, ?)", deferred)
+        for obj_type, name, _ in deferred:
+            self.conn.execute(f"drop {obj_type} if exists {name}")
+        self.conn.commit()
+
+        commit_rate = self.commit_rate
+        if batch_size:
+            self.commit_rate = batch_size
+        self._bulk_rows = 0
+        started = perf_counter()
+        try:
+            yield self
+            self.reopen()
+            self.__assess_queue(force=True)
+        finally:
+            self.commit_rate = commit_rate
+            rows, self._bulk_rows = self._bulk_rows, None
+            loaded = perf_counter()
+            self.reopen()
+            self._rebuild_indices(deferred)
+            finished = perf_counter()
+            load_time, index_time = loaded - started, finished - loaded
+            self.bulk_stats = {"rows": rows, "load_time": load_time, "index_time": index_time,
+                               "rows_per_sec": rows / load_time if load_time else 0.0,
+                               "total_rows_per_sec": rows / (finished - started) if finished > started else 0.0}
+            log.info("Bulk load: %d rows in %0.1f sec, %0.0f rows/sec; indexing %0.1f sec",
+                     rows, load_time, self.bulk_stats["rows_per_sec"], index_time)
+
+    def _rebuild_indices(self, deferred):
+        """
+        Recreate indices and triggers dropped by bulk_load(), after refreshing the R*Tree and name indices.
+        """
+        if self.has_spatial_index():
+            self.conn.execute("delete from placenames_rtree")
+            self.conn.execute("insert into placenames_rtree select id, lat, lat, lon, lon from placenames")
+        if self.has_name_index():
+            self.conn.execute("insert into placenames_fts (placenames_fts) values ('rebuild')")
+        for _, _, sql in deferred:
+            self.conn.execute(sql)
+        self.conn.execute("delete from etl_deferred_ddl")
+        self.conn.execute("ANALYZE")
+        self.conn.commit()
+
+    def _create_deferred_table(self):
+        self.conn.execute("""
+            create TABLE IF NOT EXISTS etl_deferred_ddl (
+                `type` TEXT NOT NULL,
+                `name` TEXT NOT NULL,
+                `sql` TEXT NOT NULL
+            )""")
+
+    def _restore_deferred(self):
+        """
+        Reapply indices and triggers left dropped by a bulk_load() that did not finish.
+        """
+        if not self.conn.execute(
+                "select name from sqlite_master where type = 'table' and name = 'etl_deferred_ddl'").fetchone():
+            return
+        deferred = [(row["type"], row["name"], row["sql"]) for row in
+                    self.conn.execute("select type, name, sql from etl_deferred_ddl")]
+        if deferred:
+            log.warning("Restoring %d indices and triggers from an unfinished bulk load of %s",
+                        len(deferred), self.dbpath)
+            self._rebuild_indices(deferred)
+
+    @property
+    def conn(self):
+        """
+        The connection -- in read-only mode, the connection for the calling thread, opened on demand.
+        """
+        if not self.read_only:
+            return self._conn
+        if not self._open:
+            return None
+        local = self._local
+        if getattr(local, "pid", None) != os.getpid():
+            # New thread, or a forked process that must not share its parent's connection.
+            local.conn = self._connect_ro()
+            local.pid = os.getpid()
+        return local.conn
+
+    @conn.setter
+    def conn(self, conn):
+        if self.read_only:
+            if conn is None:
+                self._open = False
+            return
+        self._conn = conn
+
+    def _connect_ro(self):
+        uri = f"file:{quote(os.path.abspath(self.dbpath))}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA cache_size = 8092')
+        conn.execute('PRAGMA mmap_size =  1048576000')  # 1000 MB, pages shared by all readers through the OS
+        conn.execute('PRAGMA locking_mode = NORMAL')  # Shared read locks; works with WAL or rollback journals
+        conn.execute('PRAGMA query_only = 1')
+        conn.execute('PRAGMA temp_store = MEMORY')
+        conn.row_factory = sqlite3.Row
+        with self._connections_lock:
+            self._connections.append((os.getpid(), conn))
+        return conn
+
     def reopen(self):
+        if self.read_only:
+            self._open = True
+            return
+
         if self.conn is not None:
             return
 
         # really close cleanly
         self.close()
 
-        self.conn = sqlite3.connect(self.dbpath)
+        self.conn = sqlite3.connect(self.dbpath, cached_statements=STATEMENT_CACHE_SIZE)
         self.conn.execute('PRAGMA cache_size = 8092')
         self.conn.execute('PRAGMA page_size =  8092')  # twice default. Cache = 8092 x 8KB pages ~ 64MB
         self.conn.execute('PRAGMA mmap_size =  1048576000')  # 1000 MB
@@ -847,7 +1168,27 @@ class DB:
         if self.conn:
             self.conn.commit()
 
+    def rollback(self):
+        """
+        Discard queued places and the uncommitted transaction.
+        """
+        self.queue.clear()
+        self.queue_count = 0
+        self.checkpoint = None
+        if self.conn:
+            self.conn.rollback()
+
     def close(self):
+        if self.read_only:
+            self._open = False
+            with self._connections_lock:
+                for pid, conn in self._connections:
+                    # Connections inherited from a parent process are left to the parent.
+                    if pid == os.getpid():
+                        conn.close()
+                self._connections.clear()
+            self._local = threading.local()
+            return
         try:
             if self.conn is not None:
                 self.__assess_queue(force=True)
@@ -897,7 +1238,22 @@ class DB:
 
     def __assess_queue(self, force=False):
         if force or (self.queue_count >= self.commit_rate):
-            sql = """
+            self._insert_batch(self.queue, checkpoint=self.checkpoint)
+            self.queue_count = 0
+            self.queue.clear()
+
+    def _insert_batch(self, rows, checkpoint=None, commit=True):
+        """
+        Insert place records already prepared by _prep_place() in one executemany, and commit.
+        :param rows: list of place records
+        :param checkpoint: optional dict of set_checkpoint() arguments, saved in the same transaction as the rows.
+        :param commit: False to leave the transaction open
+        """
+        if self._bulk_rows is not None:
+            # In key order, rows are appended to the placenames B-tree.
+            rows = sorted(rows, key=_id_key)
+            self._bulk_rows += len(rows)
+        sql = """
             insert into placenames (
                 id, place_id, name, name_type, name_group, 
                 lat, lon, geohash, feat_class, feat_code,
@@ -906,13 +1262,78 @@ class DB:
                 :id, :place_id, :name, :name_type, :name_group, 
                 :lat, :lon, :geohash, :feat_class, :feat_code,
                 :cc, :FIPS_cc, :adm1, :adm2, :source, :name_bias, :id_bias, :search_only)"""
-            self.conn.executemany(sql, self.queue)
+        self.conn.executemany(sql, rows)
+        if checkpoint:
+            self.set_checkpoint(commit=False, **checkpoint)
+        if commit:
             self.conn.commit()
-            self.queue_count = 0
-            self.queue.clear()
+
+    def _create_checkpoint_table(self):
+        if self._has_checkpoint_table:
+            return
+        self.conn.execute("""
+            create TABLE IF NOT EXISTS etl_checkpoint (
+                `source` TEXT NOT NULL,
+                `sourcefile` TEXT NOT NULL,
+                `filesize` INTEGER NULL,
+                `rowcount` INTEGER NOT NULL,
+                `offset` INTEGER NULL,
+                `complete` BIT DEFAULT 0,
+                `updated` TEXT NOT NULL,
+                PRIMARY KEY (`source`, `sourcefile`)
+            )""")
+        self._has_checkpoint_table = True
+
+    def set_checkpoint(self, source, sourcefile, rowcount, offset=None, filesize=None, complete=False, commit=True):
+        """
+        Record ETL progress for a source file. DataSource.normalize(..., resume=True) continues from here.
+        :param source: source name
+        :param sourcefile: file name
+        :param rowcount: count of records loaded
+        :param offset: byte offset in file up to which records are loaded, if known
+        :param filesize: size of file, to detect changes before resuming
+        :param complete: True if file is completely loaded
+        :param commit: False to save within the caller's transaction
+        """
+        self._create_checkpoint_table()
+        sql = """insert or replace into etl_checkpoint
+            (source, sourcefile, filesize, rowcount, offset, complete, updated) values (?, ?, ?, ?, ?, ?, ?)"""
+        self.conn.execute(sql, (source, sourcefile, filesize, rowcount, offset, 1 if complete else 0,
+                                str(arrow.now())))
+        if commit:
+            self.conn.commit()
+
+    def clear_checkpoint(self, source, sourcefile=None):
+        """
+        Forget ETL progress for a source, or one file of a source.
+        """
+        self._create_checkpoint_table()
+        if sourcefile:
+            self.conn.execute("delete from etl_checkpoint where source = ? and sourcefile = ?", (source, sourcefile))
+        else:
+            self.conn.execute("delete from etl_checkpoint where source = ?", (source,))
+        self.conn.commit()
+
+    def get_checkpoint(self, source, sourcefile):
+        """
+        :return: dict of last checkpoint for the source file -- rowcount, offset, filesize, complete, updated;
+            or None
+        """
+        self._create_checkpoint_table()
+        sql = """select rowcount, offset, filesize, complete, updated from etl_checkpoint
+            where source = ? and sourcefile = ?"""
+        row = self.conn.execute(sql, (source, sourcefile)).fetchone()
+        return dict(zip(row.keys(), row)) if row else None
 
     def add_places(self, arr):
         """ Add a list of places. """
+        if self.geohash_default:
+            # Geohash the whole batch at once; _prep_place then skips rows that have one.
+            pending = [dct for dct in arr if "lat" in dct and not dct.get("geohash")]
+            if pending:
+                cells = points2geohash([dct["lat"] for dct in pending], [dct["lon"] for dct in pending], precision=6)
+                for dct, gh in zip(pending, cells):
+                    dct["geohash"] = gh
         for dct in arr:
             self._prep_place(dct)
         self.queue.extend(arr)
@@ -930,7 +1351,8 @@ class DB:
         """
         name_bias = dict()
         place = None
-        for row in self.conn.execute(f"select * from placenames where place_id = ? limit {limit}", (plid,)):
+        sql = _select_sql(None, _PLACENAMES, ("placenames.place_id = ?",), limit=True)
+        for row in self.conn.execute(sql, (plid, limit)):
             pl = as_place(row, source="db")
             if not place:
                 place = pl
@@ -1022,43 +1444,98 @@ class DB:
             arr.append(cc["CC"])
         return arr
 
-    def list_places(self, cc=None, fc=None, criteria=None, limit=-1):
+    def list_places(self, cc=None, fc=None, criteria=None, limit=-1, columns=None):
         """
         Potentially massive array -- so this is just a Place generator.
         :param cc: country code or ''
         :param fc: feat class constraint with "*" wildcard, or ''
         :param criteria: additional clause to constrain search, e.g. " AND duplicate=0 " to find non-dups.
+            This is literal SQL -- do not pass untrusted input here.
         :param limit:  non-zero limit
+        :param columns: optional list of placenames columns to select; columns required for Place are added.
         :return: generator
         """
-        sql = ["select * from placenames"]
-        _and = ""
-        if cc is not None or fc is not None:
-            sql.append("where")
+        clauses = []
+        params = []
         if cc is not None:
-            sql.append(f"cc ='{cc}'")
+            clauses.append("placenames.cc = ?")
+            params.append(cc)
         if fc is not None:
-            if cc is not None:
-                _and = " and "
             if "*" in fc:
-                sql.append(f"{_and}feat_class like '{fc.replace('*', '%')}'")
+                clauses.append("placenames.feat_class like ?")
+                params.append(fc.replace('*', '%'))
             else:
-                sql.append(f"{_and}feat_class = '{fc}'")
-        if criteria:
-            # Include the " AND " yourself in critera
-            sql.append(criteria)
+                clauses.append("placenames.feat_class = ?")
+                params.append(fc)
         if limit > 0:
-            sql.append(f"limit {limit}")
+            params.append(limit)
 
         # Query
-        sql_script = " ".join(sql)
+        sql_script = _select_sql(_as_columns(columns), _PLACENAMES, tuple(clauses), criteria=criteria or "",
+                                 limit=limit > 0)
         if self.debug:
-            print(sql_script)
-        for p in self.conn.execute(sql_script):
+            print(sql_script, params)
+        for p in self.conn.execute(sql_script, params):
             yield as_place(p, source="db")
 
+    def iter_place_batches(self, batch_size=1000, columns=None, where: dict = None, as_="tuple"):
+        """
+        Stream placenames in batches, e.g., to walk the entire gazetteer for export.  Rows are fetched
+        batch_size at a time and converted only as requested:
+
+        - "tuple": tuples of the columns in the order given, as returned by SQLite.
+        - "dict": dicts keyed by column
+        - "Place": Place objects; columns required by Place are added to those given.
+
+        :param batch_size: rows per batch
+        :param columns: list of placenames columns, default is all columns in table order.
+        :param where: dict of column => value;  a list, tuple or set value matches any, None matches NULL.
+        :param as_: tuple, dict or Place
+        :return: generator of lists
+        """
+        if as_ not in {"tuple", "dict", "Place"}:
+            raise Exception(f"Unknown row type {as_}")
+        if as_ == "Place":
+            selected = _as_columns(columns) or PLACENAMES_COLUMNS
+            columns = [col for col in PLACENAMES_COLUMNS if col in selected]
+        else:
+            columns = list(columns or PLACENAMES_COLUMNS)
+        where = where or {}
+        unknown = set(columns).union(where.keys()).difference(PLACENAMES_COLUMNS)
+        if unknown:
+            raise Exception(f"Unknown placenames columns {sorted(unknown)}")
+
+        clauses = []
+        params = []
+        for col, val in where.items():
+            if isinstance(val, (list, tuple, set)):
+                clauses.append(f"{col} in ({','.join(['?'] * len(val))})")
+                params.extend(val)
+            elif val is None:
+                clauses.append(f"{col} is NULL")
+            else:
+                clauses.append(f"{col} = ?")
+                params.append(val)
+        sql = f"select {', '.join(columns)} from placenames"
+        if clauses:
+            sql += " where " + " and ".join(clauses)
+
+        cursor = self.conn.cursor()
+        cursor.row_factory = None  # Plain tuples
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if as_ == "dict":
+                rows = [dict(zip(columns, row)) for row in rows]
+            elif as_ == "Place":
+                rows = [as_place(dict(zip(columns, row)), source="db") for row in rows]
+            yield rows
+        cursor.close()
+
     def _list_places_at_geohash(self, lat: float = None, lon: float = None, geohash: str = None,
-                                cc: str = None, radius: int = 5000, limit=10):
+                                cc: str = None, radius: int = 5000, limit=10, columns=None):
         """
         A best effort guess at spatial query. Returns an array of matches, thinking most location queries are focused.
         This is a geohash-backed hack at search.  Even with SQLite indexing this is still very slow.
@@ -1086,7 +1563,7 @@ class DB:
         :param cc:
         :param radius:
         :param limit:
-        :return: dict of matches,  { DIST = PLACE, ... }
+        :return: list of matches,  [(DIST, PLACE), ... ]
         """
         if geohash:
             # Postpend "sss" to create a default centroid in a shorter geohash.
@@ -1096,24 +1573,26 @@ class DB:
             raise Exception("Provide lat/lon or geohash")
 
         cells = geohash_cells_radially(lat, lon, radius)
-        sql_script = []
+        clauses = ["placenames.duplicate = 0"]
+        params = []
+        if cc:
+            clauses.append("placenames.cc = ?")
+            params.append(cc)
+        cols = _as_columns(columns)
+        sql_cell = _select_sql(cols, _PLACENAMES, tuple(clauses + ["placenames.geohash = ?"]))
+        sql_prefix = _select_sql(cols, _PLACENAMES, tuple(clauses + ["placenames.geohash like ?"]))
+        queries = []
         for gh in cells:
             if len(gh) >= 6:
-                sql_script.append(f"select * from placenames where duplicate=0 and geohash = '{gh[0:6]}'")
+                queries.append((sql_cell, params + [gh[0:6]]))
             else:
-                sql_script.append(f"select * from placenames where duplicate=0 and geohash like '{gh}%'")
+                queries.append((sql_prefix, params + [f"{gh}%"]))
 
-        found = {}
+        found = []
         # Search the entire grid space
-        for script in sql_script:
-            for p in self.conn.execute(script):
-                if cc:
-                    if p["cc"] != cc:
-                        continue
-                place = as_place(p)
-                dist = distance_haversine(lon, lat, place.lon, place.lat)
-                if dist < radius:
-                    found[dist] = place
+        for script, args in queries:
+            places = [as_place(p) for p in self.conn.execute(script, args)]
+            found.extend(_places_within(lat, lon, places, radius))
             if len(found) >= limit:
                 # Return after first round of querying.
                 break
@@ -1121,26 +1600,36 @@ class DB:
         return found
 
     def _list_places_at_2d(self, lat: float, lon: float,
-                           cc: str = None, radius: int = 5000, limit=10):
-        found = {}
+                           cc: str = None, radius: int = 5000, limit=10, columns=None):
         sw, ne = bbox(lon, lat, radius)
-        sql_script = [f"""select * from placenames where 
-            (lat < {ne.lat:0.6} and lon < {ne.lon:0.6}) and 
-            (lat > {sw.lat:0.6} and lon > {sw.lon:0.6})"""]
+        clauses = ["placenames.lat < ?", "placenames.lon < ?", "placenames.lat > ?", "placenames.lon > ?"]
+        params = [ne.lat, ne.lon, sw.lat, sw.lon]
         if cc:
-            sql_script.append(f" and cc = '{cc}'")
+            clauses.append("placenames.cc = ?")
+            params.append(cc)
 
-        script = " ".join(sql_script)
-        for p in self.conn.execute(script):
-            place = as_place(p)
-            dist = distance_haversine(lon, lat, place.lon, place.lat)
-            if dist < radius:
-                found[dist] = place
+        script = _select_sql(_as_columns(columns), _PLACENAMES, tuple(clauses))
+        places = [as_place(p) for p in self.conn.execute(script, params)]
+        return _places_within(lat, lon, places, radius)
 
-        return found
+    def _list_places_at_rtree(self, lat: float, lon: float,
+                              cc: str = None, radius: int = 5000, limit=10, columns=None):
+        """
+        Spatial query using the R*Tree index, placenames_rtree. See create_spatial_index()
+        """
+        sw, ne = bbox(lon, lat, radius)
+        clauses = list(_RTREE_CLAUSES)
+        params = [ne.lat, sw.lat, ne.lon, sw.lon]
+        if cc:
+            clauses.append("placenames.cc = ?")
+            params.append(cc)
+
+        script = _select_sql(_as_columns(columns), _RTREE_PLACENAMES, tuple(clauses))
+        places = [as_place(p) for p in self.conn.execute(script, params)]
+        return _places_within(lat, lon, places, radius)
 
     def list_places_at(self, lat: float = None, lon: float = None, geohash: str = None,
-                       cc: str = None, radius: int = 5000, limit=10, method="2d"):
+                       cc: str = None, radius: int = 5000, limit=10, method="2d", columns=None):
         """
 
         :param lat: latitude
@@ -1149,20 +1638,140 @@ class DB:
         :param geohash:  optionally, use precomputed geohash of precision 6-chars instead of lat/lon.
         :param radius:  in METERS, radial distance from given point to search, DEFAULT is 5 KM
         :param limit: count of places to return
-        :param method: bbox or geohash
+        :param method: 2d (bbox), rtree or geohash.  "rtree" requires the spatial index, see create_spatial_index()
+        :param columns: optional list of placenames columns to select; columns required for Place are added.
         :return: array of tuples, sorted by distance.
         """
-        found = {}
+        found = []
         if method == "geohash" or geohash and lat is None:
-            found = self._list_places_at_geohash(lat=lat, lon=lon, geohash=geohash, cc=cc, radius=radius, limit=limit)
+            found = self._list_places_at_geohash(lat=lat, lon=lon, geohash=geohash, cc=cc, radius=radius, limit=limit,
+                                                 columns=columns)
         elif method == "2d":
-            found = self._list_places_at_2d(lat=lat, lon=lon, cc=cc, radius=radius, limit=limit)
+            found = self._list_places_at_2d(lat=lat, lon=lon, cc=cc, radius=radius, limit=limit, columns=columns)
+        elif method == "rtree":
+            found = self._list_places_at_rtree(lat=lat, lon=lon, cc=cc, radius=radius, limit=limit, columns=columns)
         if not found:
             return []
 
-        # Sort by distance key
-        result = [(dist, found[dist]) for dist in sorted(found.keys())]
-        return result[0:limit]
+        # Nearest first. Places at the same distance are all kept.
+        return heapq.nsmallest(limit, found, key=_distance_key)
+
+    def nearest(self, lat: float, lon: float, k: int = 5, cc: str = None, feat_class: str = None,
+                radius: int = 1000, max_radius: int = 1000000, columns=None):
+        """
+        K-nearest neighbor query.  The search ring starts at radius and doubles until k places are found
+        within the ring or max_radius is reached.  Uses the R*Tree spatial index if present, otherwise lat/lon indices.
+
+        :param lat: latitude
+        :param lon: longitude
+        :param k: count of places to return
+        :param cc: ISO country code to filter.
+        :param feat_class: feature class to filter, e.g., "P" for populated places
+        :param radius: in METERS, initial search radius
+        :param max_radius: in METERS, maximum search radius
+        :param columns: optional list of placenames columns to select; columns required for Place are added.
+        :return: array of tuples (distance, place), sorted by distance; fewer than k if max_radius is reached.
+        :raise ValueError: if radius is not positive, as the search ring could never grow.
+        """
+        if radius <= 0:
+            raise ValueError(f"Invalid radius {radius}")
+        if k < 1:
+            return []
+        use_rtree = self.has_spatial_index()
+        r = radius
+        while True:
+            nearest = []
+            for dist, place in self._list_places_in_range(lat, lon, r, cc=cc, feat_class=feat_class,
+                                                          use_rtree=use_rtree, columns=columns):
+                # Bounded max-heap of the k nearest.  Row ID breaks ties in distance.
+                entry = (-dist, -place.id, place)
+                if len(nearest) < k:
+                    heapq.heappush(nearest, entry)
+                elif entry > nearest[0]:
+                    heapq.heapreplace(nearest, entry)
+            # Any place not yet seen is further than r, so a full heap is the answer.
+            if len(nearest) >= k or r >= max_radius:
+                return [(-d, place) for d, rowid, place in sorted(nearest, reverse=True)]
+            r = min(2 * r, max_radius)
+
+    def list_places_at_many(self, points, radius: int = 5000, limit=10, cc: str = None, columns=None):
+        """
+        Batch version of list_places_at() for many (lat, lon) points.
+        Nearby points are grouped by geohash cell and each cell (plus radius) is read from the database once.
+
+        :param points: sequence of (lat, lon) tuples
+        :param radius: in METERS, radial distance from each point to search, DEFAULT is 5 KM
+        :param limit: count of places to return for each point
+        :param cc: ISO country code to filter.
+        :param columns: optional list of placenames columns to select; columns required for Place are added.
+        :return: array with one entry per point in input order; Each entry is an array of tuples (distance, place),
+            sorted by distance as in list_places_at()
+        """
+        results = [[] for _ in points]
+        if not points:
+            return results
+
+        precision = _estimate_geohash_precision(radius)
+        cells = {}
+        for idx, (lat, lon) in enumerate(points):
+            if lat is None or lon is None:
+                continue
+            gh = point2geohash(lat, lon, precision=precision)
+            cells.setdefault(gh, []).append(idx)
+
+        use_rtree = self.has_spatial_index()
+        for gh in cells:
+            group = cells[gh]
+            bounds = None
+            for idx in group:
+                lat, lon = points[idx]
+                bounds = _union_bounds(bounds, _bounding_box(lat, lon, radius))
+
+            candidates = list(self._list_places_in_bounds(bounds, cc=cc, use_rtree=use_rtree, columns=columns))
+            if not candidates:
+                continue
+            lats = [place.lat for place in candidates]
+            lons = [place.lon for place in candidates]
+            # Distances from every point in the cell to every candidate, in one pass.
+            matrix = distance_haversine_matrix([points[idx][1] for idx in group], [points[idx][0] for idx in group],
+                                               lons, lats)
+            for idx, distances in zip(group, matrix):
+                found = [(dist, place) for dist, place in zip(distances.tolist(), candidates) if dist < radius]
+                results[idx] = heapq.nsmallest(limit, found, key=_distance_key)
+        return results
+
+    def _list_places_in_range(self, lat: float, lon: float, radius: int, cc: str = None, feat_class: str = None,
+                              use_rtree=True, columns=None):
+        """
+        list of (distance, place) for all places within radius meters of the given point.
+        """
+        bounds = _bounding_box(lat, lon, radius)
+        places = list(self._list_places_in_bounds(bounds, cc=cc, feat_class=feat_class, use_rtree=use_rtree,
+                                                  columns=columns))
+        return _places_within(lat, lon, places, radius)
+
+    def _list_places_in_bounds(self, bounds: tuple, cc: str = None, feat_class: str = None, use_rtree=True,
+                               columns=None):
+        """
+        generator of places within the bounding box, (min_lat, max_lat, min_lon, max_lon)
+        """
+        min_lat, max_lat, min_lon, max_lon = bounds
+        if use_rtree:
+            source, clauses = _RTREE_PLACENAMES, list(_RTREE_CLAUSES)
+        else:
+            source, clauses = _PLACENAMES, ["placenames.lat <= ?", "placenames.lat >= ?",
+                                            "placenames.lon <= ?", "placenames.lon >= ?"]
+        params = [max_lat, min_lat, max_lon, min_lon]
+        if cc:
+            clauses.append("placenames.cc = ?")
+            params.append(cc)
+        if feat_class:
+            clauses.append("placenames.feat_class = ?")
+            params.append(feat_class)
+
+        script = _select_sql(_as_columns(columns), source, tuple(clauses))
+        for p in self.conn.execute(script, params):
+            yield as_place(p)
 
     def list_admin_names(self, sources=['U', 'N', 'G'], cc=None) -> set:
         """
@@ -1171,14 +1780,15 @@ class DB:
         :param sources: list of source IDs defaulting to those for USGS, NGA, Geonames.org
         :return: set of names, lowerased
         """
-        source_criteria = ','.join([f"'{s}'" for s in sources])
+        source_criteria = ','.join(["?" for s in sources])
         sql = f"""select distinct(name) AS NAME from placenames where  feat_class = 'A' and feat_code = 'ADM1' 
               and source in ({source_criteria}) and name_group='' and name_type='N'"""
-
+        params = list(sources)
         if cc:
-            sql += f" and cc='{cc}'"
+            sql += " and cc = ?"
+            params.append(cc)
         names = set([])
-        for nm in self.conn.execute(sql):
+        for nm in self.conn.execute(sql, params):
             # To list names, we normalize lowercase and remove dashes.
             names.add(nm['NAME'].lower().replace("-", " "))
         return names
@@ -1187,15 +1797,65 @@ class DB:
         sql = "update placenames set place_id=? where rowid=?"
         self.conn.execute(sql, (plid, rowid,))
 
+    def find_duplicates(self, precision=5, source_preference=None, cc=None, mark=True, block_size=10000) -> list:
+        """
+        Find the same place reported more than once, e.g., by different sources:  rows with the same normalized
+        name, name type, country, feature class and geohash cell.  This is one pass over placenames in country
+        order, grouping each country's rows in a dict.  In each group the row from the most preferred source is
+        kept, or the lowest id if sources rank the same; others are duplicates.  Rows already marked
+        duplicate are ignored, so this can be re-run after loading more sources.
+
+        Places close to each other but across a cell boundary are not grouped.
+
+        :param precision: geohash length of the location bucket, 5 is about 5 KM, 6 about 1 KM.  Stored geohash is 6.
+        :param source_preference: list of source codes, most preferred first;  unlisted sources rank last.
+        :param cc: optional country code to limit the search
+        :param mark: True to mark duplicates, in blocks of block_size rows. See mark_duplicates()
+        :param block_size: rows per update
+        :return: list of duplicate row ids
+        """
+        ranks = {src: idx for idx, src in enumerate(source_preference or [])}
+        unranked = len(ranks)
+        clauses = ["duplicate = 0"]
+        params = []
+        if cc:
+            clauses.append("cc = ?")
+            params.append(cc)
+        sql = f"""select id, name, name_type, cc, feat_class, source, geohash, lat, lon from placenames 
+            where {' and '.join(clauses)} order by cc"""
+
+        dups = []
+        groups = {}
+        current_cc = None
+        for row in self.conn.execute(sql, params):
+            if row["cc"] != current_cc:
+                current_cc = row["cc"]
+                groups = {}
+            gh = row["geohash"]
+            if not gh or len(gh) < precision:
+                gh = point2geohash(row["lat"], row["lon"], precision=precision)
+            key = (_dedup_name(row["name"]), row["name_type"], row["feat_class"], gh[0:precision])
+            rank = (ranks.get(row["source"], unranked), row["id"])
+            kept = groups.get(key)
+            if kept is None:
+                groups[key] = rank
+            elif rank < kept:
+                dups.append(kept[1])
+                groups[key] = rank
+            else:
+                dups.append(row["id"])
+
+        dups.sort()
+        if mark:
+            for x1 in range(0, len(dups), block_size):
+                self.mark_duplicates(dups[x1:x1 + block_size])
+        return dups
+
     def mark_duplicates(self, dups):
         if not dups:
             return False
-        step = 1000
-        for x1 in _array_blocks(dups, step=step):
-            x2 = x1 + step
-            arg = ",".join([str(dup) for dup in dups[x1:x2]])
-            sql = f"update placenames set duplicate=1 where id in ({arg})"
-            self.conn.execute(sql)
+        sql = "update placenames set duplicate=1 where id = ?"
+        self.conn.executemany(sql, [(dup,) for dup in dups])
         self.conn.commit()
         return True
 
@@ -1208,12 +1868,8 @@ class DB:
         """
         if not arr:
             return False
-        step = 1000
-        for x1 in _array_blocks(arr, step=step):
-            x2 = x1 + step
-            arg = ",".join([str(pl) for pl in arr[x1:x2]])
-            sql = f"update placenames set name_type='{t}' where id in ({arg})"
-            self.conn.execute(sql)
+        sql = "update placenames set name_type=? where id = ?"
+        self.conn.executemany(sql, [(t, pl) for pl in arr])
         self.conn.commit()
         return True
 
@@ -1221,13 +1877,15 @@ class DB:
         if not cc:
             print("NULL country code operations must be done manually, carefully.")
             return False
-        sql = f"update placenames set adm1='{to_code}' where cc='{cc}' and adm1='{from_code}'"
+        sql = "update placenames set adm1=? where cc=? and adm1=?"
+        params = (to_code, cc, from_code)
         if from_code == 'NULL':
-            sql = f"update placenames set adm1='{to_code}' where cc='{cc}' and adm1 is NULL"
+            sql = "update placenames set adm1=? where cc=? and adm1 is NULL"
+            params = (to_code, cc)
 
         if self.debug:
-            print(sql)
-        self.conn.execute(sql)
+            print(sql, params)
+        self.conn.execute(sql, params)
         return True
 
     def mark_search_only(self, pid):
@@ -1239,17 +1897,15 @@ class DB:
             sql = "update placenames set search_only=1 where id=?"
             self.conn.execute(sql, (pid,))
         elif isinstance(pid, list):
-            idset = ", ".join([str(x) for x in pid])
-            sql = f"update placenames set search_only=1 where id in ({idset})"
-            self.conn.execute(sql)
+            sql = "update placenames set search_only=1 where id=?"
+            self.conn.executemany(sql, [(x,) for x in pid])
         else:
             raise Exception("Place ID integer or list of integers is required")
 
     def update_bias(self, name_bias, rowids):
-        arg = ",".join([str(pid) for pid in rowids])
         flag = 1 if name_bias < 0 else 0
-        sql = f"update placenames set name_bias=?, search_only=? where id in ({arg})"
-        self.conn.execute(sql, (name_bias, flag,))
+        sql = "update placenames set name_bias=?, search_only=? where id = ?"
+        self.conn.executemany(sql, [(name_bias, flag, pid) for pid in rowids])
 
     def update_bias_by_name(self, name_bias, name):
         flag = 1 if name_bias < 0 else 0
@@ -1257,6 +1913,118 @@ class DB:
         self.conn.execute(sql, (name_bias, flag, name,))
 
 
+_PLACENAMES = "placenames"
+_RTREE_PLACENAMES = "placenames_rtree join placenames on placenames.id = placenames_rtree.id"
+_FTS_PLACENAMES = "placenames_fts join placenames on placenames.id = placenames_fts.rowid"
+_RTREE_CLAUSES = ("placenames_rtree.min_lat <= ?", "placenames_rtree.max_lat >= ?",
+                  "placenames_rtree.min_lon <= ?", "placenames_rtree.max_lon >= ?")
+
+
+def _as_columns(columns):
+    """
+    Hashable column selection for _select_sql(); None means all columns.
+    """
+    if not columns:
+        return None
+    return frozenset(columns).union(PLACE_REQUIRED_COLUMNS)
+
+
+@lru_cache(maxsize=STATEMENT_CACHE_SIZE)
+def _select_sql(columns, source: str, clauses: tuple, criteria: str = "", limit=False) -> str:
+    """
+    Build a placenames SELECT for a statement shape -- columns, source tables and clauses with "?" parameters.
+    The text for a shape is built once and is identical on every call, so SQLite reuses the prepared statement.
+
+    :param columns: frozenset from _as_columns() or None for all columns
+    :param source: table or join expression
+    :param clauses: tuple of conditions joined by AND
+    :param criteria: literal SQL appended after the conditions
+    :param limit: True to add a "limit ?" parameter
+    :return: SQL text
+    """
+    if columns:
+        unknown = columns.difference(PLACENAMES_COLUMNS)
+        if unknown:
+            raise Exception(f"Unknown placenames columns {sorted(unknown)}")
+        select = ", ".join([f"placenames.{col}" for col in PLACENAMES_COLUMNS if col in columns])
+    else:
+        select = "placenames.*"
+    sql = [f"select {select} from {source}"]
+    if clauses:
+        sql.append("where")
+        sql.append(" and ".join(clauses))
+    if criteria:
+        # Include the " AND " yourself in criteria
+        sql.append(criteria)
+    if limit:
+        sql.append("limit ?")
+    return " ".join(sql)
+
+
+def _fts_phrase(text: str) -> str:
+    """ Quote text as a single FTS5 string, so query syntax in text is not interpreted """
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _fts_words(text: str, prefix=False) -> str:
+    """ FTS5 query requiring all words of text;  with prefix=True the last word is a prefix """
+    words = [_fts_phrase(w) for w in text.split()]
+    if prefix and words:
+        words[-1] += "*"
+    return " ".join(words)
+
+
+def _id_key(row):
+    return row["id"]
+
+
+def _distance_key(found):
+    return found[0]
+
+
+def _bounding_box(lat: float, lon: float, radius: int):
+    """
+    Bounding box in degrees that contains every point within radius meters of lat, lon on the sphere used by
+    distance_haversine(). Boxes touching a pole or crossing the antimeridian span all longitudes.
+    :return: tuple of min_lat, max_lat, min_lon, max_lon
+    """
+    # Pad by a meter, as distance_haversine() truncates to whole meters.
+    angle = (radius + 1) / EARTH_RADIUS_WGS84
+    dlat = degrees(angle)
+    min_lat, max_lat = lat - dlat, lat + dlat
+    if min_lat <= -90 or max_lat >= 90 or angle >= pi / 2:
+        return max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0
+
+    ratio = sin(angle) / cos(radians(lat))
+    if ratio >= 1:
+        return min_lat, max_lat, -180.0, 180.0
+    dlon = degrees(asin(ratio))
+    min_lon, max_lon = lon - dlon, lon + dlon
+    if min_lon < -180 or max_lon > 180:
+        return min_lat, max_lat, -180.0, 180.0
+    return min_lat, max_lat, min_lon, max_lon
+
+
+def _places_within(lat: float, lon: float, places: list, radius: int):
+    """
+    Distance filter
+    :return: list of (distance, place) for those places within radius meters of lat, lon
+    """
+    if not places:
+        return []
+    distances = distance_haversine_many(lon, lat, [place.lon for place in places], [place.lat for place in places])
+    return [(dist, place) for dist, place in zip(distances.tolist(), places) if dist < radius]
+
+
+def _union_bounds(b1, b2):
+    """
+    Union of two bounding boxes (min_lat, max_lat, min_lon, max_lon); b1 may be None.
+    """
+    if b1 is None:
+        return b2
+    return min(b1[0], b2[0]), max(b1[1], b2[1]), min(b1[2], b2[2]), max(b1[3], b2[3])
+
+
 def _array_blocks(arr, step=1000):
     """
     Break up large arrays so we have predictable updates or queries.
@@ -1272,6 +2040,72 @@ def _array_blocks(arr, step=1000):
     return blocks
 
 
+def file_chunks(path: str, count: int, start=0) -> list:
+    """
+    Split a file into about `count` byte ranges that start and end on line boundaries.
+    :param path: file path
+    :param count: number of ranges desired
+    :param start: offset of a line to start from
+    :return: list of (start, end) byte offsets, in file order
+    """
+    size = os.path.getsize(path)
+    step = max(1, (size - start) // max(1, count))
+    offsets = [start]
+    with open(path, "rb") as fh:
+        pos = start + step
+        while pos < size:
+            fh.seek(pos)
+            fh.readline()  # Move to the start of the next line
+            pos = fh.tell()
+            if pos >= size:
+                break
+            offsets.append(pos)
+            pos += step
+    offsets.append(size)
+    return [(start, end) for start, end in zip(offsets[:-1], offsets[1:]) if end > start]
+
+
+def chunk_lines(path: str, start: int, end: int, encoding="UTF-8"):
+    """
+    Lines of the text file within the byte range given by file_chunks()
+    :return: generator of str
+    """
+    with open(path, "rb") as fh:
+        fh.seek(start)
+        while fh.tell() < end:
+            line = fh.readline()
+            if not line:
+                break
+            yield line.decode(encoding)
+
+
+# DataSource being normalized by worker processes, inherited by fork.
+_worker_source = None
+
+
+def _normalize_chunk(chunk):
+    """
+    Worker: parse one chunk of the source file and prepare records for insertion.
+    :return: tuple of (records, excluded_terms, error) where error is None or the formatted exception;
+             no records are returned for a chunk that failed.
+    """
+    source = _worker_source
+    source.excluded_terms = set([])
+    sourcefile, start, end = chunk
+    records = []
+    try:
+        for geo in source.process_chunk(sourcefile, start, end):
+            if not geo:
+                continue
+            if isinstance(geo, Place):
+                geo = as_place_record(geo, target="db")
+            source.db._prep_place(geo)
+            records.append(geo)
+    except Exception:
+        return [], source.excluded_terms, format_exc(limit=5)
+    return records, source.excluded_terms, None
+
+
 def add_location(geo, lat, lon, add_geohash=False):
     """
     Insert validated location coordinate and geohash
@@ -1308,12 +2142,16 @@ class DataSource:
         self.quiet = False
         self.source_name = None
         self.debug = debug
+        # Parallel normalize: row IDs for records without one are id_offset + position of the record in the file.
+        self.id_offset = 0
+        self.batch_size = 10000
 
     def purge(self):
         print(f"Purging entries for {self.source_name}")
         for k in self.source_keys:
             print(f"\tsource ID = {k}")
             self.db.purge({"source": k})
+        self.db.clear_checkpoint(self.source_name)
 
     def process_source(self, sourcefile, limit=-1):
         """
@@ -1324,41 +2162,247 @@ class DataSource:
         """
         yield None
 
-    def normalize(self, sourcefile, limit=-1, optimize=False):
+    def process_chunk(self, sourcefile, start, end):
+        """
+        generator yielding DB geo dictionary to be stored, for the lines of the source file
+        in the byte range start..end -- see chunk_lines().  Required for normalize(..., workers=N).
+        Runs in a worker process, so it must not use the database.  The chunk at start=0 includes any header.
+        :param sourcefile: Raw data file
+        :param start: byte offset of first line
+        :param end: byte offset after last line
+        :return: generator of Place object or dict of Place schema
+        """
+        raise NotImplementedError(f"{self.__class__.__name__} does not support parallel normalize")
+
+    def normalize(self, sourcefile, limit=-1, optimize=False, workers=1, resume=False):
         """
         Given the spreadsheet or source file rip through it, ingesting contents into the master gazetteer.
+        Progress is checkpointed in the DB (see DB.set_checkpoint) with every committed batch.
         :param sourcefile: input file
         :param limit: non-zero limit for testing
         :param optimize: if database should be optimized when done.
+        :param workers: number of worker processes parsing chunks of sourcefile with process_chunk().
+            Records are inserted in file order by this process.  Sources that do not implement process_chunk(),
+            or platforms without fork, are normalized serially.
+        :param resume: continue after the last checkpoint for this source and file, rather than from the start.
         :return:
         """
         print("\n============================")
         print(f"Start {self.source_name}. {arrow.now()}  FILE={sourcefile}")
+        checkpoint = self._start_checkpoint(sourcefile, resume)
+        try:
+            if checkpoint["complete"]:
+                print("Source file already loaded")
+            elif workers > 1 and self._parallel_supported():
+                self._normalize_parallel(sourcefile, checkpoint, limit=limit, workers=workers)
+            else:
+                self._normalize(sourcefile, checkpoint, limit=limit)
+        except Exception:
+            # Uncommitted rows are discarded.  normalize(..., resume=True) continues from the last checkpoint.
+            self.db.rollback()
+            raise
+        self.db.close()
+        self.db.checkpoint = None
+        if optimize:
+            self.db.optimize()
+
+        print("ROWS: ", self.rowcount)
+        print("EXCLUSIONS: ", len(self.excluded_terms))
+        if self.debug:
+            print("EXCLUSIONS:", self.excluded_terms)
+        print(f"End {self.source_name}. {arrow.now()}")
+
+    def _start_checkpoint(self, sourcefile, resume):
+        """
+        Checkpoint state to resume from, or a new one.
+        """
+        name = os.path.basename(sourcefile)
+        filesize = os.path.getsize(sourcefile)
+        checkpoint = self.db.get_checkpoint(self.source_name, name) if resume else None
+        if checkpoint:
+            if checkpoint["filesize"] != filesize:
+                raise Exception(f"Source file changed since last checkpoint. Cannot resume {sourcefile}")
+            print(f"Resuming after row {checkpoint['rowcount']}")
+            del checkpoint["updated"]
+        else:
+            checkpoint = {"rowcount": 0, "offset": 0, "complete": 0}
+            self.db.set_checkpoint(self.source_name, name, 0, offset=0, filesize=filesize)
+        checkpoint.update({"source": self.source_name, "sourcefile": name, "filesize": filesize})
+        return checkpoint
+
+    def _parallel_supported(self):
+        """
+        Workers need process_chunk() from the subclass and inherit this source by fork.
+        """
+        if type(self).process_chunk is DataSource.process_chunk:
+            print(f"{self.__class__.__name__} does not implement process_chunk; normalizing serially")
+            return False
+        if "fork" not in multiprocessing.get_all_start_methods():
+            print("Worker processes require fork; normalizing serially")
+            return False
+        return True
+
+    def _normalize_parallel(self, sourcefile, checkpoint, limit=-1, workers=2):
+        """
+        Worker processes parse chunks and prepare records; this process inserts them in batches.
+        Chunks are consumed in file order, so row order and assigned row IDs are the same on every run.
+        Row IDs are id_offset + the position of the record in the file, as with process_source().
+        Each chunk is committed with the checkpoint, its end offset.  As in the serial path, a failure
+        is reported and ends the run:  the failed chunk is not inserted, and resume=True retries it.
+        """
+        global _worker_source
+        if checkpoint["offset"] is None:
+            raise Exception("Checkpoint from a serial normalize cannot be resumed with workers")
+        self.db.close()  # Flush pending rows before forking
+        self.db.reopen()
+        self.rowcount = checkpoint["rowcount"]
+        # Records in the file before the current one
+        position = checkpoint["rowcount"]
+        chunks = [(sourcefile, start, end)
+                  for start, end in file_chunks(sourcefile, workers * 8, start=checkpoint["offset"])]
+        _worker_source = self
+        ctx = multiprocessing.get_context("fork")
+        batch = []
+        try:
+            with ctx.Pool(processes=workers) as pool:
+                for (records, excluded, error), (_, start, end) in zip(pool.imap(_normalize_chunk, chunks), chunks):
+                    self.excluded_terms.update(excluded)
+                    if error:
+                        print(f"Error with chunk {start}..{end} of {sourcefile}")
+                        print(error)
+                        pool.terminate()
+                        raise Exception(f"Failed to normalize {sourcefile} at offset {start}")
+                    for geo in records:
+                        if 0 < limit <= self.rowcount:
+                            break
+                        position += 1
+                        self.rowcount += 1
+                        if self.rowcount % self.rate == 0 and not self.quiet:
+                            print(f"Row {self.rowcount}")
+                        if geo.get("id") is None:
+                            geo["id"] = self.id_offset + position
+                        batch.append(geo)
+                        if len(batch) >= self.batch_size:
+                            self.db._insert_batch(batch, commit=False)
+                            batch = []
+                    if 0 < limit <= self.rowcount:
+                        # Partial chunk has no end offset, so only a serial normalize can resume from here.
+                        print("Reached non-zero limit for testing.")
+                        checkpoint.update({"rowcount": position, "offset": None})
+                        self.db._insert_batch(batch, checkpoint=checkpoint)
+                        pool.terminate()
+                        return
+                    checkpoint.update({"rowcount": position, "offset": end})
+                    self.db._insert_batch(batch, checkpoint=checkpoint)
+                    batch = []
+            checkpoint["complete"] = 1
+            self.db.set_checkpoint(**checkpoint)
+        except sqlite3.IntegrityError:
+            print("Data integrity issue")
+            print(format_exc(limit=5))
+            self.db.conn.rollback()
+        finally:
+            _worker_source = None
+
+    def _normalize(self, sourcefile, checkpoint, limit=-1):
+        # Position counts records from process_source.  The checkpoint saved with each committed batch
+        # is the position of the last record in that batch.
+        skip = checkpoint["rowcount"]
+        position = 0
+        checkpoint["offset"] = None
+        self.db.checkpoint = checkpoint
         for geo in self.process_source(sourcefile, limit=limit):
+            position += 1
+            if position <= skip:
+                continue
             if self.rowcount % self.rate == 0 and not self.quiet:
                 print(f"Row {self.rowcount}")
             if 0 < limit < self.rowcount:
                 print("Reached non-zero limit for testing.")
-                break
+                return
             try:
+                checkpoint["rowcount"] = position
                 self.db.add_place(geo)
             except sqlite3.IntegrityError:
                 print("Data integrity issue")
                 print(format_exc(limit=5))
                 print(self.db.queue)
-                break
+                return
             except Exception:
                 print("Error with insertion to DB")
                 print(format_exc(limit=5))
-        self.db.close()
-        if optimize:
-            self.db.optimize()
+        # Last batch is saved with the completed checkpoint on close()
+        checkpoint["complete"] = 1
 
-        print("ROWS: ", self.rowcount)
-        print("EXCLUSIONS: ", len(self.excluded_terms))
-        if self.debug:
-            print("EXCLUSIONS:", self.excluded_terms)
-        print(f"End {self.source_name}. {arrow.now()}")
+
+class GeonamesOrgSource(DataSource):
+    """
+    Geonames.org dump, e.g. allCountries.txt or a per-country file:  tab-delimited, no header,
+    one feature per line.  Each feature yields its name and its ASCII name, if different.
+    Alternate names are not loaded here.  FIPS_cc is left for downstream enrichment.
+    id_bias and name_bias are estimated with PlaceHeuristics, which needs the Xponents project resources
+    (stop terms, filters and ./tmp/wordstats.sqlite) in the working directory.
+    """
+    COLUMNS = ["geonameid", "name", "asciiname", "alternatenames", "lat", "lon", "feat_class", "feat_code",
+               "cc", "cc2", "adm1", "adm2", "adm3", "adm4", "population", "elevation", "dem", "timezone",
+               "modified"]
+
+    def __init__(self, dbf, debug=False, ver=None):
+        DataSource.__init__(self, dbf, debug=debug, ver=ver)
+        self.source_name = "Geonames.org"
+        self.source_keys = [GAZETTEER_SOURCES[self.source_name]]
+        # Loaded here, before any fork, so parallel workers share it.
+        self.estimator = PlaceHeuristics(self.db)
+
+    def _parse(self, line: str):
+        """
+        Parse one line of the dump.
+        :return: list of place records, possibly empty
+        """
+        row = line.rstrip("\r\n").split("\t")
+        if len(row) != len(self.COLUMNS):
+            return []
+        row = dict(zip(self.COLUMNS, row))
+        geo = {
+            "place_id": f"G{row['geonameid']}",
+            "feat_class": row["feat_class"] or None,
+            "feat_code": row["feat_code"] or None,
+            "cc": row["cc"] or None,
+            "FIPS_cc": None,
+            "adm1": row["adm1"] or None,
+            "adm2": row["adm2"] or None,
+            "source": self.source_keys[0],
+            "name_type": "N"
+        }
+        if not add_location(geo, row["lat"], row["lon"], add_geohash=True):
+            return []
+        names = [normalize_name(row["name"])]
+        asciiname = normalize_name(row["asciiname"])
+        if asciiname and asciiname != names[0]:
+            names.append(asciiname)
+        records = []
+        for nm in names:
+            if not nm:
+                continue
+            rec = dict(geo)
+            rec["name"] = nm
+            rec["name_group"] = name_group_for(nm)
+            self.estimator.estimate_bias(rec, name_group=rec["name_group"])
+            records.append(rec)
+        return records
+
+    def process_source(self, sourcefile, limit=-1):
+        with open(sourcefile, "r", encoding="UTF-8") as fh:
+            for line in fh:
+                for geo in self._parse(line):
+                    self.rowcount += 1
+                    geo["id"] = self.id_offset + self.rowcount
+                    yield geo
+
+    def process_chunk(self, sourcefile, start, end):
+        for line in chunk_lines(sourcefile, start, end):
+            for geo in self._parse(line):
+                yield geo
 
 
 class GazetteerIndex:
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Geohash encoding and decoding without the overhead of general purpose geodesy objects.
+
+Cells are computed by quantizing latitude and longitude to the integer cell index
+on each axis and interleaving the bits with lookup tables. Results are the same as
+the bisection done by `pygeodesy.geohash`:  `encode`, `decode`, `bounds` and `neighbors`
+are drop-in replacements for those functions.  `encode_many` and `decode_many`
+serve bulk ETL and query batches.
+"""
+from math import log10
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+MAX_PRECISION = 12
+EPS = 2.220446049250313e-16  # Inferred precision tolerance, as in pygeodesy.
+
+_BASE32_INDEX = {ch: idx for idx, ch in enumerate(BASE32)}
+_BASE32_INDEX.update({ch.upper(): idx for ch, idx in list(_BASE32_INDEX.items()) if ch.isalpha()})
+
+
+def _spread_byte(x):
+    """ Insert a zero bit after each bit of x: 0b1011 => 0b1000101 """
+    v = 0
+    for bit in range(8):
+        v |= ((x >> bit) & 1) << (2 * bit)
+    return v
+
+
+def _compact_byte(x):
+    """ Keep the even bits of x, the inverse of _spread_byte for 8 bits """
+    v = 0
+    for bit in range(4):
+        v |= ((x >> (2 * bit)) & 1) << bit
+    return v
+
+
+_SPREAD = [_spread_byte(x) for x in range(256)]
+_COMPACT = [_compact_byte(x) for x in range(256)]
+# Bit shifts for each character of a geohash of a given precision, most significant first.
+_SHIFTS = [tuple(range(5 * (p - 1), -1, -5)) for p in range(MAX_PRECISION + 1)]
+
+# Adjacency tables from https://github.com/davetroy/geohash-js, keyed by (direction, odd length)
+_NEIGHBORS = {
+    "N": ("p0r21436x8zb9dcf5h7kjnmqesgutwvy", "bc01fg45238967deuvhjyznpkmstqrwx"),
+    "S": ("14365h7k9dcfesgujnmqp0r2twvyx8zb", "238967debc01fg45kmstqrwxuvhjyznp"),
+    "E": ("bc01fg45238967deuvhjyznpkmstqrwx", "p0r21436x8zb9dcf5h7kjnmqesgutwvy"),
+    "W": ("238967debc01fg45kmstqrwxuvhjyznp", "14365h7k9dcfesgujnmqp0r2twvyx8zb")
+}
+_BORDERS = {
+    "N": ("prxz", "bcfguvyz"),
+    "S": ("028b", "0145hjnp"),
+    "E": ("bcfguvyz", "prxz"),
+    "W": ("0145hjnp", "028b")
+}
+
+
+def _spread(x):
+    """ Interleave zero bits into a cell index of up to 32 bits. """
+    return (_SPREAD[x & 0xFF]
+            | _SPREAD[(x >> 8) & 0xFF] << 16
+            | _SPREAD[(x >> 16) & 0xFF] << 32
+            | _SPREAD[(x >> 24) & 0xFF] << 48)
+
+
+def _compact(x):
+    """ Collect the even bits of a code of up to 64 bits. """
+    v = 0
+    for shift in range(0, 64, 8):
+        v |= _COMPACT[(x >> shift) & 0xFF] << (shift >> 1)
+        if not x >> (shift + 8):
+            break
+    return v
+
+
+def _quantize(value, low, size, cells):
+    """
+    Index of the cell containing value.  Cell edges `low + q*size` are exact binary fractions,
+    so checking the edges corrects any rounding in the division and agrees with bisection:
+    a value on an edge belongs to the upper cell; the top edge belongs to the last cell.
+    """
+    q = int((value - low) / size)
+    if q >= cells:
+        q = cells - 1
+    elif q < 0:
+        q = 0
+    if value < low + q * size:
+        q -= 1
+    elif q + 1 < cells and value >= low + (q + 1) * size:
+        q += 1
+    return q
+
+
+def _bits(precision):
+    """ Bits of longitude and latitude in a geohash of the given length """
+    total = 5 * precision
+    return total - total // 2, total // 2
+
+
+def _check_point(lat, lon):
+    lat, lon = float(lat), float(lon)
+    if not -90 <= lat <= 90:
+        raise ValueError(f"Invalid latitude {lat}")
+    if not -180 <= lon <= 180:
+        raise ValueError(f"Invalid longitude {lon}")
+    return lat, lon
+
+
+def _check_precision(precision):
+    p = int(precision)
+    if not 1 <= p <= MAX_PRECISION:
+        raise ValueError(f"Invalid geohash precision {precision}")
+    return p
+
+
+def _encode_cell(qlon, qlat, lon_bits, lat_bits, precision):
+    # Longitude takes the most significant bit, so it lands on the odd bit positions when
+    # the total number of bits is even.
+    if lon_bits == lat_bits:
+        code = _spread(qlon) << 1 | _spread(qlat)
+    else:
+        code = _spread(qlon) | _spread(qlat) << 1
+    return "".join([BASE32[(code >> shift) & 31] for shift in _SHIFTS[precision]])
+
+
+def _encode(lat, lon, precision):
+    lon_bits, lat_bits = _bits(precision)
+    lon_cells, lat_cells = 1 << lon_bits, 1 << lat_bits
+    qlon = _quantize(lon, -180.0, 360.0 / lon_cells, lon_cells)
+    qlat = _quantize(lat, -90.0, 180.0 / lat_cells, lat_cells)
+    return _encode_cell(qlon, qlat, lon_bits, lat_bits, precision)
+
+
+def _mid_ndigits(a, b):
+    """ Center of a..b and the number of digits worth reporting, per pygeodesy. """
+    return (a + b) * 0.5, int(2 - log10(a - b))
+
+
+def _infer_precision(lat, lon, eps):
+    """ Shortest geohash whose rounded center is within eps of the point, up to MAX_PRECISION """
+    lon_bits, lat_bits = _bits(MAX_PRECISION)
+    lon_cells, lat_cells = 1 << lon_bits, 1 << lat_bits
+    qlon = _quantize(lon, -180.0, 360.0 / lon_cells, lon_cells)
+    qlat = _quantize(lat, -90.0, 180.0 / lat_cells, lat_cells)
+    for precision in range(1, MAX_PRECISION):
+        b_lon, b_lat = _bits(precision)
+        s, w, n, e = _cell_bounds(qlon >> (lon_bits - b_lon), qlat >> (lat_bits - b_lat), b_lon, b_lat)
+        if abs(lon - round(*_mid_ndigits(e, w))) < eps and abs(lat - round(*_mid_ndigits(n, s))) < eps:
+            return precision
+    return MAX_PRECISION
+
+
+def encode(lat, lon, precision=None, eps=EPS):
+    """
+    Encode a point as a geohash.
+
+    :param lat: latitude
+    :param lon: longitude
+    :param precision: geohash length 1..12, or None to infer the length from `eps`
+    :param eps: tolerance in degrees used to infer precision
+    :return: geohash
+    """
+    lat, lon = _check_point(lat, lon)
+    if precision:
+        precision = _check_precision(precision)
+    else:
+        precision = _infer_precision(lat, lon, max(eps, EPS))
+    return _encode(lat, lon, precision)
+
+
+def encode_many(lats, lons, precision=6):
+    """
+    Encode parallel arrays of latitude and longitude at a fixed precision.
+
+    :param lats: array of latitudes
+    :param lons: array of longitudes
+    :param precision: geohash length 1..12
+    :return: list of geohashes
+    """
+    precision = _check_precision(precision)
+    lon_bits, lat_bits = _bits(precision)
+    lon_cells, lat_cells = 1 << lon_bits, 1 << lat_bits
+    lon_size, lat_size = 360.0 / lon_cells, 180.0 / lat_cells
+    result = []
+    for lat, lon in zip(lats, lons):
+        lat, lon = _check_point(lat, lon)
+        qlon = _quantize(lon, -180.0, lon_size, lon_cells)
+        qlat = _quantize(lat, -90.0, lat_size, lat_cells)
+        result.append(_encode_cell(qlon, qlat, lon_bits, lat_bits, precision))
+    return result
+
+
+def _decode_cell(geohash):
+    """ Cell indices of a geohash:  (qlon, qlat, lon_bits, lat_bits) """
+    if not geohash:
+        raise ValueError("Null geohash")
+    code = 0
+    try:
+        for ch in geohash:
+            code = code << 5 | _BASE32_INDEX[ch]
+    except KeyError:
+        raise ValueError(f"Invalid geohash {geohash}")
+    lon_bits, lat_bits = _bits(len(geohash))
+    if lon_bits == lat_bits:
+        return _compact(code >> 1), _compact(code), lon_bits, lat_bits
+    return _compact(code), _compact(code >> 1), lon_bits, lat_bits
+
+
+def _cell_bounds(qlon, qlat, lon_bits, lat_bits):
+    lon_size = 360.0 / (1 << lon_bits)
+    lat_size = 180.0 / (1 << lat_bits)
+    s = -90.0 + qlat * lat_size
+    w = -180.0 + qlon * lon_size
+    return s, w, s + lat_size, w + lon_size
+
+
+def bounds(geohash):
+    """
+    :param geohash: geohash
+    :return: tuple of cell edges (south, west, north, east)
+    """
+    return _cell_bounds(*_decode_cell(geohash))
+
+
+def _center(geohash):
+    s, w, n, e = bounds(geohash)
+    lat, lat_digits = _mid_ndigits(n, s)
+    lon, lon_digits = _mid_ndigits(e, w)
+    return lat, lat_digits, lon, lon_digits
+
+
+def _fstr(value, digits):
+    """ Format as pygeodesy does:  beyond one decimal place trailing zeros are dropped """
+    txt = "%.*f" % (digits, value)
+    if digits > 1:
+        dot = txt.find(".")
+        txt = txt[:dot + 2] + txt[dot + 2:].rstrip("0")
+    return txt
+
+
+def decode(geohash):
+    """
+    Center of the geohash cell, rounded to the number of digits the cell size supports.
+
+    :param geohash: geohash
+    :return: tuple of strings (lat, lon)
+    """
+    lat, lat_digits, lon, lon_digits = _center(geohash)
+    return _fstr(lat, lat_digits), _fstr(lon, lon_digits)
+
+
+def decode2(geohash):
+    """
+    Same as `decode`, but the center is returned as floats.
+
+    :param geohash: geohash
+    :return: tuple of floats (lat, lon)
+    """
+    lat, lat_digits, lon, lon_digits = _center(geohash)
+    return round(lat, lat_digits), round(lon, lon_digits)
+
+
+def decode_many(geohashes):
+    """
+    :param geohashes: array of geohashes
+    :return: list of (lat, lon) float tuples, as `decode2`
+    """
+    return [decode2(gh) for gh in geohashes]
+
+
+def adjacent(geohash, direction):
+    """
+    Adjacent cell of the same precision in the given direction.
+
+    :param geohash: geohash
+    :param direction: one of N, S, E, W
+    :return: geohash
+    """
+    neighbors = _NEIGHBORS.get(direction)
+    if not neighbors:
+        raise ValueError(f"Invalid direction {direction}")
+    odd = len(geohash) & 1
+    last = geohash[-1:]
+    idx = neighbors[odd].find(last)
+    if idx < 0:
+        raise ValueError(f"Invalid geohash {geohash}")
+    parent = geohash[:-1]
+    if parent and last in _BORDERS[direction][odd]:
+        parent = adjacent(parent, direction)
+    return parent + BASE32[idx]
+
+
+def neighbors(geohash):
+    """
+    The 8 cells surrounding a geohash.
+
+    :param geohash: geohash
+    :return: dict keyed by direction N, NE, E, SE, S, SW, W, NW
+    """
+    north = adjacent(geohash, "N")
+    south = adjacent(geohash, "S")
+    return {
+        "N": north,
+        "NE": adjacent(north, "E"),
+        "E": adjacent(geohash, "E"),
+        "SE": adjacent(south, "E"),
+        "S": south,
+        "SW": adjacent(south, "W"),
+        "W": adjacent(geohash, "W"),
+        "NW": adjacent(north, "W")
+    }
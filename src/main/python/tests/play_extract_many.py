@@ -0,0 +1,28 @@
+"""
+Throughput of XTemporal over many short messages, serial versus PatternExtractor.extract_many() pools.
+
+    python3 play_extract_many.py --count 20000 --workers 4
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+
+from opensextant.extractors.xtemporal import XTemporal
+
+ap = ArgumentParser()
+ap.add_argument("--count", type=int, default=20000, help="number of messages")
+ap.add_argument("--workers", type=int, default=4)
+args = ap.parse_args()
+
+rnd = Random(1)
+vocab = "status update from node seven at 2021-03-04 12:30:00 or on 4 March 2021 all clear".split()
+messages = [" ".join([rnd.choice(vocab) for _ in range(40)]) for _ in range(args.count)]
+
+extractor = XTemporal()
+for executor, workers in [("serial", 1), ("thread", args.workers), ("process", args.workers)]:
+    t0 = perf_counter()
+    total = 0
+    for matches, error in extractor.extract_many(messages, workers=workers, executor=executor, batch_size=64):
+        total += len(matches)
+    sec = perf_counter() - t0
+    print(f"{executor:<8} workers={workers}  {sec:7.2f} s  {args.count / sec:8.0f} msg/s  matches={total}")
@@ -0,0 +1,77 @@
+"""
+Memory used by Place and PlaceCandidate objects, with __slots__ versus a per-instance __dict__
+holding the same attributes, which is how these classes were laid out before.
+
+    python3 play_memory.py --count 200000
+"""
+import tracemalloc
+from argparse import ArgumentParser
+
+from opensextant import Place, PlaceCandidate
+
+
+class DictRecord:
+    """ Plain object, attributes kept in __dict__ """
+    pass
+
+
+def slot_names(cls):
+    names = []
+    for klass in cls.__mro__:
+        names.extend(getattr(klass, "__slots__", ()))
+    return names
+
+
+def as_dict_record(obj, names):
+    rec = DictRecord()
+    for nm in names:
+        setattr(rec, nm, getattr(obj, nm))
+    return rec
+
+
+def make_place(i):
+    pl = Place(f"G{i}", f"Place {i}", lat=40 + (i % 1000) * 0.001, lon=-70 - (i % 1000) * 0.001)
+    pl.id = i
+    pl.country_code = "US"
+    pl.feature_class = "P"
+    pl.feature_code = "PPL"
+    pl.adm1 = "MA"
+    pl.geohash = "drt2zp"
+    return pl
+
+
+def make_candidate(i):
+    pc = PlaceCandidate(f"Place {i}", i, i + 10)
+    pc.place = make_place(i)
+    return pc
+
+
+def measure(label, count, factory):
+    tracemalloc.start()
+    objects = [factory(i) for i in range(count)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<30} {current / 2**20:8.1f} MB  {current / count:6.0f} bytes/object")
+    return objects
+
+
+ap = ArgumentParser()
+ap.add_argument("--count", type=int, default=100000)
+args = ap.parse_args()
+
+# Legacy layout also kept X, Y beside lat, lon
+place_names = slot_names(Place) + ["X", "Y"]
+measure("Place (__slots__)", args.count, make_place)
+measure("Place (__dict__)", args.count, lambda i: as_dict_record(make_place(i), place_names))
+
+candidate_names = slot_names(PlaceCandidate)
+
+
+def make_dict_candidate(i):
+    pc = as_dict_record(make_candidate(i), candidate_names)
+    pc.place = as_dict_record(pc.place, place_names)
+    return pc
+
+
+measure("PlaceCandidate (__slots__)", args.count, make_candidate)
+measure("PlaceCandidate (__dict__)", args.count, make_dict_candidate)
@@ -0,0 +1,44 @@
+"""
+Cost per regex hit of building PatternMatch objects, in time and memory, for XCoord and XTemporal
+over numeric text where most hits are rejected by normalize() or filtered out.
+
+    python3 play_pattern_match.py --words 50000
+"""
+import tracemalloc
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+
+from opensextant.FlexPat import RuleProfile
+from opensextant.extractors.xcoord import XCoord
+from opensextant.extractors.xtemporal import XTemporal
+
+ap = ArgumentParser()
+ap.add_argument("--words", type=int, default=50000, help="size of synthetic document in words")
+args = ap.parse_args()
+
+rnd = Random(1)
+vocab = ("12 34 56.7 1200 17.5N 42 18 W 33-44-55 4 March 2021 2021-03-04 12:30:00 +40.1234 -70.5678 "
+         "N42 18 W102 report from station alpha reading").split()
+text = " ".join([rnd.choice(vocab) for _ in range(args.words)])
+
+for extractor in [XCoord(), XTemporal()]:
+    name = extractor.__class__.__name__
+    extractor.profile = RuleProfile()
+    extractor.extract(text)
+    hits = sum([st["hits"] for st in extractor.profile.as_dict().values()])
+    extractor.profile = None
+
+    t0 = perf_counter()
+    found = extractor.extract(text)
+    sec = perf_counter() - t0
+    del found
+
+    tracemalloc.start()
+    found = extractor.extract(text)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    kept = len([m for m in found if not m.filtered_out])
+    print(f"{name:<10} hits={hits:<7} returned={len(found):<7} valid={kept:<6} {sec:6.2f} s"
+          f"  {1e6 * sec / max(hits, 1):6.1f} us/hit  peak {peak / max(hits, 1):6.0f} B/hit"
+          f"  retained {current / max(len(found), 1):6.0f} B/match")
@@ -0,0 +1,39 @@
+"""
+Compare scans with and without trigger prefilters for XCoord and XTemporal over synthetic documents,
+one with numbers throughout and one of plain prose, or over a file of your own.
+
+    python3 play_pattern_scan.py [--file some.log]
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+
+from opensextant.extractors.xcoord import XCoord
+from opensextant.extractors.xtemporal import XTemporal
+
+ap = ArgumentParser()
+ap.add_argument("--file", help="text file to scan")
+ap.add_argument("--words", type=int, default=100000, help="size of synthetic document in words")
+args = ap.parse_args()
+
+docs = {}
+if args.file:
+    with open(args.file, "r", encoding="UTF-8") as fh:
+        docs[args.file] = fh.read()
+else:
+    rnd = Random(1)
+    vocab = ("report from station alpha at 1200 hours on 12 March, sensor 42 reading 17.5 "
+             "the quick brown fox jumps over the lazy dog").split()
+    docs["numeric"] = " ".join([rnd.choice(vocab) for _ in range(args.words)])
+    vocab = "the quick brown fox jumps over the lazy dog; meeting notes follow.".split()
+    docs["prose"] = " ".join([rnd.choice(vocab) for _ in range(args.words)])
+
+for extractor in [XCoord(), XTemporal()]:
+    for name, text in docs.items():
+        for triggers in [False, True]:
+            extractor.triggers = triggers
+            t0 = perf_counter()
+            found = extractor.extract(text)
+            sec = perf_counter() - t0
+            print(f"{extractor.__class__.__name__:<10} {name:<8} triggers={triggers!s:<6}"
+                  f" {sec:7.3f} s  matches={len(found)}")
@@ -0,0 +1,37 @@
+"""
+Time reduce_matches and reduce_matches_dict on growing numbers of matches spread over a long text,
+as seen with XCoord/XTemporal candidates in large log files.  Time per match should stay flat.
+
+    python3 play_reduce_matches.py --max 200000
+"""
+from argparse import ArgumentParser
+from random import Random
+from time import perf_counter
+
+from opensextant import TextMatch, reduce_matches, reduce_matches_dict
+
+ap = ArgumentParser()
+ap.add_argument("--max", type=int, default=100000, help="largest number of matches")
+args = ap.parse_args()
+
+rnd = Random(1)
+count = 1000
+while count <= args.max:
+    spans = []
+    for _ in range(count):
+        x1 = rnd.randint(0, count * 40)
+        spans.append((x1, x1 + rnd.randint(1, 30)))
+
+    matches = [TextMatch("x", x1, x2) for x1, x2 in spans]
+    t0 = perf_counter()
+    reduce_matches(matches)
+    obj_sec = perf_counter() - t0
+
+    annots = [{"start": x1, "end": x2} for x1, x2 in spans]
+    t0 = perf_counter()
+    reduce_matches_dict(annots)
+    dict_sec = perf_counter() - t0
+
+    print(f"N={count:<8} reduce_matches {obj_sec:8.3f} s ({1e6 * obj_sec / count:5.1f} us/match)"
+          f"   reduce_matches_dict {dict_sec:8.3f} s ({1e6 * dict_sec / count:5.1f} us/match)")
+    count *= 10
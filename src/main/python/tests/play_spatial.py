@@ -35,6 +35,30 @@ if args.latlon:
         print_loc(geo, dist)
     deltat(t0)
 
+    if not db.has_spatial_index():
+        msg("Building R*Tree spatial index")
+        t0 = now()
+        db.create_spatial_index()
+        deltat(t0)
+    for method in ["2d", "rtree"]:
+        msg(f"Method {method}, 100 queries")
+        t0 = now()
+        for _ in range(100):
+            db.list_places_at(lat=coord.lat, lon=coord.lon, method=method)
+        deltat(t0)
+
+    # Jittered points within a few KM of the query point.
+    points = [(coord.lat + 0.0005 * (i % 50), coord.lon - 0.0005 * (i // 50)) for i in range(1000)]
+    msg("Batch of 1000 points, list_places_at_many")
+    t0 = now()
+    db.list_places_at_many(points)
+    deltat(t0)
+    msg("Batch of 1000 points, list_places_at")
+    t0 = now()
+    for lat, lon in points:
+        db.list_places_at(lat=lat, lon=lon)
+    deltat(t0)
+
     sys.exit()
 
 gh = "9q5fp"
@@ -0,0 +1,239 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main, skipUnless
+
+from opensextant.gazetteer import DB, DataSource, GeonamesOrgSource, chunk_lines, file_chunks
+
+
+class SampleSource(DataSource):
+    """
+    Tab-delimited source:  place_id, name, lat, lon, with a header line
+    """
+
+    def __init__(self, dbf):
+        DataSource.__init__(self, dbf)
+        self.source_name = "Sample"
+        self.source_keys = ["X"]
+        self.quiet = True
+        self.id_offset = 5000
+        self.fail_at = None
+
+    def _parse(self, line):
+        plid, name, lat, lon = line.rstrip("\n").split("\t")
+        if plid == "place_id":
+            return None
+        if plid == self.fail_at:
+            raise Exception("Simulated failure")
+        if name.startswith("~"):
+            self.excluded_terms.add(name)
+            return None
+        return {
+            "place_id": plid, "name": name, "name_type": "N", "name_group": "",
+            "lat": float(lat), "lon": float(lon), "feat_class": "P", "feat_code": "PPL",
+            "cc": "US", "FIPS_cc": "US", "adm1": "01", "adm2": None, "source": "XP",
+            "name_bias": 0, "id_bias": 0
+        }
+
+    def process_source(self, sourcefile, limit=-1):
+        with open(sourcefile, "r", encoding="UTF-8") as fh:
+            for line in fh:
+                geo = self._parse(line)
+                if geo:
+                    self.rowcount += 1
+                    geo["id"] = self.id_offset + self.rowcount
+                    yield geo
+
+    def process_chunk(self, sourcefile, start, end):
+        for line in chunk_lines(sourcefile, start, end):
+            yield self._parse(line)
+
+
+class TestGazetteerETL(TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.sourcefile = os.path.join(self.tmpdir, "sample.txt")
+        with open(self.sourcefile, "w", encoding="UTF-8") as fh:
+            fh.write("place_id\tname\tlat\tlon\n")
+            for i in range(1000):
+                name = f"~Skip {i}" if i % 100 == 0 else f"Place {i}"
+                fh.write(f"X{i}\t{name}\t{40 + i * 0.001:0.4f}\t{-70 - i * 0.001:0.4f}\n")
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _load(self, dbname, fail_at=None, **kwargs):
+        source = SampleSource(os.path.join(self.tmpdir, dbname))
+        source.db.geohash_default = True
+        source.fail_at = fail_at
+        try:
+            source.normalize(self.sourcefile, **kwargs)
+        finally:
+            source.db.close()
+        return source
+
+    def _places(self, source):
+        source.db.reopen()
+        try:
+            return list(source.db.list_places())
+        finally:
+            source.db.close()
+
+    def _list(self, source):
+        source.db.reopen()
+        try:
+            return [(pl.id, pl.place_id, pl.geohash) for pl in source.db.list_places()]
+        finally:
+            source.db.close()
+
+    def test_file_chunks(self):
+        size = os.path.getsize(self.sourcefile)
+        chunks = file_chunks(self.sourcefile, 7)
+        self.assertEqual(0, chunks[0][0])
+        self.assertEqual(size, chunks[-1][1])
+        lines = []
+        for start, end in chunks:
+            lines.extend(chunk_lines(self.sourcefile, start, end))
+        with open(self.sourcefile, "r", encoding="UTF-8") as fh:
+            self.assertEqual(fh.readlines(), lines)
+
+    def test_parallel_normalize(self):
+        serial = self._load("serial.sqlite")
+        parallel = self._load("parallel.sqlite", workers=3)
+        self.assertEqual(serial.rowcount, parallel.rowcount)
+        self.assertEqual(serial.excluded_terms, parallel.excluded_terms)
+
+        expected = self._list(serial)
+        self.assertEqual(990, len(expected))
+        self.assertEqual(expected, self._list(parallel))
+
+        limited = self._load("limited.sqlite", workers=2, limit=25)
+        self.assertEqual(25, limited.rowcount)
+
+    @skipUnless(os.path.exists(os.path.join("etc", "gazetteer", "filters", "non-placenames.csv")),
+                "PlaceHeuristics needs Xponents project resources")
+    def test_geonames_parallel(self):
+        sourcefile = os.path.join(self.tmpdir, "allCountries.txt")
+        with open(sourcefile, "w", encoding="UTF-8") as fh:
+            for i in range(500):
+                name = f"Ville {i}" if i % 3 else f"Villé {i}"
+                asciiname = f"Ville {i}"
+                row = [str(1000 + i), name, asciiname, "", f"{45 + i * 0.001:0.5f}", f"{2 + i * 0.001:0.5f}",
+                       "P", "PPL", "FR", "", "11", "75", "", "", str(i * 10), "", "40", "Europe/Paris",
+                       "2021-03-04"]
+                fh.write("\t".join(row) + "\n")
+
+        results = []
+        for workers in [1, 2]:
+            source = GeonamesOrgSource(os.path.join(self.tmpdir, f"geonames{workers}.sqlite"))
+            source.quiet = True
+            source.db.geohash_default = True
+            try:
+                source.normalize(sourcefile, workers=workers)
+            finally:
+                source.db.close()
+            self.assertEqual({"OG"}, {pl.source for pl in self._places(source)})
+            results.append(self._list(source))
+        self.assertEqual(667, len(results[0]))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(("G1000", "u0"), (results[0][0][1], results[0][0][2][0:2]))
+
+    def test_chunk_failure(self):
+        expected = self._list(self._load("full.sqlite"))
+        with self.assertRaises(Exception):
+            self._load("failed.sqlite", fail_at="X555", workers=3)
+        source = SampleSource(os.path.join(self.tmpdir, "failed.sqlite"))
+        try:
+            checkpoint = source.db.get_checkpoint("Sample", "sample.txt")
+        finally:
+            source.db.close()
+        # Nothing of the failed chunk is kept, the checkpoint is the end of the chunk before it.
+        places = [pl[1] for pl in self._list(source)]
+        self.assertEqual(0, checkpoint["complete"])
+        self.assertEqual(len(places), checkpoint["rowcount"])
+        self.assertNotIn("X554", places)
+        self.assertNotIn("X999", places)
+        self.assertEqual(expected[0:len(places)], self._list(source))
+
+    def test_resume(self):
+        expected = self._list(self._load("full.sqlite"))
+        for workers in [1, 3]:
+            dbname = f"resume{workers}.sqlite"
+            with self.assertRaises(Exception):
+                self._load(dbname, fail_at="X555", workers=workers)
+            source = self._load(dbname, workers=workers, resume=True)
+            self.assertEqual(expected, self._list(source))
+
+            source.db.reopen()
+            checkpoint = source.db.get_checkpoint("Sample", "sample.txt")
+            self.assertEqual(1, checkpoint["complete"])
+            self.assertEqual(990, checkpoint["rowcount"])
+            source.db.close()
+
+            # Nothing more to do
+            source = self._load(dbname, workers=workers, resume=True)
+            self.assertEqual(expected, self._list(source))
+
+    def test_bulk_load(self):
+        expected = self._list(self._load("full.sqlite"))
+
+        source = SampleSource(os.path.join(self.tmpdir, "bulk.sqlite"))
+        source.db.geohash_default = True
+        source.db.create_name_index()
+        schema_sql = "select type, name from sqlite_master where tbl_name = 'placenames' order by name"
+        schema = source.db.conn.execute(schema_sql).fetchall()
+        with self.assertLogs("opensextant.gazetteer", level="INFO") as logged:
+            with source.db.bulk_load(batch_size=300):
+                self.assertEqual(0, len(source.db.conn.execute(
+                    "select name from sqlite_master where tbl_name = 'placenames' and type = 'index'").fetchall()))
+                source.normalize(self.sourcefile)
+        self.assertIn("Bulk load: 990 rows", logged.output[-1])
+        try:
+            self.assertEqual(990, source.db.bulk_stats["rows"])
+            self.assertTrue(source.db.bulk_stats["rows_per_sec"] > 0)
+            self.assertEqual(schema, source.db.conn.execute(schema_sql).fetchall())
+            # R*Tree and name index are rebuilt, and triggers are back in place.
+            self.assertEqual("X1", source.db.list_places_at(lat=40.001, lon=-70.001, radius=50,
+                                                            method="rtree")[0][1].place_id)
+            self.assertEqual(["X555"], [pl.place_id for pl in source.db.search_names(text="place 555")])
+            source.db.delete_places("where place_id = 'X555'")
+            self.assertEqual(0, len(source.db.search_names(text="place 555")))
+        finally:
+            source.db.close()
+        self.assertEqual(len(expected) - 1, len(self._list(source)))
+
+    def test_bulk_load_interrupted(self):
+        dbf = os.path.join(self.tmpdir, "interrupted.sqlite")
+        source = SampleSource(dbf)
+        source.db.geohash_default = True
+        source.db.create_name_index()
+        schema_sql = "select type, name from sqlite_master where tbl_name = 'placenames' order by name"
+        schema = source.db.conn.execute(schema_sql).fetchall()
+        source.db.close()
+
+        def _load_and_die():
+            with source.db.bulk_load(batch_size=300):
+                source.normalize(self.sourcefile)
+                os._exit(1)
+
+        proc = multiprocessing.get_context("fork").Process(target=_load_and_die)
+        proc.start()
+        proc.join()
+        self.assertEqual(1, proc.exitcode)
+
+        # Indices and triggers dropped by the dead process are restored on open
+        with self.assertLogs("opensextant.gazetteer", level="WARNING"):
+            db = DB(dbf)
+        try:
+            self.assertEqual(schema, db.conn.execute(schema_sql).fetchall())
+            self.assertEqual(0, db.conn.execute("select count(*) from etl_deferred_ddl").fetchone()[0])
+            self.assertEqual(["X555"], [pl.place_id for pl in db.search_names(text="place 555")])
+            self.assertEqual("X1", db.list_places_at(lat=40.001, lon=-70.001, radius=50, method="rtree")[0][1].place_id)
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase, main
+
+from opensextant import distance_haversine
+from opensextant.gazetteer import DB
+
+
+def make_place(rowid, name, lat, lon, cc="US", fc="P", dsg="PPL", source="U"):
+    return {
+        "id": rowid, "place_id": f"{source}{rowid}", "name": name, "name_type": "N", "name_group": "",
+        "lat": lat, "lon": lon, "feat_class": fc, "feat_code": dsg,
+        "cc": cc, "FIPS_cc": cc, "adm1": "01", "adm2": None, "source": source,
+        "name_bias": 0, "id_bias": 0
+    }
+
+
+# A small grid of places around Boston, MA;  ~1.1 KM spacing in latitude
+SAMPLE_PLACES = [make_place(1000 + i * 10 + j, f"Place {i}-{j}", 42.30 + 0.01 * i, -71.10 + 0.01 * j)
+                 for i in range(10) for j in range(10)]
+
+
+class TestGazetteerQuery(TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+        self.db = DB(os.path.join(self.tmpdir, "test_gazetteer.sqlite"), add_geohash=True)
+        self.db.add_places(SAMPLE_PLACES)
+        self.db.close()
+        self.db.reopen()
+
+    def tearDown(self) -> None:
+        self.db.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_rtree_matches_2d(self):
+        self.assertTrue(self.db.has_spatial_index())
+        lat, lon = 42.345, -71.055
+        for radius in [500, 1500, 5000]:
+            by_2d = self.db.list_places_at(lat=lat, lon=lon, radius=radius, limit=100, method="2d")
+            by_rtree = self.db.list_places_at(lat=lat, lon=lon, radius=radius, limit=100, method="rtree")
+            self.assertEqual(sorted([(d, pl.id) for d, pl in by_2d]), sorted([(d, pl.id) for d, pl in by_rtree]))
+            for dist, pl in by_rtree:
+                self.assertTrue(dist < radius)
+                self.assertEqual(dist, distance_haversine(lon, lat, pl.lon, pl.lat))
+
+    def test_rtree_sync(self):
+        lat, lon = 42.30, -71.10
+        found = self.db.list_places_at(lat=lat, lon=lon, radius=100, method="rtree")
+        self.assertEqual(1000, found[0][1].id)
+
+        self.db.delete_places("where id = 1000")
+        found = self.db.list_places_at(lat=lat, lon=lon, radius=100, method="rtree")
+        self.assertEqual(0, len(found))
+
+        # Index rebuilt from table on demand, e.g., for a gazetteer created before the R*Tree was introduced.
+        self.db.conn.execute("drop table placenames_rtree")
+        self.assertFalse(self.db.has_spatial_index())
+        self.db.create_spatial_index()
+        found = self.db.list_places_at(lat=42.31, lon=-71.10, radius=100, method="rtree")
+        self.assertEqual(1010, found[0][1].id)
+
+    def test_same_distance(self):
+        # Four places equidistant from the center of a grid cell are all kept.
+        lat, lon = 42.305, -71.095
+        found = self.db.list_places_at(lat=lat, lon=lon, radius=1000, limit=10)
+        self.assertEqual({1000, 1001, 1010, 1011}, {pl.id for d, pl in found})
+
+    def test_nearest(self):
+        lat, lon = 42.345, -71.055
+        for k in [1, 5, 12, 100]:
+            found = self.db.nearest(lat, lon, k=k, radius=100)
+            self.assertEqual(k, len(found))
+            # Brute force check
+            expected = sorted([(distance_haversine(lon, lat, p["lon"], p["lat"]), p["id"]) for p in SAMPLE_PLACES])
+            self.assertEqual([d for d, rowid in expected[0:k]], [d for d, pl in found])
+
+        # Sparse: nearest places are far from this point, but within 1000 KM
+        found = self.db.nearest(41.0, -73.0, k=3, radius=500)
+        self.assertEqual(3, len(found))
+        self.assertEqual(1000, found[0][1].id)
+
+        # Filters
+        self.assertEqual(0, len(self.db.nearest(lat, lon, k=3, cc="CA", max_radius=50000)))
+        self.assertEqual(0, len(self.db.nearest(lat, lon, k=3, feat_class="A", max_radius=50000)))
+        self.assertEqual(3, len(self.db.nearest(lat, lon, k=3, cc="US", feat_class="P")))
+
+        # Same results without the R*Tree
+        self.db.conn.execute("drop table placenames_rtree")
+        found = self.db.nearest(lat, lon, k=12, radius=100)
+        self.assertEqual(12, len(found))
+
+        # Polar and antimeridian search regions
+        self.assertEqual(0, len(self.db.nearest(89.9, 179.9, k=3, max_radius=10000)))
+
+        for radius in [0, -100]:
+            self.assertRaises(ValueError, self.db.nearest, lat, lon, k=3, radius=radius)
+
+    def test_list_places_at_many(self):
+        points = [(42.345, -71.055), (42.3451, -71.0551), (None, None), (10.0, 10.0), (42.305, -71.095),
+                  (42.399, -71.001)]
+        for radius in [800, 2500]:
+            batch = self.db.list_places_at_many(points, radius=radius, limit=7)
+            self.assertEqual(len(points), len(batch))
+            for (lat, lon), found in zip(points, batch):
+                if lat is None or lat == 10.0:
+                    self.assertEqual([], found)
+                    continue
+                expected = self.db.list_places_at(lat=lat, lon=lon, radius=radius, limit=7)
+                self.assertEqual([d for d, pl in expected], [d for d, pl in found])
+                self.assertEqual(len(expected), len(found))
+
+    def test_parameterized_queries(self):
+        self.assertEqual(100, len(list(self.db.list_places(cc="US"))))
+        self.assertEqual(5, len(list(self.db.list_places(cc="US", fc="P*", limit=5))))
+        # Values are bound, not pasted into SQL
+        self.assertEqual(0, len(list(self.db.list_places(cc="US' or '1'='1"))))
+
+        # Column selection keeps what Place requires
+        pl = next(self.db.list_places(cc="US", columns=["adm1"], limit=1))
+        self.assertEqual("01", pl.adm1)
+        self.assertIsNone(pl.geohash)
+        self.assertEqual(1000, pl.id)
+        found = self.db.list_places_at(lat=42.30, lon=-71.10, radius=100, columns=["geohash"])
+        self.assertEqual(1000, found[0][1].id)
+        self.assertIsNotNone(found[0][1].geohash)
+        with self.assertRaises(Exception):
+            list(self.db.list_places(columns=["name; drop table placenames"]))
+
+        self.assertTrue(self.db.update_admin1_code("US", "01", "MA"))
+        self.assertEqual(100, len(list(self.db.list_places(criteria=" where adm1 = 'MA'"))))
+
+        self.db.mark_duplicates([1000, 1001])
+        found = self.db.list_places_at(lat=42.30, lon=-71.10, radius=2000, limit=100, method="geohash")
+        self.assertFalse({1000, 1001}.intersection({pl.id for d, pl in found}))
+
+    def test_read_only(self):
+        dbpath = self.db.dbpath
+        self.db.close()
+        self.assertRaises(Exception, DB, os.path.join(self.tmpdir, "missing.sqlite"), mode="ro")
+
+        db = DB(dbpath, mode="ro")
+        try:
+            # Several readers, one connection per thread
+            def query(lat):
+                found = db.list_places_at(lat=lat, lon=-71.10, radius=100, method="rtree")
+                return found[0][1].id, db.conn
+
+            main_conn = db.conn
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(query, [42.30 + 0.01 * i for i in range(10)]))
+            self.assertEqual([1000 + 10 * i for i in range(10)], [rowid for rowid, conn in results])
+            self.assertNotIn(main_conn, [conn for rowid, conn in results])
+
+            with self.assertRaises(Exception):
+                db.delete_places("where id = 1000")
+        finally:
+            db.close()
+        self.assertIsNone(db.conn)
+
+    def test_search_names(self):
+        self.assertFalse(self.db.has_name_index())
+        self.db.create_name_index()
+        self.assertTrue(self.db.has_name_index())
+        self.db.add_places([make_place(1, "São Paulo", -23.55, -46.63, cc="BR"),
+                            make_place(2, "New York", 40.71, -74.0),
+                            make_place(3, "Newark", 40.73, -74.17)])
+        self.db.close()
+        self.db.reopen()
+
+        self.assertEqual(["São Paulo"], [pl.name for pl in self.db.search_names(text="sao paulo")])
+        self.assertEqual({"Newark", "New York"}, {pl.name for pl in self.db.search_names(prefix="new")})
+        self.assertEqual(["New York"], [pl.name for pl in self.db.search_names(prefix="New Yo")])
+        self.assertEqual(3, len(self.db.search_names(text="place", cc="US", limit=3)))
+        self.assertEqual(0, len(self.db.search_names(text="place", cc="BR")))
+        # Query syntax in user input is treated as text
+        self.assertEqual(0, len(self.db.search_names(text='place" OR "york')))
+
+        # Index follows updates and deletes
+        self.db.conn.execute("update placenames set name = 'Old York' where id = 2")
+        self.db.delete_places("where id = 3")
+        self.assertEqual(["Old York"], [pl.name for pl in self.db.search_names(text="york")])
+        self.assertEqual(0, len(self.db.search_names(prefix="new")))
+
+    def test_find_duplicates(self):
+        self.db.add_places([
+            # Same as 1000 and 1011, from NGA
+            make_place(1, "PLACE 0-0", 42.3001, -71.1001, source="N"),
+            make_place(2, " Place  1-1", 42.31, -71.09, source="N"),
+            # Different feature class, or too far away
+            make_place(3, "Place 0-0", 42.30, -71.10, fc="A", dsg="ADM2", source="N"),
+            make_place(4, "Place 0-0", 42.70, -71.10, source="N"),
+            # Different country
+            make_place(5, "Place 0-1", 42.30, -71.09, cc="CA", source="N")
+        ])
+        self.db.close()
+        self.db.reopen()
+
+        # Lowest id is kept, unless source is preferred
+        self.assertEqual([1000, 1011], self.db.find_duplicates(mark=False))
+        self.assertEqual([1, 2], self.db.find_duplicates(source_preference=["U"], mark=False))
+        self.assertEqual([], self.db.find_duplicates(cc="CA", mark=False))
+        self.assertEqual([1, 2], self.db.find_duplicates(source_preference=["U"], block_size=1))
+        ids = {pl.id for pl in self.db.list_places(criteria=" where duplicate = 1")}
+        self.assertEqual({1, 2}, ids)
+        # Marked rows are not considered again
+        self.assertEqual([], self.db.find_duplicates())
+
+    def test_iter_place_batches(self):
+        batches = list(self.db.iter_place_batches(batch_size=30, columns=["id", "name"]))
+        self.assertEqual([30, 30, 30, 10], [len(b) for b in batches])
+        self.assertEqual((1000, "Place 0-0"), batches[0][0])
+
+        rows = [row for batch in self.db.iter_place_batches(where={"id": [1000, 1001], "adm2": None}, as_="dict")
+                for row in batch]
+        self.assertEqual([1000, 1001], [row["id"] for row in rows])
+        self.assertEqual("U1000", rows[0]["place_id"])
+
+        batches = list(self.db.iter_place_batches(columns=["geohash"], where={"cc": "US"}, as_="Place"))
+        self.assertEqual(1, len(batches))
+        places = batches[0]
+        self.assertEqual(100, len(places))
+        self.assertEqual("Place 0-0", places[0].name)
+        self.assertIsNotNone(places[0].geohash)
+        self.assertIsNone(places[0].adm1)
+
+        self.assertEqual([], list(self.db.iter_place_batches(where={"cc": "ZZ"})))
+        with self.assertRaises(Exception):
+            list(self.db.iter_place_batches(where={"1=1 or cc": "US"}))
+
+
+if __name__ == "__main__":
+    main()
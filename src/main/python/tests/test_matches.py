@@ -1,4 +1,7 @@
-from opensextant import TextMatch, reduce_matches
+from random import Random
+from unittest import TestCase, main
+
+from opensextant import TextMatch, reduce_matches, reduce_matches_dict, IS_SUBMATCH, IS_DUPLICATE
 
 arr = [
 
@@ -19,3 +22,82 @@ reduce_matches(arr)
 print("X1, X2, DUP, sUB, OVERLAP")
 for m in arr:
     print(m.start, m.end, m.is_duplicate, m.is_submatch, m.is_overlap)
+
+
+def reduce_matches_pairwise(matches):
+    """ Reference:  compare every pair, as reduce_matches did before the sweep. """
+    for i, M in enumerate(matches):
+        if M.filtered_out:
+            continue
+        m1, m2 = M.start, M.end
+        for N in matches[i + 1:]:
+            if N.filtered_out:
+                continue
+            n1, n2 = N.start, N.end
+            if m2 < n1 or m1 > n2:
+                continue
+            if n1 == m1 and n2 == m2:
+                N.is_duplicate = True
+            elif n1 <= m1 < m2 <= n2:
+                M.is_submatch = True
+            elif m1 <= n1 < n2 <= m2:
+                N.is_submatch = True
+            elif m1 <= n2 <= m2 or n1 <= m2 <= n2:
+                M.is_overlap = True
+                N.is_overlap = True
+
+
+def reduce_matches_dict_pairwise(matches):
+    """ Reference for reduce_matches_dict """
+    for i, M in enumerate(matches):
+        m1, m2 = M['start'], M['end']
+        for N in matches[i + 1:]:
+            n1, n2 = N['start'], N['end']
+            if m2 < n1 or m1 > n2:
+                continue
+            if n1 == m1 and n2 == m2:
+                N['submatch'] = IS_DUPLICATE
+            elif n1 <= m1 < m2 <= n2:
+                M['submatch'] = IS_SUBMATCH
+            elif m1 <= n1 < n2 <= m2:
+                N['submatch'] = IS_SUBMATCH
+
+
+def random_spans(rnd, count, width):
+    spans = []
+    for _ in range(count):
+        x1 = rnd.randint(0, width)
+        x2 = x1 + rnd.choice([0, 0, 1, 2, 3, 5, 8, 20, -1])
+        spans.append((x1, x2))
+    # Plenty of exact duplicates
+    spans.extend(rnd.choices(spans, k=count // 4))
+    rnd.shuffle(spans)
+    return spans
+
+
+class TestReduceMatches(TestCase):
+    def test_sweep_equals_pairwise(self):
+        rnd = Random(7)
+        for trial in range(300):
+            spans = random_spans(rnd, rnd.randint(0, 60), rnd.choice([10, 50, 200]))
+            filtered = [rnd.random() < 0.1 for _ in spans]
+            expected, found = [], []
+            for arr in (expected, found):
+                for (x1, x2), flt in zip(spans, filtered):
+                    m = TextMatch("x", x1, x2)
+                    m.filtered_out = flt
+                    arr.append(m)
+            reduce_matches_pairwise(expected)
+            reduce_matches(found)
+            flags = [(m.is_duplicate, m.is_submatch, m.is_overlap) for m in expected]
+            self.assertEqual(flags, [(m.is_duplicate, m.is_submatch, m.is_overlap) for m in found], spans)
+
+            expected = [{"start": x1, "end": x2} for x1, x2 in spans]
+            found = [{"start": x1, "end": x2} for x1, x2 in spans]
+            reduce_matches_dict_pairwise(expected)
+            reduce_matches_dict(found)
+            self.assertEqual(expected, found, spans)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import csv
+import io
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from opensextant.FlexPat import RegexPatternManager, PatternExtractor, PatternMatch, RuleProfile, derive_triggers
+from opensextant.extractors.xcoord import XCoord
+from opensextant.extractors.xtemporal import XTemporal
+
+
+def summary(matches):
+    return [(m.pattern_id, m.text, m.start, m.end, m.filtered_out) for m in matches]
+
+
+def sample_texts(extractor):
+    texts = [t.text for t in extractor.pattern_manager.test_cases]
+    # One long document, including runs of text where no rule applies.
+    texts.append(" and nothing else here. ".join(texts))
+    return texts
+
+
+class OddCodeMatch(PatternMatch):
+    """ Omits codes that are odd numbers """
+
+    def normalize(self):
+        PatternMatch.normalize(self)
+        self.omit = int(self.text.split()[-1]) % 2 == 1
+
+
+class TestPatternExtractor(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def test_scan_plan(self):
+        for extractor in [XCoord(debug=True), XTemporal(debug=True)]:
+            texts = sample_texts(extractor)
+            extractor.triggers = False
+            expected = [summary(extractor.extract(text)) for text in texts]
+            self.assertTrue(any(expected))
+
+            extractor.triggers = True
+            self.assertEqual(expected, [summary(extractor.extract(text)) for text in texts])
+            self.assertEqual([], extractor.extract("no dates or coordinates"))
+
+            # Plan follows enabled state of rules
+            fam = sorted(extractor.pattern_manager.families)[0]
+            extractor.pattern_manager.set_enabled(fam, False)
+            plan = extractor.scan_plan()
+            self.assertNotIn(fam, [f for f, rules in plan.families])
+            found = {m.pattern_id for text in texts for m in extractor.extract(text)}
+            self.assertFalse([pid for pid in found if pid.startswith(fam)])
+            self.assertIs(plan, extractor.scan_plan())
+
+            extractor.pattern_manager.enable_all()
+            self.assertEqual(expected, [summary(extractor.extract(text)) for text in texts])
+
+            with self.assertRaises(Exception):
+                extractor.extract("text", features=["NoSuchFamily"])
+
+    def test_triggers(self):
+        def triggers(pattern):
+            return [t.pattern for t in derive_triggers(re.compile(pattern, re.IGNORECASE))]
+
+        self.assertEqual(["[°]", "[\\d]"], triggers("\\b\\d{1,2}(\\.\\d+)?\\s?°"))
+        # Optional items, lookarounds and broad classes require nothing.
+        self.assertEqual(["[x]"], triggers("[a-z]*\\w+\\s(?=y)(z)?x"))
+        self.assertEqual(["[bc]"], triggers("a?(b|c+)"))
+        self.assertEqual([], triggers("a|\\w"))
+        self.assertEqual([], triggers("[^x]+"))
+
+        cfg = os.path.join(self.tmpdir, "test_patterns.cfg")
+        with open(cfg, "w", encoding="UTF-8") as fh:
+            fh.write("#DEFINE\tnum\t\\d+\n")
+            fh.write("#RULE\tCODE\t01\tcode\\s<num>\n")
+            fh.write("#RULE\tCODE\t02\t<num>\\s?units\n")
+            fh.write("#TRIGGER\tCODE\t02\tunits\n")
+            fh.write("#RULE\tTAG\t01\t#<num>\n")
+            fh.write("#TRIGGER\tTAG\t*\t#\n")
+        mgr = RegexPatternManager(cfg)
+        self.assertEqual(["units"], [t.pattern for t in mgr.get_pattern("CODE-02").triggers])
+        self.assertEqual("#", mgr.family_triggers["TAG"].pattern)
+
+        extractor = PatternExtractor(mgr)
+        text = "code 12 and 33 UNITS, #4"
+        found = sorted(summary(extractor.extract(text)))
+        self.assertEqual([("CODE-01", "code 12", 0, 7, False), ("CODE-02", "33 UNITS", 12, 20, False),
+                          ("TAG-01", "#4", 22, 24, False)], found)
+        extractor.triggers = False
+        self.assertEqual(found, sorted(summary(extractor.extract(text))))
+        extractor.triggers = True
+        self.assertEqual([], extractor.extract("code and 33 things"))
+
+    def test_rule_cache(self):
+        cache_dir = os.path.join(self.tmpdir, "cache")
+        expected = {}
+        for extractor in [XCoord(), XTemporal()]:
+            mgr = extractor.pattern_manager
+            expected[mgr.patterns_file] = [(p.id, p.regex.pattern, p.regex_groups, [t.pattern for t in p.triggers])
+                                           for p in mgr.patterns.values()]
+            texts = [t.text for t in RegexPatternManager(mgr.patterns_file, testing=True, cache_dir=False).test_cases]
+            for attempt in ["miss", "hit"]:
+                cached = RegexPatternManager(mgr.patterns_file, cache_dir=cache_dir)
+                self.assertTrue(os.path.exists(cached.cache_file))
+                if attempt == "hit":
+                    # Not compiled until used
+                    self.assertTrue(all(p._regex is None for p in cached.patterns.values()))
+                self.assertEqual(expected[mgr.patterns_file],
+                                 [(p.id, p.regex.pattern, p.regex_groups, [t.pattern for t in p.triggers])
+                                  for p in cached.patterns.values()])
+                other = PatternExtractor(cached)
+                self.assertEqual([summary(extractor.extract(t)) for t in texts],
+                                 [summary(other.extract(t)) for t in texts])
+
+        cfg = os.path.join(self.tmpdir, "test_patterns.cfg")
+        with open(cfg, "w", encoding="UTF-8") as fh:
+            fh.write("#DEFINE\tnum\t\\d+\n#RULE\tCODE\t01\tcode\\s<num>\n")
+        first = RegexPatternManager(cfg, cache_dir=cache_dir)
+        # Edited config is a new cache entry, old one removed
+        with open(cfg, "a", encoding="UTF-8") as fh:
+            fh.write("#RULE\tCODE\t02\t<num>\\s?units\n")
+        second = RegexPatternManager(cfg, cache_dir=cache_dir)
+        self.assertNotEqual(first.cache_file, second.cache_file)
+        self.assertFalse(os.path.exists(first.cache_file))
+        self.assertEqual(["CODE-01", "CODE-02"], sorted(second.patterns))
+
+        # Unreadable cache is rebuilt
+        with open(second.cache_file, "w", encoding="UTF-8") as fh:
+            fh.write("{garbage")
+        third = RegexPatternManager(cfg, cache_dir=cache_dir)
+        self.assertEqual(["CODE-01", "CODE-02"], sorted(third.patterns))
+        self.assertEqual(["CODE-01", "CODE-02"], sorted(RegexPatternManager(cfg, cache_dir=cache_dir).patterns))
+
+        self.assertIsNone(RegexPatternManager(cfg, cache_dir=False).cache_file)
+
+        # Opt-in:  no cache by default, unless set in the environment
+        environ = dict(os.environ)
+        try:
+            os.environ.pop("XPONENTS_FLEXPAT_CACHE", None)
+            self.assertIsNone(RegexPatternManager(cfg).cache_file)
+            os.environ["XPONENTS_FLEXPAT_CACHE"] = cache_dir
+            self.assertEqual(third.cache_file, RegexPatternManager(cfg).cache_file)
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+
+    def test_profile(self):
+        for extractor in [XCoord(debug=True), XTemporal(debug=True)]:
+            texts = sample_texts(extractor)
+            extractor.profile = RuleProfile()
+            found = [m for text in texts for m in extractor.extract(text)]
+            report = extractor.profile.as_dict()
+            # Rules skipped by triggers are not scanned at all
+            self.assertTrue(set(report).issubset(extractor.pattern_manager.patterns))
+            self.assertEqual(len(found), sum(st["hits"] - st["omitted"] for st in report.values()))
+            self.assertEqual(len([m for m in found if m.filtered_out]),
+                             sum(st["filtered_out"] for st in report.values()))
+            for pid, st in report.items():
+                self.assertEqual(len([m for m in found if m.pattern_id == pid]), st["hits"] - st["omitted"])
+                self.assertLessEqual(st["scans"], len(texts))
+
+            families = extractor.profile.as_dict(by="family")
+            self.assertEqual({st["family"] for st in report.values()}, set(families))
+            self.assertEqual(sum(st["hits"] for st in report.values()), sum(st["hits"] for st in families.values()))
+
+            buf = io.StringIO()
+            extractor.profile.write_csv(buf)
+            rows = list(csv.DictReader(io.StringIO(buf.getvalue())))
+            self.assertEqual(list(report), [row["rule"] for row in rows])
+            self.assertEqual(report, pickle.loads(pickle.dumps(extractor.profile)).as_dict())
+
+            extractor.profile.reset()
+            self.assertEqual({}, extractor.profile.as_dict())
+            extractor.profile = None
+            extractor.extract(texts[0])
+
+        cfg = os.path.join(self.tmpdir, "test_patterns.cfg")
+        with open(cfg, "w", encoding="UTF-8") as fh:
+            fh.write("#DEFINE\tnum\t\\d+\n#RULE\tCODE\t01\tcode\\s<num>\n")
+        mgr = RegexPatternManager(cfg, cache_dir=False)
+        mgr.get_pattern("CODE-01").match_class = OddCodeMatch
+        extractor = PatternExtractor(mgr)
+        extractor.profile = RuleProfile()
+        found = extractor.extract("code 1, code 2, code 3 and code 33")
+        self.assertEqual(["code 2"], [m.text for m in found])
+        report = extractor.profile.as_dict(by="family")
+        self.assertEqual({"CODE": {"family": "CODE", "scans": 1, "hits": 4, "omitted": 3, "filtered_out": 0,
+                                   "timeouts": 0}},
+                         {fam: {k: v for k, v in st.items() if k != "seconds"} for fam, st in report.items()})
+        fpath = os.path.join(self.tmpdir, "profile.csv")
+        extractor.profile.write_csv(fpath, by="family")
+        with open(fpath, "r", encoding="UTF-8") as fh:
+            self.assertEqual(["CODE"], [row["family"] for row in csv.DictReader(fh)])
+
+    def test_guarded(self):
+        extractor = XTemporal(debug=True)
+        texts = sample_texts(extractor)
+        expected = [summary(extractor.extract(text)) for text in texts]
+        extractor.rule_timeout = 5
+        self.assertEqual(expected, [summary(extractor.extract(text)) for text in texts])
+        self.assertEqual({}, extractor.timeouts)
+
+        cfg = os.path.join(self.tmpdir, "test_patterns.cfg")
+        with open(cfg, "w", encoding="UTF-8") as fh:
+            # Catastrophic backtracking when "b" does not follow the a's
+            fh.write("#DEFINE\tas\t(?:a+)+\n#RULE\tSLOW\t01\t<as>b\n#RULE\tCODE\t01\tc<as>\n")
+        extractor = PatternExtractor(RegexPatternManager(cfg, cache_dir=False), rule_timeout=0.5)
+        extractor.profile = RuleProfile()
+        text = "b c" + "a" * 40 + "c"
+        with self.assertLogs("opensextant.FlexPat", level="WARNING") as logged:
+            self.assertEqual([("CODE-01", "c" + "a" * 40, 2, 43, False)], summary(extractor.extract(text)))
+        self.assertIn("SLOW-01", logged.output[0])
+        self.assertEqual({"SLOW-01": 1}, extractor.timeouts)
+        self.assertEqual(1, extractor.profile.as_dict()["SLOW-01"]["timeouts"])
+        # Later texts still scanned by all rules
+        self.assertEqual([("CODE-01", "ca", 4, 6, False), ("SLOW-01", "aab", 0, 3, False)],
+                         sorted(summary(extractor.extract("aab ca"))))
+        self.assertEqual({"SLOW-01": 1}, extractor.timeouts)
+
+        # Process workers forked after guarded scans here start their own watchdog
+        docs = ["aab ca", "b ca", "no match"] * 4
+        expected = [(sorted(summary(extractor.extract(d))), None) for d in docs]
+        self.assertEqual(expected, [(sorted(summary(found)), err)
+                                    for found, err in extractor.extract_many(docs, workers=2, batch_size=2)])
+
+    def test_deferred_match(self):
+        extractor = XTemporal(debug=True)
+        text = " and ".join(sample_texts(extractor)[0:-1])
+        found = extractor.extract(text)
+        self.assertTrue(found)
+        for m in found:
+            eager = PatternMatch(m.text, m.start, m.end, pattern_id=m.pattern_id)
+            eager.add_surrounding_text(text, len(text), length=20)
+            # Returned matches do not hold on to the text
+            self.assertIsNone(m._match)
+            attrs = m.attributes()
+            self.assertEqual((eager.pre_text, eager.post_text), (m.pre_text, m.post_text))
+            for slot, value, x1, x2 in m.match_groups:
+                self.assertEqual(attrs[slot], value)
+                if value is not None:
+                    self.assertEqual(value, text[x1:x2])
+            self.assertEqual(attrs, m.attributes())
+
+            copied = pickle.loads(pickle.dumps(m))
+            self.assertEqual((m.text, m.start, m.end, m.filtered_out, m.pre_text, m.post_text, m.match_groups,
+                              m.attributes()),
+                             (copied.text, copied.start, copied.end, copied.filtered_out, copied.pre_text,
+                              copied.post_text, copied.match_groups, copied.attributes()))
+
+        # Derived from the raw match on first use, while normalizing
+        raw = re.search(r"(?P<a>\d+)-(?P<b>[a-z]+)?", "num 12- end")
+        lazy = PatternMatch(raw.group(), raw.start(), raw.end(), pattern_id="X-01", match=raw,
+                            slot_names=["a", "b"], surrounding=3)
+        self.assertEqual({"method": "X-01", "a": "12", "b": None}, lazy.attributes())
+        self.assertIsNone(lazy._match_groups)
+        self.assertEqual(("um ", " en"), (lazy.pre_text, lazy.post_text))
+        lazy.release_match()
+        self.assertEqual((None, [("a", "12", 4, 6), ("b", None, -1, -1)]), (lazy._match, lazy.match_groups))
+
+        plain = PatternMatch("abc", 0, 3, match_groups=[("x", "abc", 0, 3)])
+        self.assertEqual((None, None, {"method": None, "x": "abc"}), (plain.pre_text, plain.post_text,
+                                                                     plain.attributes()))
+
+    def test_run_tests(self):
+        def outcome(results):
+            return [(r["TEST"], r["PASS"], summary(r["MATCHES"])) for r in results]
+
+        extractor = XTemporal(debug=True)
+        expected = outcome(extractor.default_tests())
+        self.assertTrue(expected)
+        json_report = os.path.join(self.tmpdir, "tests.json")
+        results = extractor.run_tests(workers=2, slow=60, report=json_report)
+        self.assertEqual(expected, outcome(results))
+        self.assertFalse([r for r in results if r["SLOW"] or r["SECONDS"] < 0])
+        with open(json_report, "r", encoding="UTF-8") as fh:
+            report = json.load(fh)
+        self.assertEqual([(r["TEST"], r["PASS"]) for r in results], [(r["test"], r["pass"]) for r in report])
+        self.assertEqual([m.text for m in results[0]["MATCHES"]], [m["text"] for m in report[0]["matches"]])
+
+        junit_report = os.path.join(self.tmpdir, "tests.xml")
+        results = extractor.run_tests(workers=1, slow=0, report=junit_report, report_format="junit")
+        self.assertEqual(expected, outcome(results))
+        suite = ElementTree.parse(junit_report).getroot()
+        self.assertEqual(str(len(results)), suite.get("tests"))
+        self.assertEqual(len(results), int(suite.get("failures")))
+        failed = {r["TEST"] for r in results if not r["PASS"]}
+        for case, result in zip(suite.iter("testcase"), results):
+            self.assertEqual(result["TEST"], case.get("name"))
+            self.assertEqual("match" if result["TEST"] in failed else "slow", case.find("failure").get("type"))
+
+        self.assertRaises(Exception, extractor.run_tests, report_format="csv")
+
+    def test_extract_many(self):
+        extractor = XTemporal(debug=True)
+        texts = sample_texts(extractor)
+        texts.insert(3, None)
+        expected = [summary(extractor.extract(text)) if text else None for text in texts]
+        for executor, workers in [("process", 3), ("thread", 3), ("process", 1)]:
+            results = list(extractor.extract_many(iter(texts), workers=workers, executor=executor, batch_size=4))
+            self.assertEqual(len(texts), len(results))
+            self.assertEqual(expected, [summary(matches) if matches is not None else None
+                                        for matches, error in results])
+            # Failure on one text is reported with it
+            self.assertEqual([3], [i for i, (matches, error) in enumerate(results) if error])
+            self.assertIn("TypeError", results[3][1])
+
+        found = extractor.extract_many(["on 2020-01-01", "none"], workers=2, features=["YMD"])
+        self.assertEqual([["YMD-01"], []], [[m.pattern_id for m in matches] for matches, error in found])
+
+    def test_extract_stream(self):
+        for extractor in [XCoord(debug=True), XTemporal(debug=True)]:
+            text = " filler text here. ".join(sample_texts(extractor)[0:-1]) * 3
+            expected = sorted(summary(extractor.extract(text)))
+            for chunk_size, overlap in [(200, 80), (1000, 100), (len(text) * 2, 100)]:
+                found = list(extractor.extract_stream(io.StringIO(text), chunk_size=chunk_size, overlap=overlap))
+                self.assertEqual(expected, sorted(summary(found)))
+                for m in found:
+                    self.assertEqual(m.text, text[m.start:m.end])
+                    for slot, value, x1, x2 in m.match_groups:
+                        if x1 >= 0:
+                            self.assertEqual(value, text[x1:x2])
+            # Iterable of lines
+            lines = io.StringIO(text).readlines()
+            self.assertEqual(expected, sorted(summary(extractor.extract_stream(lines, chunk_size=300, overlap=100))))
+
+        self.assertRaises(Exception, list, extractor.extract_stream("text"))
+        self.assertEqual([], list(extractor.extract_stream(io.StringIO(""))))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,7 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import pickle
+from random import Random
 from unittest import TestCase, main
-from opensextant import geohash_encode, geohash_neighbors, geohash_cells, radial_geohash, geohash_cells_radially
+
+from pygeodesy import geohash as pygeohash
+
+import opensextant
+from opensextant import geohash, Coordinate, Place
+from opensextant import geohash_encode, geohash_neighbors, geohash_cells, radial_geohash, geohash_cells_radially, \
+    distance_haversine, distance_cartesian, distance_haversine_many, distance_haversine_pairwise, \
+    distance_haversine_matrix, distance_cartesian_many, distance_cartesian_pairwise, distance_cartesian_matrix
 
 
 def print_cells(lat, lon):
@@ -51,6 +60,78 @@ class TestSpatialQuery(TestCase):
         # Additionally, the length of proposed cells here will vary based on radius.
         self.assertEqual(4, len(cells.get("NW")))
 
+    def test_geohash_engine(self):
+        # Built-in geohash must agree with pygeodesy, including points on cell edges and poles.
+        rnd = Random(5)
+        points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(500)]
+        points.extend([(0.0, 0.0), (90.0, 180.0), (-90.0, -180.0), (-1e-20, -1e-20), (45.0, 90.0), (22.5, 11.25)])
+        for lat, lon in points:
+            for prec in [None, 1, 2, 5, 6, 8, 11, 12]:
+                self.assertEqual(pygeohash.encode(lat, lon, precision=prec), geohash.encode(lat, lon, precision=prec))
+            gh = pygeohash.encode(lat, lon, precision=rnd.randint(1, 12))
+            self.assertEqual(pygeohash.decode(gh), geohash.decode(gh))
+            self.assertEqual(tuple(pygeohash.bounds(gh)), geohash.bounds(gh))
+            self.assertEqual({k: str(v) for k, v in pygeohash.neighbors(gh).items()}, geohash.neighbors(gh))
+            self.assertEqual(tuple(float(x) for x in pygeohash.decode(gh)), opensextant.geohash2point(gh))
+
+        lats, lons = [p[0] for p in points], [p[1] for p in points]
+        cells = geohash.encode_many(lats, lons, precision=7)
+        self.assertEqual([pygeohash.encode(y, x, precision=7) for y, x in points], cells)
+        self.assertEqual([geohash.decode2(gh) for gh in cells], geohash.decode_many(cells))
+        self.assertRaises(ValueError, geohash.encode, 91, 0)
+
+    def test_distance_arrays(self):
+        rnd = Random(1)
+        lons1 = [rnd.uniform(-180, 180) for _ in range(50)]
+        lats1 = [rnd.uniform(-90, 90) for _ in range(50)]
+        lons2 = [rnd.uniform(-180, 180) for _ in range(50)]
+        lats2 = [rnd.uniform(-90, 90) for _ in range(50)]
+
+        numpy_mod = opensextant.np
+        try:
+            for np_setting in [numpy_mod, None]:
+                opensextant.np = np_setting
+                # Same meters as the scalar function, with or without NumPy.
+                expected = [distance_haversine(lons1[0], lats1[0], x, y) for x, y in zip(lons2, lats2)]
+                self.assertEqual(expected, list(distance_haversine_many(lons1[0], lats1[0], lons2, lats2)))
+
+                expected = [distance_haversine(*args) for args in zip(lons1, lats1, lons2, lats2)]
+                self.assertEqual(expected, list(distance_haversine_pairwise(lons1, lats1, lons2, lats2)))
+
+                matrix = distance_haversine_matrix(lons1[0:5], lats1[0:5], lons2, lats2)
+                self.assertEqual(5, len(matrix))
+                for i in range(5):
+                    expected = [distance_haversine(lons1[i], lats1[i], x, y) for x, y in zip(lons2, lats2)]
+                    self.assertEqual(expected, list(matrix[i]))
+
+                expected = [distance_cartesian(lons1[0], lats1[0], x, y) for x, y in zip(lons2, lats2)]
+                self.assertEqual(len(expected), len(distance_cartesian_many(lons1[0], lats1[0], lons2, lats2)))
+                for d1, d2 in zip(expected, distance_cartesian_many(lons1[0], lats1[0], lons2, lats2)):
+                    self.assertAlmostEqual(d1, d2)
+                expected = [distance_cartesian(*args) for args in zip(lons1, lats1, lons2, lats2)]
+                for d1, d2 in zip(expected, distance_cartesian_pairwise(lons1, lats1, lons2, lats2)):
+                    self.assertAlmostEqual(d1, d2)
+                matrix = distance_cartesian_matrix(lons1[0:5], lats1[0:5], lons2, lats2)
+                self.assertAlmostEqual(distance_cartesian(lons1[4], lats1[4], lons2[7], lats2[7]), matrix[4][7])
+        finally:
+            opensextant.np = numpy_mod
+
+    def test_coordinate_slots(self):
+        pl = Place("G1", "Boston", lat="42.36", lon="-71.06")
+        self.assertFalse(hasattr(pl, "__dict__"))
+        self.assertEqual((42.36, -71.06), (pl.Y, pl.X))
+        self.assertEqual((42.36, -71.06), pl.get_location())
+        pl.X = 10.0
+        self.assertEqual(10.0, pl.lon)
+        self.assertRaises(AttributeError, setattr, pl, "no_such_attribute", 1)
+
+        copy = pickle.loads(pickle.dumps(pl))
+        self.assertEqual(("G1", "Boston", 42.36, 10.0), (copy.place_id, copy.name, copy.lat, copy.lon))
+
+        pl.lat = None
+        self.assertFalse(pl.has_coordinate())
+        self.assertEqual("unset", str(Coordinate(None)))
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,8 +1,11 @@
 import copy
 import os
 import unittest
+from datetime import datetime
+from random import Random
 
-from opensextant.extractors.xtemporal import XTemporal
+from opensextant.extractors import xtemporal
+from opensextant.extractors.xtemporal import XTemporal, normalize_tz
 from opensextant.utility import get_csv_writer, ensure_dirs
 
 
@@ -23,6 +26,44 @@ class TestXTemporal(unittest.TestCase):
                 print(date_match.text, result, "Expected", expected)
                 self.assertEqual(expected, result)
 
+    def test_date_fast_path(self):
+        zones = [None] + [normalize_tz({"SHORT_TZ": "Z"})] + \
+                [normalize_tz({"LONG_TZ": tz}) for tz in ["EST", "GMT", "CET", "MST", "EET", "WET", "HST", "UTC"]]
+        self.assertIsNone(normalize_tz({"LONG_TZ": "XXX"}))
+        self.assertIsNone(normalize_tz({"SHORT_TZ": "z"}))
+        zones.extend([normalize_tz({"SHORT_TZ": tz}) for tz in ["+0530", "-0345", "+1400"]])
+        # Same zones as parsed with arrow before
+        for tz, fmt in [("Z", "Z"), ("+0530", "Z"), ("-04", "Z"), ("z", "Z"), ("EST", "ZZZ"), ("UTC", "ZZZ"),
+                        ("PRC", "ZZZ"), ("CET", "ZZZ"), ("XXX", "ZZZ"), ("PST", "ZZZ")]:
+            try:
+                before = xtemporal.arrow.get(tz, fmt)
+            except Exception:
+                before = None
+            after = xtemporal._parse_tz(tz, fmt)
+            if before is None:
+                self.assertIsNone(after)
+                continue
+            self.assertEqual(before.format("ZZZ"), xtemporal._tzname(after))
+            for dt in [datetime(2021, 1, 1), datetime(2021, 7, 1)]:
+                self.assertEqual(before.tzinfo.utcoffset(dt), after.utcoffset(dt))
+        rnd = Random(1)
+        for i in range(5000):
+            ymd = (rnd.randint(1, 2039), rnd.randint(1, 12), rnd.randint(1, 28))
+            tm = None
+            if i % 4:
+                tm = (rnd.randint(0, 23), rnd.randint(0, 59), rnd.choice([-1, rnd.randint(0, 59)]), "s")
+            tz = rnd.choice(zones) if tm else None
+            self.assertEqual(xtemporal._arrow_date_attrs(*ymd, tm, tz), xtemporal._date_attrs(*ymd, tm, tz))
+
+        datex = XTemporal(debug=True)
+        texts = [t.text for t in datex.pattern_manager.test_cases]
+        arrow_datex = XTemporal(use_arrow=True)
+        found = [m for t in texts for m in arrow_datex.extract(t)]
+        self.assertTrue(all(isinstance(m, xtemporal.ArrowDateTimeMatch) for m in found))
+        expected = [(m.text, m.filtered_out, m.attrs) for m in found]
+        self.assertTrue([attrs for text, filtered, attrs in expected if "tzinfo" in attrs])
+        self.assertEqual(expected, [(m.text, m.filtered_out, m.attrs) for t in texts for m in datex.extract(t)])
+
     def test_full_run(self):
         print("Run Default Tests")
 